@@ -0,0 +1,112 @@
+"""
+Compare the buffering GzipMiddleware with the StreamingGzipMiddleware on a
+large response.
+
+Each middleware runs in its own subprocess so that peak memory use (the
+process's max RSS) is measured independently. Run from the src directory:
+
+    python -m benchmarks.gzip_middleware [--size-mb 5] [--chunk-kb 64]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+IMPLEMENTATIONS = ('GzipMiddleware', 'StreamingGzipMiddleware')
+
+
+def max_rss_kb():
+    # ru_maxrss is in kilobytes on Linux (and in bytes on OS X).
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        usage //= 1024
+    return usage
+
+
+def make_app(size, chunk_size):
+    """A WSGI app that yields `size` bytes of HTML-ish text, generating each
+    chunk as it goes so that the app itself holds little in memory."""
+    line = b'<li class="event"><a href="/event/1">An upcoming event</a></li>\n'
+    lines_per_chunk = max(1, chunk_size // len(line))
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
+        remaining = size
+        while remaining > 0:
+            chunk = (line * lines_per_chunk)[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+    return app
+
+
+def run_one(name, size, chunk_size):
+    from planbox import gzip_middleware
+
+    middleware = getattr(gzip_middleware, name)
+    app = middleware(make_app(size, chunk_size))
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    baseline_rss = max_rss_kb()
+    start = time.time()
+    first_byte = None
+    body_size = 0
+
+    response = app(environ, start_response)
+    try:
+        for chunk in response:
+            if chunk and first_byte is None:
+                first_byte = time.time()
+            body_size += len(chunk)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    end = time.time()
+
+    return {
+        'implementation': name,
+        'ttfb_ms': (first_byte - start) * 1000,
+        'total_ms': (end - start) * 1000,
+        'peak_rss_delta_kb': max_rss_kb() - baseline_rss,
+        'compressed_bytes': body_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size-mb', type=float, default=5)
+    parser.add_argument('--chunk-kb', type=int, default=64)
+    parser.add_argument('--run', choices=IMPLEMENTATIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    chunk_size = args.chunk_kb * 1024
+
+    if args.run:
+        print(json.dumps(run_one(args.run, size, chunk_size)))
+        return
+
+    print('Response size: %s bytes in %s byte chunks' % (size, chunk_size))
+    print('%-24s %10s %10s %16s %12s' % (
+        'implementation', 'ttfb ms', 'total ms', 'peak rss +KB', 'gz bytes'))
+    for name in IMPLEMENTATIONS:
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.gzip_middleware',
+            '--size-mb', str(args.size_mb), '--chunk-kb', str(args.chunk_kb),
+            '--run', name])
+        result = json.loads(output.decode('utf-8'))
+        print('%-24s %10.1f %10.1f %16d %12d' % (
+            name, result['ttfb_ms'], result['total_ms'],
+            result['peak_rss_delta_kb'], result['compressed_bytes']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare cloning a large template project one object at a time (the old
+clone_related implementations) with the bulk tree clone in
+planbox_data.cloning.
+
+Run from the src directory:
+
+    python -m benchmarks.project_clone [--events 20] [--attachments 5] [--sections 50] [--clones 5]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+from benchmarks.utils import setup_django, test_database, count_queries, timed
+
+
+def old_clone(obj, overrides=None):
+    # CloneableModelMixin.clone, ModelWithSlugMixin.clone, and the
+    # clone_related methods of Project and Event, before the bulk tree clone.
+    from planbox_data.models import ModelWithSlugMixin, clone_pre_save, uniquify_slug
+
+    fields = obj._meta.fields
+    ignore_field_names = obj.get_ignore_fields(obj.__class__)
+    inst_kwargs = dict((fld.name, getattr(obj, fld.name)) for fld in fields
+                       if fld.name not in ignore_field_names)
+    inst_kwargs.update(overrides or {})
+
+    new_inst = obj.__class__(**inst_kwargs)
+    clone_pre_save.send(sender=obj.__class__, orig_inst=obj, new_inst=new_inst)
+    if isinstance(obj, ModelWithSlugMixin):
+        # The old allocator loaded every sibling's slug
+        new_inst.slug = uniquify_slug(obj.slug, [o.slug for o in new_inst.get_slug_queryset()])
+    new_inst.save()
+
+    for relation_name in obj.cloned_relations:
+        related_manager = getattr(obj, relation_name)
+        field = obj._meta.get_field_by_name(relation_name)[0]
+        parent_field = 'attached_to' if relation_name == 'attachments' else field.field.name
+        for related in related_manager.all():
+            old_clone(related, {parent_field: new_inst})
+
+    return new_inst
+
+
+def build_template(num_events, num_attachments, num_sections):
+    from planbox_data.models import Profile, Project, Event, Section, Attachment
+
+    owner = Profile.objects.create(slug='benchmark-templates')
+    project = Project.objects.create(slug='template', title='Template', location='Anywhere', owner=owner)
+
+    details = {'content': '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 40)}
+    for i in range(num_events):
+        event = Event.objects.create(project=project, slug='event-%s' % i, label='Event %s' % i, index=i)
+        for j in range(num_attachments):
+            Attachment.objects.create(attached_to=event, url='http://example.com/%s/%s' % (i, j), index=j)
+    for i in range(num_sections):
+        Section.objects.create(project=project, type='text', slug='section-%s' % i, details=details, index=i)
+
+    return project
+
+
+def run_clones(clone, project, owners):
+    with count_queries() as queries:
+        results, elapsed = timed(lambda: [clone(project, {'owner': owner}) for owner in owners])
+    return results, elapsed / len(owners), queries['queries'] // len(owners)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--attachments', type=int, default=5)
+    parser.add_argument('--sections', type=int, default=50)
+    parser.add_argument('--clones', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from planbox_data.models import Profile
+
+    with test_database():
+        project = build_template(args.events, args.attachments, args.sections)
+        owners = [Profile.objects.create(slug='owner-%s' % i) for i in range(2 * args.clones)]
+
+        old_results, old_ms, old_queries = run_clones(old_clone, project, owners[:args.clones])
+        new_results, new_ms, new_queries = run_clones(
+            lambda project, overrides: project.clone(overrides=overrides), project, owners[args.clones:])
+
+        for old, new in zip(old_results, new_results):
+            assert old.events.count() == new.events.count()
+            assert old.sections.count() == new.sections.count()
+
+        print('%s events with %s attachments each, %s sections; %s clones' % (
+            args.events, args.attachments, args.sections, args.clones))
+        print('%-28s %12s %10s' % ('implementation', 'ms / clone', 'queries'))
+        print('%-28s %12.1f %10d' % ('one object at a time', old_ms, old_queries))
+        print('%-28s %12.1f %10d' % ('bulk tree clone', new_ms, new_queries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure how long the server takes to pre-render a project page body, by
+section type, and for the whole body, rendered and from the cache.
+
+Run from the src directory:
+
+    python -m benchmarks.project_prerender [--events 30] [--renders 50]
+"""
+
+from __future__ import print_function
+
+import argparse
+from benchmarks.utils import setup_django, test_database, timed
+
+
+def build_project(num_events):
+    from django.contrib.auth.models import User as UserAuth
+    from planbox_data.models import Project, Section, Event, Attachment
+
+    auth = UserAuth.objects.create_user(username='owner', password='123')
+    project = Project.objects.create(
+        slug='big-project', title='Big project', location='Philadelphia',
+        owner=auth.profile, public=True, details={'tagline': 'A big project'})
+
+    paragraph = '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 40)
+    sections = [
+        ('timeline', {}),
+        ('text', {'content': paragraph * 3}),
+        ('image', {'img_url': 'https://example.com/image.png'}),
+        ('faqs', [{'question': 'Question %s?' % n, 'answer': paragraph} for n in range(10)]),
+        ('shareabouts', {'dataset_url': 'https://example.com/datasets/ideas'}),
+        ('raw', {'content': '<iframe src="https://example.com/video"></iframe>'}),
+    ]
+    for index, (section_type, details) in enumerate(sections):
+        Section.objects.create(
+            project=project, type=section_type, slug=section_type,
+            label=section_type.title(), menu_label=section_type.title(),
+            details=details, index=index, active=True)
+
+    for index in range(num_events):
+        event = Event.objects.create(
+            project=project, slug='event-%s' % index, label='Event %s' % index,
+            description=paragraph, datetime_label='Some day',
+            details={'tags': ['tag-%s' % (index % 5)]}, index=index)
+        for attachment_index in range(2):
+            Attachment.objects.create(
+                attached_to=event, label='Attachment %s' % attachment_index,
+                url='https://example.com/attachment.pdf', index=attachment_index)
+
+    return project
+
+
+def time_renders(render, count):
+    _, elapsed = timed(lambda: [render() for _ in range(count)])
+    return elapsed / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--events', type=int, default=30)
+    parser.add_argument('--renders', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.utils.timezone import localtime, now
+    from planbox_data import documents
+    from planbox_ui import prerender
+
+    with test_database():
+        project = build_project(args.events)
+        project_data = documents.get_project_data(project)
+        template_data = prerender.to_template_data(project_data)
+        today = localtime(now()).date()
+
+        # Compile the templates before timing anything.
+        prerender.render_project_body(project_data, today)
+
+        print('%s events, %s renders each' % (args.events, args.renders))
+        print('%-28s %12s %12s' % ('render', 'ms / render', 'bytes'))
+
+        for section in template_data['sections']:
+            render_section = prerender.SECTION_RENDERERS[section['type']]
+            html = render_section(section, template_data, today)
+            ms = time_renders(lambda: render_section(section, template_data, today), args.renders)
+            print('%-28s %12.2f %12d' % ('%s section' % (section['type'],), ms, len(html)))
+
+        html = prerender.render_project_body(project_data, today)
+        ms = time_renders(lambda: prerender.render_project_body(project_data, today), args.renders)
+        print('%-28s %12.2f %12d' % ('whole body', ms, len(html)))
+
+        cache.clear()
+        prerender.get_prerendered_project(project, project_data)
+        ms = time_renders(lambda: prerender.get_prerendered_project(project, project_data), args.renders)
+        print('%-28s %12.2f %12d' % ('whole body, cached', ms, len(html)))
+
+
+if __name__ == '__main__':
+    main()
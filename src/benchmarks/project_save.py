@@ -0,0 +1,101 @@
+"""
+Compare the latency of saving a change to one section of a project by PUTting
+the whole project document with PATCHing just that section through the nested
+section endpoint.
+
+Run from the src directory:
+
+    python -m benchmarks.project_save [--sections 50] [--saves 20]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+from benchmarks.utils import setup_django, test_database, count_queries, timed
+
+
+def build_project(num_sections, num_events=20):
+    from django.contrib.auth.models import User as UserAuth
+    from planbox_data.models import Project, Section, Event
+
+    auth = UserAuth.objects.create_user(username='owner', password='123')
+    project = Project.objects.create(
+        slug='big-project', title='Big project', location='Philadelphia',
+        owner=auth.profile, public=True)
+
+    details = {'content': '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 40)}
+    for index in range(num_sections):
+        Section.objects.create(
+            project=project, type='text', slug='section-%s' % index,
+            label='Section %s' % index, menu_label='Section %s' % index,
+            details=details, index=index)
+    timeline = project.sections.filter(slug='section-0').get()
+    timeline.type = 'timeline'
+    timeline.save()
+
+    for index in range(num_events):
+        Event.objects.create(
+            project=project, slug='event-%s' % index, label='Event %s' % index,
+            description='Something happens.', index=index)
+
+    return project
+
+
+def run_saves(save, count):
+    with count_queries() as queries:
+        responses, elapsed = timed(lambda: [save(n) for n in range(count)])
+    for response in responses:
+        assert response.status_code == 200, response.content
+    return elapsed / count, queries['queries'] // count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sections', type=int, default=50)
+    parser.add_argument('--saves', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.urlresolvers import reverse
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+    with test_database():
+        project = build_project(args.sections)
+        section = project.sections.get(slug='section-%s' % (args.sections // 2))
+
+        client = Client()
+        client.login(username='owner', password='123')
+
+        project_url = reverse('project-detail', kwargs={'pk': project.pk})
+        document = json.loads(client.get(project_url).content.decode('utf-8'))
+
+        def put_project(n):
+            for section_data in document['sections']:
+                if section_data['id'] == section.pk:
+                    section_data['label'] = 'Label %s' % n
+            return client.put(project_url, data=json.dumps(document),
+                              content_type='application/json')
+
+        section_url = reverse('project-section-detail',
+                              kwargs={'project_pk': project.pk, 'pk': section.pk})
+
+        def patch_section(n):
+            return client.patch(section_url, data=json.dumps({'label': 'Label %s' % n}),
+                                content_type='application/json')
+
+        put_ms, put_queries = run_saves(put_project, args.saves)
+        patch_ms, patch_queries = run_saves(patch_section, args.saves)
+
+        print('%s sections, %s saves of a one-section change' % (args.sections, args.saves))
+        print('%-28s %12s %10s %12s' % ('endpoint', 'ms / save', 'queries', 'body bytes'))
+        print('%-28s %12.1f %10d %12d' % ('PUT whole project', put_ms, put_queries,
+                                          len(json.dumps(document))))
+        print('%-28s %12.1f %10d %12d' % ('PATCH one section', patch_ms, patch_queries,
+                                          len(json.dumps({'label': 'Label 0'}))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare allocating profile slugs by loading every slug in the table (the old
+get_all_slugs approach) with the prefix lookups in planbox_data.slugs, over a
+table of 100k profiles.
+
+Half of the new profiles have names that are not in use yet, and half have a
+name that is already shared by a run of teams. Run from the src directory:
+
+    python -m benchmarks.slug_allocation [--profiles 100000] [--allocations 20]
+"""
+
+from __future__ import print_function
+
+import argparse
+from benchmarks.utils import setup_django, test_database, count_queries, timed
+
+
+def old_allocate_slug(slug):
+    # The implementation of ModelWithSlugMixin.ensure_slug for profiles
+    # before the slug allocator.
+    from planbox_data.models import Profile, uniquify_slug
+    existing_slugs = set([p['slug'] for p in Profile.objects.all().values('slug')])
+    return uniquify_slug(slug, existing_slugs)
+
+
+def new_allocate_slug(slug):
+    from planbox_data.models import Profile
+    from planbox_data.slugs import allocate_slug
+    return allocate_slug(slug, Profile.objects.all())
+
+
+def build_profiles(num_profiles, num_shared=50):
+    from planbox_data.models import Profile
+
+    profiles = [Profile(slug='user-%s' % i) for i in range(num_profiles - num_shared)]
+    profiles.append(Profile(slug='planning-team'))
+    profiles.extend(Profile(slug='planning-team-%s' % i) for i in range(2, num_shared + 1))
+    Profile.objects.bulk_create(profiles)
+
+
+def run_allocations(allocate, slugs):
+    with count_queries() as queries:
+        results, elapsed = timed(lambda: [allocate(slug) for slug in slugs])
+    return results, elapsed, queries['queries']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--profiles', type=int, default=100000)
+    parser.add_argument('--allocations', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+
+    with test_database():
+        build_profiles(args.profiles)
+
+        slugs = ['new-team-%s' % i if i % 2 else 'planning-team'
+                 for i in range(args.allocations)]
+
+        old_results, old_ms, old_queries = run_allocations(old_allocate_slug, slugs)
+        new_results, new_ms, new_queries = run_allocations(new_allocate_slug, slugs)
+
+        assert old_results == new_results, 'Results differ between implementations'
+
+        print('%s profiles, %s slug allocations' % (args.profiles, args.allocations))
+        print('%-28s %12s %10s %12s' % ('implementation', 'total ms', 'queries', 'ms / slug'))
+        print('%-28s %12.1f %10d %12.2f' % ('all slugs (get_all_slugs)', old_ms, old_queries, old_ms / args.allocations))
+        print('%-28s %12.1f %10d %12.2f' % ('prefix lookup', new_ms, new_queries, new_ms / args.allocations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare the old recursive Profile.has_member with the membership closure
+query in planbox_data.membership, over a graph of 10k profiles.
+
+The graph has a tree of nested teams (each team is a member of a parent
+team) and users that belong to one or two teams each. Run from the src
+directory:
+
+    python -m benchmarks.team_membership [--profiles 10000] [--checks 20]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+from benchmarks.utils import setup_django, test_database, count_queries, timed
+
+
+def old_has_member(team, user):
+    # The implementation of Profile.has_member before the closure query.
+    members = list(team.members.all())
+    if user.id in [profile.auth_id for profile in members]:
+        return True
+    else:
+        return any(old_has_member(profile, user) for profile in members)
+
+
+def build_graph(num_profiles, branching=10, team_fraction=0.1):
+    from django.contrib.auth.models import User as UserAuth
+    from planbox_data.models import Profile
+
+    Membership = Profile.teams.through
+    num_teams = int(num_profiles * team_fraction)
+    num_users = num_profiles - num_teams
+
+    Profile.objects.bulk_create([
+        Profile(slug='team-%s' % i, name='Team %s' % i)
+        for i in range(num_teams)])
+    team_ids = list(Profile.objects.filter(slug__startswith='team-')
+                    .order_by('id').values_list('id', flat=True))
+
+    UserAuth.objects.bulk_create([
+        UserAuth(username='user-%s' % i) for i in range(num_users)])
+    auth_ids = list(UserAuth.objects.order_by('id').values_list('id', flat=True))
+    Profile.objects.bulk_create([
+        Profile(slug='user-%s' % i, auth_id=auth_id)
+        for i, auth_id in enumerate(auth_ids)])
+    user_profile_ids = list(Profile.objects.filter(auth__isnull=False)
+                            .order_by('id').values_list('id', flat=True))
+
+    # Nest the teams in a tree: team i is a member of team (i - 1) / branching.
+    memberships = [
+        Membership(from_profile_id=team_ids[i], to_profile_id=team_ids[(i - 1) // branching])
+        for i in range(1, num_teams)]
+
+    # Put each user in one or two teams.
+    rng = random.Random(1)
+    for profile_id in user_profile_ids:
+        for team_id in set(rng.sample(team_ids, rng.randint(1, 2))):
+            memberships.append(Membership(from_profile_id=profile_id, to_profile_id=team_id))
+    Membership.objects.bulk_create(memberships)
+
+    return team_ids, auth_ids
+
+
+def run_checks(check, pairs):
+    with count_queries() as queries:
+        results, elapsed = timed(lambda: [check(team, user) for team, user in pairs])
+    return results, elapsed, queries['queries']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--profiles', type=int, default=10000)
+    parser.add_argument('--checks', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User as UserAuth
+    from planbox_data.models import Profile
+
+    with test_database():
+        team_ids, auth_ids = build_graph(args.profiles)
+
+        rng = random.Random(2)
+        # Check against teams near the top of the tree, where the old
+        # implementation has the most to walk.
+        teams = list(Profile.objects.filter(id__in=team_ids[:11]))
+        pairs = [(rng.choice(teams), UserAuth.objects.get(id=rng.choice(auth_ids)))
+                 for _ in range(args.checks)]
+
+        def fresh_pairs():
+            # New user objects, so that nothing is memoized yet
+            return [(team, UserAuth(id=user.id)) for team, user in pairs]
+
+        old_results, old_ms, old_queries = run_checks(old_has_member, fresh_pairs())
+        new_results, new_ms, new_queries = run_checks(
+            lambda team, user: team.has_member(user), fresh_pairs())
+
+        # Every check for the same user, as in a single request
+        one_user = UserAuth(id=pairs[0][1].id)
+        _, memo_ms, memo_queries = run_checks(
+            lambda team, user: team.has_member(user),
+            [(team, one_user) for team, _ in pairs])
+
+        assert old_results == new_results, 'Results differ between implementations'
+
+        print('%s profiles, %s membership checks (%s positive)' % (
+            args.profiles, args.checks, sum(new_results)))
+        print('%-28s %12s %10s' % ('implementation', 'total ms', 'queries'))
+        print('%-28s %12.1f %10d' % ('recursive has_member', old_ms, old_queries))
+        print('%-28s %12.1f %10d' % ('closure query', new_ms, new_queries))
+        print('%-28s %12.1f %10d' % ('closure query, one user', memo_ms, memo_queries))
+
+
+if __name__ == '__main__':
+    main()
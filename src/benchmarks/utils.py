@@ -0,0 +1,49 @@
+"""
+Helpers for benchmarks that need Django and a database.
+
+Benchmarks run against a throwaway test database (created the same way the
+test runner creates one), so they never touch real data. Use the settings
+module in DJANGO_SETTINGS_MODULE, or planbox.settings by default.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'planbox.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create a test database for the duration of the block."""
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run in the block; the count is in result['queries']."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    result = {}
+    with CaptureQueriesContext(connection) as context:
+        yield result
+    result['queries'] = len(context.captured_queries)
+
+
+def timed(func, *args, **kwargs):
+    """Call func, and return its result along with the time taken in ms."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, (time.time() - start) * 1000
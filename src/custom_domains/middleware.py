@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.http import Http404
-from custom_domains.models import DomainMapping, DefaultDomainMapping
+from custom_domains.models import DefaultDomainMapping
+from custom_domains.resolver import resolver
 
 
 class CustomDomainResolvingMiddleware(object):
@@ -13,10 +14,10 @@ class CustomDomainResolvingMiddleware(object):
             request.actual_path_info = request.path_info
             return
 
-        # If the domain is implicit, check that it's valid.
-        try:
-            mapping = DomainMapping.objects.get(domain=domain)
-        except DomainMapping.DoesNotExist:
+        # If the domain is implicit, check that it's valid. The resolver holds
+        # all of the mappings in memory, so this doesn't hit the database.
+        mapping = resolver.resolve(domain)
+        if mapping is None:
             raise Http404
 
         # Finally, stick the valid mapping on the request, and reassign the
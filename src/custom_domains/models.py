@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext as _
 
@@ -50,4 +51,12 @@ class DomainMapping (BaseDomainMappingMixin, models.Model):
 class DefaultDomainMapping (BaseDomainMappingMixin):
     def __init__(self, domain):
         self.domain = domain
-        self.root_path = '/'
\ No newline at end of file
+        self.root_path = '/'
+
+
+def invalidate_domain_mappings(sender, instance, **kwargs):
+    from custom_domains.resolver import resolver
+    resolver.invalidate()
+
+post_save.connect(invalidate_domain_mappings, sender=DomainMapping, dispatch_uid="domain-mapping-save-signal")
+post_delete.connect(invalidate_domain_mappings, sender=DomainMapping, dispatch_uid="domain-mapping-delete-signal")
@@ -0,0 +1,116 @@
+"""
+An in-process cache of the DomainMapping table.
+
+Every request on a custom domain needs its mapping, so rather than querying
+for it each time, each process holds the whole (small) table in memory and
+resolves hosts from a dict. Since the whole table is held, a host that is not
+in the dict has no mapping, so lookups for unknown hosts don't touch the
+database either.
+
+Mappings may be for exact domains (e.g., www.example.com) or for wildcard
+subdomains (e.g., *.example.com, which matches a.example.com and
+b.a.example.com, but not example.com). Exact matches win, followed by the
+longest matching wildcard suffix.
+
+The table is reloaded when it is older than the TTL, or when another process
+has changed a mapping. Saving or deleting a DomainMapping bumps a generation
+counter in the Django cache (see the signal handlers in
+custom_domains.models), and each process checks that counter at most once
+every few seconds.
+"""
+
+from __future__ import unicode_literals
+
+import time
+from django.conf import settings
+from django.core.cache import cache
+from custom_domains.models import DomainMapping
+
+
+GENERATION_KEY = 'planbox:domain-mappings:generation'
+
+
+def normalize_domain(domain):
+    return domain.strip().lower().rstrip('.')
+
+
+class DomainMappingResolver (object):
+    def __init__(self, ttl=None, check_interval=None):
+        self.ttl = (ttl if ttl is not None else
+                    getattr(settings, 'DOMAIN_MAPPING_CACHE_TTL', 5 * 60))
+        self.check_interval = (check_interval if check_interval is not None else
+                               getattr(settings, 'DOMAIN_MAPPING_CHECK_INTERVAL', 5))
+        self.clear()
+
+    def clear(self):
+        # The state is kept in a single tuple, so that a reload in one greenlet
+        # or thread is seen all at once by the others.
+        self._state = None
+        self._checked_at = 0
+
+    def get_generation(self):
+        return cache.get(GENERATION_KEY)
+
+    def load(self):
+        generation = self.get_generation()
+        exact, wildcards = {}, {}
+        for mapping in DomainMapping.objects.all():
+            domain = normalize_domain(mapping.domain)
+            if domain.startswith('*.'):
+                wildcards[domain[2:]] = mapping
+            else:
+                exact[domain] = mapping
+
+        now = time.time()
+        self._state = (exact, wildcards, generation, now)
+        self._checked_at = now
+        return self._state
+
+    def get_state(self):
+        state = self._state
+        if state is None:
+            return self.load()
+
+        exact, wildcards, generation, loaded_at = state
+        now = time.time()
+        if now - loaded_at > self.ttl:
+            return self.load()
+
+        if now - self._checked_at > self.check_interval:
+            self._checked_at = now
+            if self.get_generation() != generation:
+                return self.load()
+
+        return state
+
+    def resolve(self, domain):
+        """
+        Get the DomainMapping for the given host, or None if there is none.
+        """
+        exact, wildcards, _, _ = self.get_state()
+        domain = normalize_domain(domain)
+
+        mapping = exact.get(domain)
+        if mapping is not None or not wildcards:
+            return mapping
+
+        labels = domain.split('.')
+        for index in range(1, len(labels)):
+            mapping = wildcards.get('.'.join(labels[index:]))
+            if mapping is not None:
+                return mapping
+        return None
+
+    def invalidate(self):
+        """
+        Drop this process's copy of the table, and tell the other processes to
+        drop theirs.
+        """
+        self.clear()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, int(time.time() * 1000), None)
+
+
+resolver = DomainMappingResolver()
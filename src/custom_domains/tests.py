@@ -1,9 +1,11 @@
+from django.core.cache import cache
 from django.http import Http404
 from django.test import TestCase, RequestFactory
 from django.test.utils import override_settings
 from custom_domains.context_processors import StaticContextProcessor
 from custom_domains.middleware import CustomDomainResolvingMiddleware
 from custom_domains.models import DomainMapping, DefaultDomainMapping
+from custom_domains.resolver import DomainMappingResolver, resolver, GENERATION_KEY
 
 
 class StaticContextProcessorTests (TestCase):
@@ -51,9 +53,11 @@ class StaticContextProcessorTests (TestCase):
 class CustomDomainMiddlewareTests (TestCase):
     def setUp(self):
         self.factory = RequestFactory()
+        resolver.clear()
 
     def tearDown(self):
         DomainMapping.objects.all().delete()
+        resolver.clear()
 
     def test_default_mapping_is_used_for_known_host(self):
         request = self.factory.get('/root/path')
@@ -85,3 +89,69 @@ class CustomDomainMiddlewareTests (TestCase):
 
         with self.assertRaises(Http404):
             middleware.process_request(request)
+
+    @override_settings()
+    def test_lookups_do_not_hit_the_database_once_mappings_are_loaded(self):
+        DomainMapping.objects.create(domain='www.registeredserver.com', root_path='/root')
+        middleware = CustomDomainResolvingMiddleware()
+
+        request = self.factory.get('/path')
+        request.META['HTTP_HOST'] = 'www.registeredserver.com'
+        with self.assertNumQueries(1):
+            middleware.process_request(request)
+
+        request = self.factory.get('/path')
+        request.META['HTTP_HOST'] = 'www.registeredserver.com'
+        with self.assertNumQueries(0):
+            middleware.process_request(request)
+
+        request = self.factory.get('/path')
+        request.META['HTTP_HOST'] = 'www.unknownserver.com'
+        with self.assertNumQueries(0):
+            with self.assertRaises(Http404):
+                middleware.process_request(request)
+
+
+class DomainMappingResolverTests (TestCase):
+    def setUp(self):
+        cache.delete(GENERATION_KEY)
+        self.resolver = DomainMappingResolver(ttl=60, check_interval=0)
+
+    def tearDown(self):
+        DomainMapping.objects.all().delete()
+
+    def test_wildcard_mappings_match_subdomains(self):
+        wildcard = DomainMapping.objects.create(domain='*.example.org', root_path='/wild')
+        specific = DomainMapping.objects.create(domain='*.b.example.org', root_path='/b')
+        exact = DomainMapping.objects.create(domain='a.example.org', root_path='/a')
+
+        self.assertEqual(self.resolver.resolve('a.example.org').pk, exact.pk)
+        self.assertEqual(self.resolver.resolve('c.example.org').pk, wildcard.pk)
+        self.assertEqual(self.resolver.resolve('C.Example.org').pk, wildcard.pk)
+        self.assertEqual(self.resolver.resolve('c.b.example.org').pk, specific.pk)
+        self.assertIsNone(self.resolver.resolve('example.org'))
+        self.assertIsNone(self.resolver.resolve('example.com'))
+
+    def test_saving_and_deleting_mappings_invalidates_other_resolvers(self):
+        self.assertIsNone(self.resolver.resolve('www.example.com'))
+
+        mapping = DomainMapping.objects.create(domain='www.example.com', root_path='/root')
+        self.assertEqual(self.resolver.resolve('www.example.com').root_path, '/root')
+
+        mapping.root_path = '/other-root'
+        mapping.save()
+        self.assertEqual(self.resolver.resolve('www.example.com').root_path, '/other-root')
+
+        mapping.delete()
+        self.assertIsNone(self.resolver.resolve('www.example.com'))
+
+    def test_generation_is_only_checked_every_check_interval(self):
+        resolver = DomainMappingResolver(ttl=60, check_interval=60)
+        self.assertIsNone(resolver.resolve('www.example.com'))
+
+        DomainMapping.objects.create(domain='www.example.com', root_path='/root')
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolver.resolve('www.example.com'))
+
+        resolver.clear()
+        self.assertEqual(resolver.resolve('www.example.com').root_path, '/root')
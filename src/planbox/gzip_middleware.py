@@ -1,6 +1,8 @@
 from gzip import GzipFile
+from itertools import chain
 from wsgiref.headers import Headers
 import re
+import zlib
 
 try:
     # Python 2
@@ -106,3 +108,192 @@ class GzipMiddleware(object):
         # Send the headers and the contents
         start_response(app_response['status'], app_response['headers'])
         return [gzipped_response]
+
+
+# Content types that are already compressed, and so are not worth gzipping.
+# Types are matched by prefix, so 'image/' covers all images; anything listed
+# in ALWAYS_COMPRESSIBLE_TYPES is compressed anyway.
+DEFAULT_SKIP_TYPES = (
+    'image/',
+    'audio/',
+    'video/',
+    'font/woff',
+    'application/font-woff',
+    'application/x-font-woff',
+    'application/zip',
+    'application/gzip',
+    'application/x-gzip',
+    'application/pdf',
+)
+ALWAYS_COMPRESSIBLE_TYPES = (
+    'image/svg+xml',
+)
+
+# Minimum response sizes, in bytes, for compression by content type. The '*'
+# entry is used for any type that is not explicitly listed.
+DEFAULT_MIN_SIZES = {
+    '*': 200,
+}
+
+
+class ClosingIterator(object):
+    """Iterates over some already-read chunks, and then over the rest of the
+    application's response, closing the application's response when done.
+    """
+    def __init__(self, buffered, chunks, app_iter):
+        self.buffered = buffered
+        self.chunks = chunks
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        return chain(self.buffered, self.chunks)
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+class GzipStream(ClosingIterator):
+    """Gzips the response one chunk at a time as the application yields it,
+    so that at most one chunk of the uncompressed body is held in memory.
+    """
+    def __init__(self, buffered, chunks, app_iter, compresslevel=6):
+        super(GzipStream, self).__init__(buffered, chunks, app_iter)
+        self.compresslevel = compresslevel
+
+    def __iter__(self):
+        # A wbits value of 16 + MAX_WBITS gives us a gzip header and trailer
+        # instead of a bare zlib stream.
+        compressor = zlib.compressobj(
+            self.compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        for chunk in chain(self.buffered, self.chunks):
+            if chunk:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+        yield compressor.flush()
+
+
+class StreamingGzipMiddleware(object):
+    """WSGI middleware that gzips output as it is produced, instead of
+    collecting the entire response first like GzipMiddleware does.
+
+    Responses that already have a content encoding, whose content types are
+    already compressed (see DEFAULT_SKIP_TYPES), or that are smaller than the
+    minimum size for their content type (see DEFAULT_MIN_SIZES) are passed
+    through untouched, as are responses that can't have a body (to HEAD
+    requests, and with 1xx, 204 or 304 statuses) and empty bodies, whatever
+    their Content-Length says.
+    """
+    def __init__(self, app, compresslevel=6, min_sizes=None, skip_types=None):
+        self.app = app
+        self.compresslevel = compresslevel
+        self.min_sizes = DEFAULT_MIN_SIZES.copy()
+        self.min_sizes.update(min_sizes or {})
+        self.skip_types = (DEFAULT_SKIP_TYPES if skip_types is None
+                           else tuple(skip_types))
+
+    def get_content_type(self, headers):
+        return (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+
+    def get_min_size(self, content_type):
+        return self.min_sizes.get(content_type, self.min_sizes['*'])
+
+    def is_compressible_type(self, content_type):
+        if content_type.startswith(ALWAYS_COMPRESSIBLE_TYPES):
+            return True
+        return not content_type.startswith(self.skip_types)
+
+    def __call__(self, environ, start_response):
+        if not client_accepts_gzip(environ):
+            return self.app(environ, start_response)
+
+        app_response = {}
+        buffered = []
+
+        def _intercept_response(status, headers, exc_info=None):
+            app_response['status'] = status
+            app_response['headers'] = headers
+            # Anything sent through the legacy write callable is treated as
+            # though it came at the front of the response body.
+            return buffered.append
+
+        app_iter = self.app(environ, _intercept_response)
+        chunks = iter(app_iter)
+
+        try:
+            # Applications may hold off on calling start_response until they
+            # yield their first chunk of output.
+            while 'headers' not in app_response:
+                buffered.append(next(chunks))
+        except StopIteration:
+            pass
+        except:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            raise
+
+        headers = Headers(app_response['headers'])
+        content_type = self.get_content_type(headers)
+        status_code = int(app_response['status'].split(None, 1)[0])
+
+        def pass_through():
+            start_response(app_response['status'], app_response['headers'])
+            if not buffered:
+                # Return the response as-is, so that the server can still use
+                # things like wsgi.file_wrapper.
+                return app_iter
+            return ClosingIterator(buffered, chunks, app_iter)
+
+        if environ.get('REQUEST_METHOD') == 'HEAD' or \
+           status_code < 200 or status_code in (204, 304) or \
+           'content-encoding' in headers or \
+           not self.is_compressible_type(content_type):
+            return pass_through()
+
+        def read_at_least(size):
+            # Buffer chunks of the response until there are at least size
+            # bytes, or the response ends. Return the number of bytes read.
+            buffered_size = sum(len(chunk) for chunk in buffered)
+            try:
+                while buffered_size < size:
+                    chunk = next(chunks)
+                    buffered.append(chunk)
+                    buffered_size += len(chunk)
+            except StopIteration:
+                pass
+            except:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+                raise
+            return buffered_size
+
+        # Check the size of the response against the minimum for its content
+        # type. If we don't know the size up front, read just enough of the
+        # response to find out whether it's big enough. Even if we do, make
+        # sure there's a body at all, so that an empty one doesn't become a
+        # gzip header and trailer.
+        min_size = self.get_min_size(content_type)
+        if 'content-length' in headers:
+            try:
+                too_small = int(headers['Content-Length']) < min_size
+            except ValueError:
+                too_small = True
+            too_small = too_small or read_at_least(1) < 1
+        else:
+            too_small = read_at_least(min_size) < min_size
+
+        if too_small:
+            return pass_through()
+
+        # Set headers accordingly. The compressed length isn't known until the
+        # whole response has been sent.
+        headers['Content-Encoding'] = 'gzip'
+        del headers['Content-Length']
+        if 'ETag' in headers:
+            headers['ETag'] = re.sub('"$', ';gzip"', headers['ETag'])
+        patch_vary_headers(headers, ('Accept-Encoding',))
+
+        start_response(app_response['status'], app_response['headers'])
+        return GzipStream(buffered, chunks, app_iter, self.compresslevel)
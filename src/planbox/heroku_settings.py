@@ -13,6 +13,10 @@ CSRF_COOKIE_SECURE = HTTPS_ENABLED
 STATIC_ROOT = rel_path('../../staticfiles')
 STATIC_URL = '/static/'
 
+# Write content-hashed copies and gzip (and brotli, if the brotli package is
+# installed) siblings of static files at collectstatic time.
+STATICFILES_STORAGE = 'planbox.storage.PrecompressedManifestStaticFilesStorage'
+
 SECRET_KEY = 'changemeloremipsumdolorsitametconsecteturadipisicingelit'
 ALLOWED_HOSTS = ['*']
 KNOWN_HOSTS = os.environ.get('KNOWN_HOSTS').split(',')
@@ -22,8 +22,13 @@ application = Sentry(application)
 from dj_static import Cling
 application = Cling(application)
 
-from .gzip_middleware import GzipMiddleware
-application = GzipMiddleware(application)
+# Serve the gzip/brotli siblings written at collectstatic time (see
+# planbox.storage) instead of compressing static files on every request.
+from .storage import PrecompressedStaticMiddleware
+application = PrecompressedStaticMiddleware(application)
+
+from .gzip_middleware import StreamingGzipMiddleware
+application = StreamingGzipMiddleware(application)
 
 from .twinkie import ExpiresMiddleware
 application = ExpiresMiddleware(application, {
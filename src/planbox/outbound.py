@@ -0,0 +1,281 @@
+"""
+The HTTP client for calls from Planbox to other services (the Shareabouts
+API, MoonClerk, the flavor pages, ...).
+
+Every outbound request should go through the shared client, e.g.:
+
+    from planbox.outbound import http
+    response = http.get(url, headers=headers)
+
+or, for a series of requests that share cookies:
+
+    session = http.session()
+    session.post(...)
+
+so that all of them get:
+
+* Kept-alive connections, pooled per host, shared by every caller in the
+  process.
+* A timeout (OUTBOUND_HTTP_TIMEOUT), unless the caller gives its own. Under
+  gevent, a request without a timeout can tie up a worker for as long as
+  the other side cares to keep the connection open.
+* Retries, with exponential backoff, of idempotent requests (GET, HEAD,
+  OPTIONS, PUT, DELETE) that fail to connect, time out, or get a 502, 503 or
+  504 back.
+* A circuit breaker per host: once OUTBOUND_HTTP_BREAKER_THRESHOLD requests
+  in a row to a host have failed, requests to the host fail right away with
+  a CircuitOpenError for OUTBOUND_HTTP_BREAKER_RESET seconds, after which a
+  single request is let through to see whether the host is back.
+* Per-host counts of requests, errors and retries, and request times (see
+  OutboundClient.get_stats). They are also reported to New Relic as custom
+  metrics, when the agent is available.
+
+CircuitOpenError is a requests.ConnectionError, so code that handles
+connection errors handles open circuits too.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import requests
+import threading
+import time
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+try:
+    import newrelic.agent
+except ImportError:
+    newrelic = None
+
+log = logging.getLogger(__name__)
+
+
+# Seconds to wait to connect, and between bytes of the response
+OUTBOUND_HTTP_TIMEOUT = getattr(settings, 'OUTBOUND_HTTP_TIMEOUT', 10)
+# How many times to retry a failed idempotent request
+OUTBOUND_HTTP_RETRIES = getattr(settings, 'OUTBOUND_HTTP_RETRIES', 2)
+# Seconds to wait before the first retry; each retry waits twice as long
+OUTBOUND_HTTP_RETRY_BACKOFF = getattr(settings, 'OUTBOUND_HTTP_RETRY_BACKOFF', 0.25)
+# Failures in a row after which requests to a host fail fast
+OUTBOUND_HTTP_BREAKER_THRESHOLD = getattr(settings, 'OUTBOUND_HTTP_BREAKER_THRESHOLD', 5)
+# Seconds for which requests to a failing host fail fast
+OUTBOUND_HTTP_BREAKER_RESET = getattr(settings, 'OUTBOUND_HTTP_BREAKER_RESET', 30)
+# The most connections to keep open to a single host
+OUTBOUND_HTTP_POOL_SIZE = getattr(settings, 'OUTBOUND_HTTP_POOL_SIZE', 10)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class CircuitOpenError (requests.ConnectionError):
+    pass
+
+
+class HostState (object):
+    """
+    The circuit breaker and the statistics for one host.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.trial_in_progress = False
+
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_error = None
+
+    def allow_request(self, now):
+        with self.lock:
+            if self.open_until is None:
+                return True
+            if now < self.open_until or self.trial_in_progress:
+                self.rejected += 1
+                return False
+            # Half-open: let one request through to try the host.
+            self.trial_in_progress = True
+            return True
+
+    def record(self, elapsed, error, now, threshold, reset_timeout):
+        with self.lock:
+            self.requests += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.trial_in_progress = False
+
+            if error is None:
+                self.consecutive_failures = 0
+                self.open_until = None
+                return
+
+            self.errors += 1
+            self.last_error = error
+            self.consecutive_failures += 1
+            if self.open_until is not None or self.consecutive_failures >= threshold:
+                self.open_until = now + reset_timeout
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'average_ms': (1000 * self.total_time / self.requests) if self.requests else None,
+                'max_ms': 1000 * self.max_time,
+                'last_error': self.last_error,
+                'circuit_open': self.open_until is not None,
+            }
+
+
+class OutboundSession (requests.Session):
+    """
+    A requests session whose requests go through an OutboundClient.
+    """
+    def __init__(self, client):
+        super(OutboundSession, self).__init__()
+        self.client = client
+        self.mount('http://', client.adapter)
+        self.mount('https://', client.adapter)
+
+    def request(self, method, url, **kwargs):
+        return self.client.send(super(OutboundSession, self).request, method, url, **kwargs)
+
+    def close(self):
+        # The adapter (and its connection pools) belongs to the client.
+        pass
+
+
+class OutboundClient (object):
+    def __init__(self, timeout=None, retries=None, backoff=None,
+                 breaker_threshold=None, breaker_reset=None, pool_size=None,
+                 clock=time.time, sleep=time.sleep):
+        self.timeout = timeout if timeout is not None else OUTBOUND_HTTP_TIMEOUT
+        self.retries = retries if retries is not None else OUTBOUND_HTTP_RETRIES
+        self.backoff = backoff if backoff is not None else OUTBOUND_HTTP_RETRY_BACKOFF
+        self.breaker_threshold = breaker_threshold if breaker_threshold is not None else OUTBOUND_HTTP_BREAKER_THRESHOLD
+        self.breaker_reset = breaker_reset if breaker_reset is not None else OUTBOUND_HTTP_BREAKER_RESET
+        self.clock = clock
+        self.sleep = sleep
+
+        # The adapter keeps a pool of connections for each host.
+        pool_size = pool_size if pool_size is not None else OUTBOUND_HTTP_POOL_SIZE
+        self.adapter = HTTPAdapter(pool_connections=20, pool_maxsize=pool_size)
+        self.hosts_lock = threading.Lock()
+        self.hosts = {}
+
+    def get_host_state(self, host):
+        with self.hosts_lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState()
+            return state
+
+    def get_stats(self):
+        """
+        Get the request statistics for each host, keyed by host.
+        """
+        with self.hosts_lock:
+            hosts = list(self.hosts.items())
+        return dict((host, state.get_stats()) for host, state in hosts)
+
+    def reset(self):
+        with self.hosts_lock:
+            self.hosts = {}
+
+    def session(self):
+        """
+        Get a session for a series of requests that share cookies.
+        """
+        return OutboundSession(self)
+
+    def send(self, send_request, method, url, retries=None, **kwargs):
+        """
+        Make a request with send_request (e.g., Session.request), applying
+        the client's timeout, retry and circuit breaker policies.
+        """
+        host = urlparse(url).netloc
+        state = self.get_host_state(host)
+        kwargs.setdefault('timeout', self.timeout)
+        if retries is None:
+            retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            if not state.allow_request(self.clock()):
+                raise CircuitOpenError('Not connecting to %s; it has been failing.' % (host,))
+
+            start = self.clock()
+            response = exception = None
+            # Until the request returns, count it as failed, so that an
+            # unexpected exception is recorded (and, if this was the trial
+            # request of a half-open circuit, lets the next one through).
+            error = 'Unexpected error'
+            try:
+                try:
+                    response = send_request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    exception = e
+                    error = '%s: %s' % (type(e).__name__, e)
+                except Exception as e:
+                    error = '%s: %s' % (type(e).__name__, e)
+                    raise
+                else:
+                    error = 'HTTP %s' % (response.status_code,) if response.status_code >= 500 else None
+            finally:
+                elapsed = self.clock() - start
+                state.record(elapsed, error, self.clock(), self.breaker_threshold, self.breaker_reset)
+                self.report_metrics(host, elapsed, error)
+
+            retryable = exception is not None or (response is not None and response.status_code in RETRY_STATUS_CODES)
+            if not retryable or attempt >= retries:
+                if exception is not None:
+                    raise exception
+                return response
+
+            log.info('%s %s failed (%s); retrying.', method, url, error)
+            with state.lock:
+                state.retries += 1
+            self.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def report_metrics(self, host, elapsed, error):
+        if newrelic is None:
+            return
+        newrelic.agent.record_custom_metric('Custom/Outbound/%s/Time' % (host,), elapsed)
+        newrelic.agent.record_custom_metric('Custom/Outbound/%s/Errors' % (host,), 1 if error else 0)
+
+    def request(self, method, url, **kwargs):
+        # Each request gets its own session, so that cookies set by one
+        # service aren't sent along with another caller's requests.
+        return self.session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+http = OutboundClient()
@@ -0,0 +1,256 @@
+"""
+Static file storage and serving for precompressed assets.
+
+At collectstatic time, PrecompressedManifestStaticFilesStorage writes
+content-hashed copies of every static file (along with a staticfiles.json
+manifest), and then writes gzip (and, if the brotli package is installed,
+brotli) siblings next to each compressible file -- e.g., app.js.gz and
+app.js.br next to app.js.
+
+At request time, PrecompressedStaticMiddleware serves those siblings straight
+from disk to clients that accept them, so that no CPU goes into compressing
+static files on each request.
+"""
+
+import gzip
+import mimetypes
+import os
+import posixpath
+from io import BytesIO
+from wsgiref.headers import Headers
+from wsgiref.util import FileWrapper
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestFilesMixin, StaticFilesStorage)
+from .gzip_middleware import patch_vary_headers
+
+try:
+    # Python 2
+    from urllib import unquote
+except ImportError:
+    # Python 3
+    from urllib.parse import unquote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Extensions of files that are worth compressing ahead of time. Images,
+# fonts like woff, and archives are already compressed.
+PRECOMPRESS_EXTENSIONS = (
+    '.css', '.js', '.map', '.json', '.html', '.htm', '.txt', '.xml',
+    '.svg', '.ico', '.eot', '.otf', '.ttf',
+)
+
+# Content-codings we know how to serve, in order of preference, along with the
+# file suffix for each.
+PRECOMPRESSED_ENCODINGS = (
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+
+class PrecompressMixin(object):
+    """
+    A storage mixin that writes compressed siblings of compressible files
+    once the files have been collected and post-processed.
+    """
+    precompress_extensions = PRECOMPRESS_EXTENSIONS
+    precompress_min_size = 200
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set(paths)
+
+        parent_post_process = getattr(
+            super(PrecompressMixin, self), 'post_process', None)
+        if parent_post_process is not None:
+            for name, hashed_name, processed in parent_post_process(paths, dry_run, **options):
+                if hashed_name:
+                    names.add(hashed_name)
+                yield name, hashed_name, processed
+
+        if dry_run:
+            return
+
+        for name in sorted(names):
+            if self.should_precompress(name):
+                self.precompress(name)
+
+    def should_precompress(self, name):
+        return os.path.splitext(name)[1].lower() in self.precompress_extensions
+
+    def get_compressors(self):
+        compressors = []
+        if brotli is not None:
+            compressors.append(('.br', brotli.compress))
+        compressors.append(('.gz', gzip_bytes))
+        return compressors
+
+    def precompress(self, name):
+        """
+        Write compressed siblings of the named file, and return the names of
+        the siblings written. A sibling is only kept if it is actually smaller
+        than the original.
+        """
+        path = self.path(name)
+        with open(path, 'rb') as original:
+            content = original.read()
+
+        written = []
+        for suffix, compress in self.get_compressors():
+            compressed_path = path + suffix
+            compressed = compress(content) if len(content) >= self.precompress_min_size else None
+
+            if compressed is not None and len(compressed) < len(content):
+                with open(compressed_path, 'wb') as compressed_file:
+                    compressed_file.write(compressed)
+                written.append(name + suffix)
+            elif os.path.exists(compressed_path):
+                # Don't leave a stale sibling from an earlier deploy.
+                os.remove(compressed_path)
+        return written
+
+
+def gzip_bytes(content, compresslevel=9):
+    """Gzip the given bytes with a fixed mtime, so that the output (and so its
+    ETag) only changes when the content does."""
+    zbuf = BytesIO()
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=compresslevel,
+                      fileobj=zbuf, mtime=0)
+    f.write(content)
+    f.close()
+    return zbuf.getvalue()
+
+
+class PrecompressedManifestStaticFilesStorage (
+        PrecompressMixin, ManifestFilesMixin, StaticFilesStorage):
+    """
+    Writes content-hashed copies of static files plus gzip/brotli siblings.
+
+    References inside CSS files are left alone (i.e., the hashed copies are
+    not rewritten), because several of the bower components refer to files
+    that are not shipped with them, which would fail the build.
+    """
+    patterns = ()
+
+
+def parse_accept_encoding(header):
+    """
+    Get the set of content-codings that a client accepts, leaving out any
+    that were given a q-value of 0.
+    """
+    codings = set()
+    for part in header.split(','):
+        pieces = [piece.strip() for piece in part.split(';')]
+        coding = pieces[0].lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        for param in pieces[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            codings.add(coding)
+    return codings
+
+
+class PrecompressedStaticMiddleware (object):
+    """
+    WSGI middleware that serves precompressed siblings of static files from
+    STATIC_ROOT. Requests for files that have no compressed siblings are left
+    for the wrapped application (e.g., Cling) to handle.
+
+    Responses carry a strong ETag that differs for each encoding, and
+    conditional requests with a matching If-None-Match get a 304.
+    """
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = os.path.abspath(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+
+    def get_file_path(self, path_info):
+        if not self.prefix.startswith('/') or not path_info.startswith(self.prefix):
+            return None
+
+        rel_path = posixpath.normpath(unquote(path_info[len(self.prefix):]))
+        if rel_path.startswith('..') or rel_path.startswith('/') or rel_path == '.':
+            return None
+
+        file_path = os.path.join(self.root, *rel_path.split('/'))
+        if not os.path.isfile(file_path):
+            return None
+        return file_path
+
+    def get_variants(self, file_path):
+        return [(encoding, file_path + suffix)
+                for encoding, suffix in PRECOMPRESSED_ENCODINGS
+                if os.path.isfile(file_path + suffix)]
+
+    def make_etag(self, stat, encoding):
+        tag = '%x-%x' % (int(stat.st_mtime), stat.st_size)
+        if encoding:
+            tag += '-' + encoding
+        return '"%s"' % (tag,)
+
+    def etag_matches(self, environ, etag):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+
+        file_path = self.get_file_path(environ.get('PATH_INFO', ''))
+        if file_path is None:
+            return self.application(environ, start_response)
+
+        variants = self.get_variants(file_path)
+        if not variants:
+            return self.application(environ, start_response)
+
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding, serve_path = None, file_path
+        for variant_encoding, variant_path in variants:
+            if variant_encoding in accepted:
+                encoding, serve_path = variant_encoding, variant_path
+                break
+
+        return self.serve(environ, start_response, file_path, serve_path, encoding)
+
+    def serve(self, environ, start_response, file_path, serve_path, encoding):
+        stat = os.stat(serve_path)
+        content_type, _ = mimetypes.guess_type(file_path)
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        elif content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+
+        headers_list = []
+        headers = Headers(headers_list)
+        headers['ETag'] = self.make_etag(stat, encoding)
+        patch_vary_headers(headers, ('Accept-Encoding',))
+
+        if self.etag_matches(environ, headers['ETag']):
+            start_response('304 Not Modified', headers_list)
+            return []
+
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(stat.st_size)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        start_response('200 OK', headers_list)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return []
+
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(serve_path, 'rb'), 8192)
@@ -0,0 +1,286 @@
+import gzip
+import os
+import requests
+import responses
+import shutil
+import tempfile
+from io import BytesIO
+from django.test import SimpleTestCase
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_raises, ok_
+from planbox.gzip_middleware import StreamingGzipMiddleware
+from planbox.outbound import OutboundClient, CircuitOpenError
+from planbox.storage import (
+    PrecompressedManifestStaticFilesStorage, PrecompressedStaticMiddleware,
+    parse_accept_encoding)
+
+
+def not_found_app(environ, start_response):
+    start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+    return [b'Not found']
+
+
+class PrecompressedStaticTests (SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.storage = PrecompressedManifestStaticFilesStorage(
+            location=self.static_root, base_url='/static/')
+        self.middleware = PrecompressedStaticMiddleware(
+            not_found_app, root=self.static_root, prefix='/static/')
+
+        self.content = b'body { color: red; }\n' * 100
+        os.makedirs(os.path.join(self.static_root, 'styles'))
+        with open(os.path.join(self.static_root, 'styles', 'app.css'), 'wb') as f:
+            f.write(self.content)
+        with open(os.path.join(self.static_root, 'styles', 'tiny.css'), 'wb') as f:
+            f.write(b'a{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.static_root)
+
+    def collect(self):
+        paths = {
+            'styles/app.css': (self.storage, 'styles/app.css'),
+            'styles/tiny.css': (self.storage, 'styles/tiny.css'),
+        }
+        return list(self.storage.post_process(paths))
+
+    def request(self, path, **environ):
+        environ.setdefault('REQUEST_METHOD', 'GET')
+        environ['PATH_INFO'] = path
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        body = self.middleware(environ, start_response)
+        try:
+            response['body'] = b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return response
+
+    def test_post_process_writes_hashed_and_gzipped_files(self):
+        self.collect()
+        hashed_name = self.storage.stored_name('styles/app.css')
+
+        files = os.listdir(os.path.join(self.static_root, 'styles'))
+        assert_in('app.css.gz', files)
+        assert_in(os.path.basename(hashed_name), files)
+        assert_in(os.path.basename(hashed_name) + '.gz', files)
+
+        # Too small to be worth compressing
+        assert_not_in('tiny.css.gz', files)
+
+        with open(os.path.join(self.static_root, 'styles', 'app.css.gz'), 'rb') as f:
+            assert_equal(gzip.GzipFile(fileobj=BytesIO(f.read())).read(), self.content)
+
+    def test_serves_gzipped_sibling_to_clients_that_accept_gzip(self):
+        self.collect()
+        response = self.request('/static/styles/app.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        assert_equal(response['status'], '200 OK')
+        assert_equal(response['headers']['Content-Encoding'], 'gzip')
+        assert_equal(response['headers']['Vary'], 'Accept-Encoding')
+        assert_equal(int(response['headers']['Content-Length']), len(response['body']))
+        assert_equal(gzip.GzipFile(fileobj=BytesIO(response['body'])).read(), self.content)
+
+    def test_serves_uncompressed_file_with_a_different_etag(self):
+        self.collect()
+        gzipped = self.request('/static/styles/app.css', HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.request('/static/styles/app.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+
+        assert_not_in('Content-Encoding', plain['headers'])
+        assert_equal(plain['body'], self.content)
+        assert_equal(plain['headers']['Vary'], 'Accept-Encoding')
+        assert gzipped['headers']['ETag'] != plain['headers']['ETag']
+
+    def test_returns_not_modified_for_matching_etag(self):
+        self.collect()
+        response = self.request('/static/styles/app.css', HTTP_ACCEPT_ENCODING='gzip')
+        response = self.request('/static/styles/app.css', HTTP_ACCEPT_ENCODING='gzip',
+                                HTTP_IF_NONE_MATCH=response['headers']['ETag'])
+
+        assert_equal(response['status'], '304 Not Modified')
+        assert_equal(response['body'], b'')
+
+    def test_defers_to_application_for_files_without_siblings(self):
+        self.collect()
+        response = self.request('/static/styles/tiny.css', HTTP_ACCEPT_ENCODING='gzip')
+        assert_equal(response['status'], '404 NOT FOUND')
+
+        response = self.request('/static/../styles/app.css', HTTP_ACCEPT_ENCODING='gzip')
+        assert_equal(response['status'], '404 NOT FOUND')
+
+    def test_parse_accept_encoding(self):
+        assert_equal(parse_accept_encoding('gzip, deflate, br'), set(['gzip', 'deflate', 'br']))
+        assert_equal(parse_accept_encoding('gzip;q=1.0, br; q=0'), set(['gzip']))
+        assert_equal(parse_accept_encoding(''), set())
+
+
+class StreamingGzipMiddlewareTests (SimpleTestCase):
+    body = b'<p>' + b'Lorem ipsum dolor sit amet. ' * 100 + b'</p>'
+
+    def request(self, status='200 OK', body=None, method='GET'):
+        # The app always claims the length of the full body.
+        body = self.body if body is None else body
+        def app(environ, start_response):
+            start_response(status, [('Content-Type', 'text/html'),
+                                    ('Content-Length', str(len(self.body)))])
+            return [body]
+
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        middleware = StreamingGzipMiddleware(app)
+        response['body'] = b''.join(middleware({'REQUEST_METHOD': method, 'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response))
+        return response
+
+    def test_compresses_large_responses(self):
+        response = self.request()
+        assert_equal(response['headers']['Content-Encoding'], 'gzip')
+        assert_equal(gzip.GzipFile(fileobj=BytesIO(response['body'])).read(), self.body)
+
+    def test_passes_through_responses_without_bodies(self):
+        for status, method in [('200 OK', 'HEAD'), ('204 NO CONTENT', 'GET'),
+                               ('304 NOT MODIFIED', 'GET'), ('100 CONTINUE', 'GET')]:
+            response = self.request(status, body=b'', method=method)
+            assert_not_in('Content-Encoding', response['headers'])
+            assert_equal(response['body'], b'')
+
+    def test_passes_through_empty_bodies_whatever_their_length(self):
+        response = self.request(body=b'')
+        assert_not_in('Content-Encoding', response['headers'])
+        assert_equal(response['body'], b'')
+
+
+class FakeClock (object):
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class OutboundClientTests (SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleeps = []
+        self.client = OutboundClient(timeout=5, retries=2, backoff=0.5,
+                                     breaker_threshold=3, breaker_reset=30,
+                                     clock=self.clock, sleep=self.sleeps.append)
+
+    @responses.activate
+    def test_successful_requests_are_counted_per_host(self):
+        responses.add(responses.GET, 'http://a.example.com/x', body='{}', content_type='application/json')
+        responses.add(responses.GET, 'http://b.example.com/y', body='{}', content_type='application/json')
+
+        assert_equal(self.client.get('http://a.example.com/x').status_code, 200)
+        assert_equal(self.client.get('http://a.example.com/x').status_code, 200)
+        assert_equal(self.client.get('http://b.example.com/y').status_code, 200)
+
+        stats = self.client.get_stats()
+        assert_equal(stats['a.example.com']['requests'], 2)
+        assert_equal(stats['a.example.com']['errors'], 0)
+        assert_equal(stats['b.example.com']['requests'], 1)
+
+    @responses.activate
+    def test_idempotent_requests_are_retried_with_backoff(self):
+        responses.add(responses.GET, 'http://a.example.com/x', status=503)
+
+        response = self.client.get('http://a.example.com/x')
+        assert_equal(response.status_code, 503)
+        assert_equal(len(responses.calls), 3)
+        assert_equal(self.sleeps, [0.5, 1.0])
+        assert_equal(self.client.get_stats()['a.example.com']['retries'], 2)
+
+    @responses.activate
+    def test_posts_are_not_retried(self):
+        responses.add(responses.POST, 'http://a.example.com/x', status=503)
+
+        assert_equal(self.client.post('http://a.example.com/x').status_code, 503)
+        assert_equal(len(responses.calls), 1)
+
+    @responses.activate
+    def test_client_errors_are_not_retried(self):
+        responses.add(responses.GET, 'http://a.example.com/x', status=404)
+
+        assert_equal(self.client.get('http://a.example.com/x').status_code, 404)
+        assert_equal(len(responses.calls), 1)
+        assert_equal(self.client.get_stats()['a.example.com']['errors'], 0)
+
+    @responses.activate
+    def test_connection_errors_are_raised_after_retries(self):
+        # responses refuses connections to URLs it doesn't know.
+        with assert_raises(requests.ConnectionError):
+            self.client.get('http://down.example.com/x')
+        assert_equal(len(responses.calls), 3)
+
+    @responses.activate
+    def test_circuit_opens_after_consecutive_failures(self):
+        responses.add(responses.POST, 'http://down.example.com/x', status=500)
+        responses.add(responses.GET, 'http://up.example.com/x', body='ok')
+
+        for _ in range(3):
+            self.client.post('http://down.example.com/x')
+        assert_equal(len(responses.calls), 3)
+
+        # Requests to the failing host fail fast...
+        with assert_raises(CircuitOpenError):
+            self.client.post('http://down.example.com/x')
+        assert_equal(len(responses.calls), 3)
+        assert_equal(self.client.get_stats()['down.example.com']['rejected'], 1)
+        ok_(self.client.get_stats()['down.example.com']['circuit_open'])
+
+        # ...but not to other hosts.
+        assert_equal(self.client.get('http://up.example.com/x').status_code, 200)
+
+    @responses.activate
+    def test_circuit_closes_when_the_host_recovers(self):
+        responses.add(responses.POST, 'http://flaky.example.com/x', status=500)
+        for _ in range(3):
+            self.client.post('http://flaky.example.com/x')
+
+        # After the reset timeout, one trial request is let through. If it
+        # fails, the circuit opens again.
+        self.clock.time += 31
+        self.client.post('http://flaky.example.com/x')
+        assert_equal(len(responses.calls), 4)
+        with assert_raises(CircuitOpenError):
+            self.client.post('http://flaky.example.com/x')
+
+        # If it succeeds, the circuit closes.
+        self.clock.time += 31
+        responses.reset()
+        responses.add(responses.POST, 'http://flaky.example.com/x', status=201)
+        assert_equal(self.client.post('http://flaky.example.com/x').status_code, 201)
+        assert_equal(self.client.post('http://flaky.example.com/x').status_code, 201)
+        ok_(not self.client.get_stats()['flaky.example.com']['circuit_open'])
+
+    @responses.activate
+    def test_unexpected_errors_count_as_failures(self):
+        def broken_request(method, url, **kwargs):
+            raise requests.TooManyRedirects('Exceeded 30 redirects.')
+
+        responses.add(responses.POST, 'http://flaky.example.com/x', status=500)
+        for _ in range(3):
+            self.client.post('http://flaky.example.com/x')
+
+        # An unexpected error in the trial request is raised, and recorded as
+        # a failure, so the circuit opens again...
+        self.clock.time += 31
+        with assert_raises(requests.TooManyRedirects):
+            self.client.send(broken_request, 'GET', 'http://flaky.example.com/x')
+        stats = self.client.get_stats()['flaky.example.com']
+        assert_equal(stats['errors'], 4)
+        assert_in('TooManyRedirects', stats['last_error'])
+        with assert_raises(CircuitOpenError):
+            self.client.post('http://flaky.example.com/x')
+
+        # ...and another trial is let through after the reset timeout.
+        self.clock.time += 31
+        responses.reset()
+        responses.add(responses.POST, 'http://flaky.example.com/x', status=201)
+        assert_equal(self.client.post('http://flaky.example.com/x').status_code, 201)
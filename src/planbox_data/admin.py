@@ -3,7 +3,6 @@
 from __future__ import unicode_literals
 
 import json
-from django.conf import settings
 from django.contrib.admin import SimpleListFilter
 from django.contrib.gis import admin
 from django.contrib import messages
@@ -19,6 +18,7 @@ from django_ace import AceWidget
 from django_object_actions import DjangoObjectActions
 from genericadmin.admin import GenericAdminModelAdmin, GenericTabularInline
 from jsonfield import JSONField
+from planbox_data import catalogue
 from planbox_data.models import Profile, ProfileProjectTemplate, Roundup, Project, Event, Theme, Section, Attachment
 
 
@@ -213,11 +213,7 @@ class TemplateProjectListFilter(SimpleListFilter):
     parameter_name = 'template'
 
     def lookups(self, request, model_admin):
-        templates_profile = Profile.objects.get(slug=settings.TEMPLATES_PROFILE)
-        return [
-            (template.project_id, template.label or '(No label)')
-            for template in templates_profile.project_templates.all()
-        ]
+        return catalogue.get_template_choices()
 
     def queryset(self, request, queryset):
         if self.value():
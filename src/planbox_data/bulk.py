@@ -0,0 +1,161 @@
+"""
+Helpers for writing many rows of a model at once.
+
+Saving a project used to save each of its events, sections, and attachments
+one at a time, with an UPDATE (and, for new items, a query for the next free
+index and another for the existing slugs) per item. These helpers let the
+serializers instead work out which rows actually changed, and write them with
+a handful of statements.
+
+Rows written this way do not go through Model.save, so no pre_save/post_save
+signals are sent for them.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import connection
+
+
+# SQLite allows at most 999 parameters per statement.
+MAX_QUERY_PARAMS = 900
+
+
+def get_compared_fields(model, exclude=()):
+    return [field for field in model._meta.concrete_fields
+            if not field.primary_key and field.name not in exclude]
+
+
+def get_value(instance, field):
+    # Not field.value_from_object, which gives some fields' values (e.g., a
+    # JSONField's) already serialized.
+    return getattr(instance, field.attname)
+
+
+def get_changed_fields(original, instance, exclude=()):
+    """
+    Get the names of the concrete fields whose values differ between two
+    instances of a model.
+    """
+    return [field.name for field in get_compared_fields(type(instance), exclude)
+            if get_value(original, field) != get_value(instance, field)]
+
+
+def get_placeholder(field):
+    # PostgreSQL can't infer the type of a parameter inside a CASE, so give it
+    # the column's type explicitly.
+    if connection.vendor == 'postgresql':
+        return 'CAST(%%s AS %s)' % (field.db_type(connection),)
+    return '%s'
+
+
+def bulk_update(model, changes):
+    """
+    Write the changed fields of many instances of a model.
+
+    changes -- A list of (instance, field_names) pairs.
+
+    Rows are written in batches, with one UPDATE per batch that sets each
+    changed column with a CASE on the primary key, e.g.:
+
+        UPDATE section SET label = CASE id WHEN 1 THEN 'a' WHEN 3 THEN 'b'
+                                           ELSE label END
+        WHERE id IN (1, 3)
+
+    Returns the number of statements issued.
+    """
+    changes = [(instance, set(field_names)) for instance, field_names in changes if field_names]
+    if not changes:
+        return 0
+
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pk_column = qn(opts.pk.column)
+    fields = [field for field in get_compared_fields(model)
+              if any(field.name in names for _, names in changes)]
+
+    # Each row takes two parameters per column (the pk and the value), and one
+    # more for the WHERE clause.
+    batch_size = max(1, MAX_QUERY_PARAMS // (2 * len(fields) + 1))
+
+    statements = 0
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(changes), batch_size):
+            batch = changes[start:start + batch_size]
+            assignments, params = [], []
+
+            for field in fields:
+                cases = []
+                for instance, names in batch:
+                    if field.name in names:
+                        cases.append('WHEN %%s THEN %s' % (get_placeholder(field),))
+                        params.append(instance.pk)
+                        params.append(field.get_db_prep_save(get_value(instance, field), connection=connection))
+                if cases:
+                    column = qn(field.column)
+                    assignments.append('%s = CASE %s %s ELSE %s END' % (
+                        column, pk_column, ' '.join(cases), column))
+
+            pks = [instance.pk for instance, _ in batch]
+            params.extend(pks)
+            sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+                qn(opts.db_table), ', '.join(assignments), pk_column,
+                ', '.join(['%s'] * len(pks)))
+
+            cursor.execute(sql, params)
+            statements += 1
+    finally:
+        cursor.close()
+
+    return statements
+
+
+def get_unique_key(model, instances):
+    """
+    Get the names of a set of fields that uniquely identify a row of the
+    model, and that are set on all of the given instances; or None if there
+    is no such set.
+    """
+    opts = model._meta
+    candidates = [(field.name,) for field in opts.fields
+                  if field.unique and not field.primary_key]
+    candidates.extend(tuple(names) for names in opts.unique_together)
+
+    for names in candidates:
+        attnames = [opts.get_field(name).attname for name in names]
+        if all(getattr(instance, attname) is not None
+               for instance in instances for attname in attnames):
+            return names
+    return None
+
+
+def bulk_create_with_pks(model, instances):
+    """
+    Insert the instances with bulk_create, and set their primary keys.
+
+    Bulk inserts don't report the keys of the inserted rows, so the rows are
+    looked up again by a unique key (e.g., a section's project and slug). If
+    the model has no unique key that is set on all of the instances, nothing
+    is inserted, and False is returned.
+    """
+    names = get_unique_key(model, instances)
+    if names is None:
+        return False
+
+    model.objects.bulk_create(instances)
+
+    opts = model._meta
+    attnames = [opts.get_field(name).attname for name in names]
+    batch_size = MAX_QUERY_PARAMS // len(attnames)
+
+    pks = {}
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        filters = dict((attname + '__in', set(getattr(instance, attname) for instance in batch))
+                       for attname in attnames)
+        rows = model.objects.filter(**filters).values_list(*(attnames + ['pk']))
+        pks.update((row[:-1], row[-1]) for row in rows)
+
+    for instance in instances:
+        instance.pk = pks[tuple(getattr(instance, attname) for attname in attnames)]
+    return True
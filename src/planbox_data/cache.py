@@ -0,0 +1,108 @@
+"""
+Cached version stamps for projects.
+
+A project's rendering depends on more than the project row -- events,
+sections, and attachments can all change without the project's updated_at
+moving. Anything that caches a rendering of a project should include the
+project's version in its cache key. The version is bumped whenever the project
+or any of its events, sections, or attachments are saved or deleted (see the
+signal handlers at the bottom of planbox_data.models).
+
+The template catalogue (see planbox_data.catalogue) has a version of its own,
+which is bumped whenever the templates profile, one of its projects, or a
+profile project template is saved or deleted.
+
+Each profile's roundup (see planbox_data.roundups) has a version too, which is
+bumped whenever the profile or one of its projects is saved or deleted, or a
+project's summary changes.
+"""
+
+from __future__ import unicode_literals
+
+import time
+from django.core.cache import cache
+
+
+TEMPLATE_CATALOGUE_VERSION_KEY = 'planbox:template-catalogue:version'
+
+
+def get_project_version_key(project_id):
+    return 'planbox:project-version:%s' % (project_id,)
+
+
+def new_version():
+    # Versions are seeded from the clock instead of starting at 1, so that if
+    # the version is ever evicted from the cache, the replacement will not
+    # collide with a version that some stale cache entry was keyed on.
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        if not cache.add(key, version, None):
+            # Someone else set the version in the mean time.
+            version = cache.get(key, version)
+    return version
+
+
+def touch_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The version is not in the cache yet.
+        version = new_version()
+        cache.set(key, version, None)
+        return version
+
+
+def get_project_version(project_id):
+    """
+    Get the current version stamp for the project with the given id.
+    """
+    return get_version(get_project_version_key(project_id))
+
+
+def touch_project(project_id):
+    """
+    Bump the version stamp for the project with the given id, invalidating
+    any cached renderings of the project.
+    """
+    return touch_version(get_project_version_key(project_id))
+
+
+def get_template_catalogue_version():
+    """
+    Get the current version stamp for the template catalogue (see
+    planbox_data.catalogue).
+    """
+    return get_version(TEMPLATE_CATALOGUE_VERSION_KEY)
+
+
+def touch_template_catalogue():
+    """
+    Bump the version stamp for the template catalogue, invalidating the
+    cached template listings.
+    """
+    return touch_version(TEMPLATE_CATALOGUE_VERSION_KEY)
+
+
+def get_roundup_version_key(owner_id):
+    return 'planbox:roundup-version:%s' % (owner_id,)
+
+
+def get_roundup_version(owner_id):
+    """
+    Get the current version stamp for the roundup of the profile with the
+    given id.
+    """
+    return get_version(get_roundup_version_key(owner_id))
+
+
+def touch_roundup(owner_id):
+    """
+    Bump the version stamp for the roundup of the profile with the given id,
+    invalidating the cached listings of the profile's projects.
+    """
+    return touch_version(get_roundup_version_key(owner_id))
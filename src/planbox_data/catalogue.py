@@ -0,0 +1,86 @@
+"""
+The template catalogue: cached, serialized listings of the project templates.
+
+The profile page lists every project template, the "new plan" page is built
+from the serialized data of a template project, and the project admin filters
+by template. Rather than querying for and serializing the templates for every
+page, the payloads are built once and cached under the template catalogue's
+version stamp (see planbox_data.cache). The version is bumped when the
+templates profile, one of its projects, or any profile project template is
+saved or deleted (see the signal handlers in planbox_data.models), which
+makes the cached payloads unreachable.
+
+A template project's data is cached under the project's own version stamp
+instead, since any project may be used as a template, and the project version
+is bumped when the project's events or sections change.
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from planbox_data.cache import get_project_version, get_template_catalogue_version
+from planbox_data.models import Profile, Project, ProfileProjectTemplate
+from planbox_data.serializers import ProfileProjectTemplateSerializer, TemplateProjectSerializer
+
+
+TEMPLATE_CATALOGUE_TIMEOUT = getattr(settings, 'TEMPLATE_CATALOGUE_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_catalogue_key(name):
+    return 'planbox:template-catalogue:%s:%s' % (get_template_catalogue_version(), name)
+
+
+def get_or_build(key, build):
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, TEMPLATE_CATALOGUE_TIMEOUT)
+    return data
+
+
+def get_project_templates():
+    return ProfileProjectTemplate.objects\
+        .filter(profile__slug=settings.TEMPLATES_PROFILE)\
+        .select_related('profile', 'project')
+
+
+def get_project_templates_data():
+    """
+    Get the serialized project templates of the templates profile.
+    """
+    def build():
+        serializer = ProfileProjectTemplateSerializer(get_project_templates(), many=True)
+        return serializer.data
+    return get_or_build(get_catalogue_key('project-templates'), build)
+
+
+def get_template_choices():
+    """
+    Get a list of (project id, label) pairs for the project templates of the
+    templates profile.
+    """
+    def build():
+        return [(template.project_id, template.label or '(No label)')
+                for template in ProfileProjectTemplate.objects.filter(profile__slug=settings.TEMPLATES_PROFILE)]
+    return get_or_build(get_catalogue_key('template-choices'), build)
+
+
+def get_template_project_data(owner_slug, project_slug):
+    """
+    Get the serialized data for a new project based on the given template
+    project, or None if there is no such project.
+    """
+    project_ids = Project.objects.filter(owner__slug=owner_slug, slug=project_slug).values_list('pk', flat=True)
+    if not project_ids:
+        return None
+    project_id = project_ids[0]
+
+    def build():
+        project = Project.objects.get(pk=project_id)
+        project.template = project
+        serializer = TemplateProjectSerializer(project)
+        return serializer.data
+
+    key = 'planbox:template-project:%s:%s' % (project_id, get_project_version(project_id))
+    return get_or_build(key, build)
@@ -0,0 +1,139 @@
+"""
+Cloning of model instances along with their related objects.
+
+A cloneable model lists, in cloned_relations, the reverse relations whose
+objects are cloned along with it -- e.g., a project's events and sections,
+and an event's attachments. Rather than cloning each related object on its
+own (with a query to find its children, and a save, per object), the objects
+are cloned one level of the tree at a time: all of the events of a project
+are read in one query and written with one bulk insert, then all of the
+attachments of all of those events, and so on.
+
+Since the new objects are not saved one at a time, integrations that need to
+take part in cloning should listen for clone_pre_save_batch and
+clone_post_save_batch, which are sent once per level with a list of
+(original, clone) pairs. The single-instance clone_pre_save signal is still
+sent for each object, and clone_post_save for each object that has been
+given its primary key; for objects inserted without finding out their keys
+(see below), only clone_post_save_batch is sent.
+
+New objects are given their primary keys by looking them up again by a unique
+key (see planbox_data.bulk.bulk_create_with_pks). Objects with no unique key
+(e.g., attachments) are inserted without finding out their keys, unless they
+have related objects of their own to clone, in which case they are saved one
+at a time.
+"""
+
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.generic import GenericRelation
+from django.contrib.contenttypes.models import ContentType
+from django.dispatch import Signal
+from django.utils.timezone import now
+from planbox_data import bulk
+
+
+clone_pre_save = Signal(providing_args=["orig_inst", "new_inst"])
+clone_post_save = Signal(providing_args=["orig_inst", "new_inst"])
+
+# Sent with a list of (orig_inst, new_inst) pairs, all of the sender model.
+# The new instances are not saved yet when clone_pre_save_batch is sent, so
+# receivers may still change them. When clone_post_save_batch is sent, they
+# have been saved, along with their own related objects.
+clone_pre_save_batch = Signal(providing_args=["pairs"])
+clone_post_save_batch = Signal(providing_args=["pairs"])
+
+
+def send_clone_pre_save(sender, pairs):
+    for orig_inst, new_inst in pairs:
+        clone_pre_save.send(sender=sender, orig_inst=orig_inst, new_inst=new_inst)
+    clone_pre_save_batch.send(sender=sender, pairs=pairs)
+
+
+def send_clone_post_save(sender, pairs):
+    for orig_inst, new_inst in pairs:
+        # Clones that were inserted without their keys can't be looked up
+        # again by a receiver, so they only go out in the batch signal.
+        if new_inst.pk is not None:
+            clone_post_save.send(sender=sender, orig_inst=orig_inst, new_inst=new_inst)
+    clone_post_save_batch.send(sender=sender, pairs=pairs)
+
+
+def get_related_objects(Model, relation_name, orig_pks):
+    """
+    Get the objects related to the given instances of Model through the named
+    relation, along with a function that gets the field overrides that
+    attach a clone of one of the objects to a given parent.
+    """
+    field = Model._meta.get_field_by_name(relation_name)[0]
+
+    if isinstance(field, GenericRelation):
+        RelatedModel = field.rel.to
+        ct_field, id_field = field.content_type_field_name, field.object_id_field_name
+        objects = RelatedModel.objects.filter(**{
+            ct_field: ContentType.objects.get_for_model(Model),
+            id_field + '__in': orig_pks})
+        get_parent_pk = lambda obj: getattr(obj, id_field)
+        get_overrides = lambda parent: {id_field: parent.pk}
+
+    else:
+        # A reverse foreign key or one-to-one relation
+        RelatedModel = field.model
+        fk = field.field
+        objects = RelatedModel.objects.filter(**{fk.name + '__in': orig_pks})
+        get_parent_pk = lambda obj: getattr(obj, fk.attname)
+        get_overrides = lambda parent: {fk.name: parent}
+
+    return RelatedModel, objects, get_parent_pk, get_overrides
+
+
+def clone_related_in_bulk(pairs):
+    """
+    Clone the objects related to each original instance onto its clone.
+
+    pairs -- A list of (original, clone) pairs of instances of the same
+        model. The clones must already be saved.
+    """
+    if not pairs:
+        return
+
+    # Avoid a circular import; models uses this module.
+    from planbox_data.models import TimeStampedModel, bulk_related_saved
+
+    Model = type(pairs[0][0])
+    clones_by_orig_pk = dict((orig.pk, clone) for orig, clone in pairs)
+
+    for relation_name in Model.cloned_relations:
+        RelatedModel, objects, get_parent_pk, get_overrides = get_related_objects(
+            Model, relation_name, list(clones_by_orig_pk))
+
+        current_time = now()
+        related_pairs = []
+        for obj in objects:
+            parent = clones_by_orig_pk[get_parent_pk(obj)]
+            clone = obj.make_clone(overrides=get_overrides(parent))
+            if isinstance(clone, TimeStampedModel):
+                clone.created_at = clone.updated_at = current_time
+            related_pairs.append((obj, clone))
+
+        if not related_pairs:
+            continue
+
+        send_clone_pre_save(RelatedModel, related_pairs)
+
+        clones = [clone for _, clone in related_pairs]
+        if bulk.bulk_create_with_pks(RelatedModel, clones):
+            clone_related_in_bulk(related_pairs)
+        elif RelatedModel.cloned_relations:
+            # We need the new objects' keys to clone their own relations.
+            for clone in clones:
+                clone.save()
+            clone_related_in_bulk(related_pairs)
+        else:
+            RelatedModel.objects.bulk_create(clones)
+
+        send_clone_post_save(RelatedModel, related_pairs)
+
+        # No save signals were sent for the new objects.
+        for parent in set(clones_by_orig_pk[get_parent_pk(obj)] for obj, _ in related_pairs):
+            bulk_related_saved.send(sender=Model, instance=parent, model=RelatedModel)
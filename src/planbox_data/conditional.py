@@ -0,0 +1,127 @@
+"""
+Conditional GET support for projects and profiles.
+
+Responses for a single project or profile carry a weak ETag and a
+Last-Modified date, so that a client that already has the current
+representation (e.g., the project editor polling the API, or a browser
+revalidating a page) gets a 304 Not Modified without the project or profile
+being serialized or rendered again.
+
+A project's ETag is derived from the same stamps as the project page cache
+key: the project's cached version (see planbox_data.cache), which moves
+whenever any of its events, sections or attachments change, and the
+timestamps of the project, its owner and its theme. A profile's ETag is
+derived from its roundup version, which moves whenever the profile or one of
+its projects changes, and from the timestamps of its teams and members.
+
+Last-Modified is the latest of those timestamps. It doesn't move when, say,
+an event is edited outside of the API, so If-None-Match takes precedence and
+If-Modified-Since is only looked at when no ETags are sent.
+
+Set ETAG_SALT (e.g., to the deployed revision) to make clients fetch fresh
+copies of everything after the code that renders it changes.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+from calendar import timegm
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from planbox_data.cache import get_project_version, get_roundup_version
+from planbox_data.models import Profile
+
+
+ETAG_SALT = getattr(settings, 'ETAG_SALT', '')
+
+
+def timestamp(dt):
+    return dt.isoformat() if dt else ''
+
+
+def make_etag(*parts):
+    key_string = '|'.join('%s' % (part,) for part in (ETAG_SALT,) + parts)
+    return hashlib.md5(key_string.encode('utf-8')).hexdigest()
+
+
+def latest(*dts):
+    dts = [dt for dt in dts if dt is not None]
+    return max(dts) if dts else None
+
+
+def get_project_validators(project, *variants):
+    """
+    Get the (etag, last_modified) pair for the given project. The variants
+    are included in the ETag, for representations that differ in more than
+    the project (e.g., by response format).
+    """
+    owner, theme = project.owner, project.theme
+    etag = make_etag(
+        'project', project.pk,
+        get_project_version(project.pk),
+        timestamp(project.updated_at),
+        timestamp(project.last_saved_at),
+        timestamp(owner.updated_at),
+        timestamp(theme.updated_at) if theme else '',
+        *variants)
+    last_modified = latest(project.updated_at, project.last_saved_at,
+                           owner.updated_at, theme.updated_at if theme else None)
+    return etag, last_modified
+
+
+def get_profile_validators(profile, *variants):
+    """
+    Get the (etag, last_modified) pair for the given profile. The variants
+    are included in the ETag, for representations that differ in more than
+    the profile (e.g., by response format).
+    """
+    associated = list(Profile.objects
+        .filter(Q(members=profile) | Q(teams=profile))
+        .distinct()
+        .order_by('pk')
+        .values_list('pk', 'updated_at'))
+
+    etag = make_etag(
+        'profile', profile.pk,
+        get_roundup_version(profile.pk),
+        timestamp(profile.updated_at),
+        ','.join('%s@%s' % (pk, timestamp(updated_at)) for pk, updated_at in associated),
+        *variants)
+    last_modified = latest(profile.updated_at, *[updated_at for _, updated_at in associated])
+    return etag, last_modified
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Check whether the client that made the request already has the
+    representation with the given validators.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison: parse_etags drops any W/ prefixes.
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return (if_modified_since is not None and
+                timegm(last_modified.utctimetuple()) <= if_modified_since)
+
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = 'W/' + quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    return response
+
+
+def not_modified_response(etag, last_modified):
+    return set_validators(HttpResponseNotModified(), etag, last_modified)
@@ -0,0 +1,114 @@
+"""
+Materialized project documents.
+
+Projects are read far more often than they are written, and every read used
+to serialize the project, its events, their attachments, and its sections
+field by field. Instead, the serialized project (the FullProjectSerializer
+output) is kept in a ProjectDocument row for each project, and reads are
+served from there.
+
+A project's document is marked stale in the same transaction as any change
+to the project, its owner, or its events, attachments or sections (see the
+signal handlers at the bottom of planbox_data.models). The next read rebuilds
+it. Marking a document stale also bumps its generation, and a rebuilt
+document is only saved if the generation is still the one that was read
+before building it; so a read that races with a write can't save a document
+built from the data from before the write.
+
+The check_project_documents management command compares the stored documents
+with fresh serializations.
+"""
+
+from __future__ import unicode_literals
+
+import json
+from collections import OrderedDict
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from planbox_data.models import Project, ProjectDocument, invalidate_project_documents
+from planbox_data.serializers import FullProjectSerializer
+
+
+# The fields in the full (editor) document that aren't in the public one
+FULL_ONLY_FIELDS = ('expires_at', 'payment_type')
+
+
+def normalize(data):
+    # Pass the data through JSON, so that a fresh serialization looks just
+    # like a document loaded from the database.
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder), object_pairs_hook=OrderedDict)
+
+
+def serialize_project(project_id):
+    """
+    Serialize the project with the given id from scratch.
+    """
+    project = Project.objects.prefetch_for_serialization().get(pk=project_id)
+    return normalize(FullProjectSerializer(project).data)
+
+
+def get_document_row(project_id):
+    try:
+        return ProjectDocument.objects.get(project_id=project_id)
+    except ProjectDocument.DoesNotExist:
+        pass
+
+    # Projects get their documents when they're created, but just in case...
+    try:
+        with transaction.atomic():
+            return ProjectDocument.objects.create(project_id=project_id)
+    except IntegrityError:
+        return ProjectDocument.objects.get(project_id=project_id)
+
+
+def get_document(project_id):
+    """
+    Get the full serialized document for the project with the given id,
+    rebuilding it if it's stale.
+    """
+    row = get_document_row(project_id)
+    if row.data is not None:
+        return row.data
+
+    data = serialize_project(project_id)
+    ProjectDocument.objects\
+        .filter(project_id=project_id, generation=row.generation)\
+        .update(data=data, built_at=now())
+    return data
+
+
+def to_public(document):
+    return OrderedDict((key, value) for key, value in document.items() if key not in FULL_ONLY_FIELDS)
+
+
+def get_project_data(project, full=False):
+    """
+    Get the serialized data for the given project: what FullProjectSerializer
+    would give if full is True, or what ProjectSerializer would give if not.
+    """
+    document = get_document(project.pk)
+    return document if full else to_public(document)
+
+
+def check_document(project_id):
+    """
+    Compare the stored document for a project with a fresh serialization.
+    Returns a list of the top-level keys whose values differ (empty if the
+    document matches, or is stale and so will be rebuilt anyway).
+    """
+    row = get_document_row(project_id)
+    if row.data is None:
+        return []
+
+    fresh = serialize_project(project_id)
+    keys = set(fresh) | set(row.data)
+    return sorted(key for key in keys if fresh.get(key) != row.data.get(key))
+
+
+def rebuild_document(project_id):
+    """
+    Mark the project's document as stale, and build it again.
+    """
+    invalidate_project_documents(project_id=project_id)
+    return get_document(project_id)
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from planbox_data.documents import check_document, rebuild_document
+from planbox_data.models import Project
+
+
+class Command (BaseCommand):
+    args = '[project_id ...]'
+    help = ('Check the stored project documents against fresh serializations '
+            'of the projects (all projects, unless ids are given).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--fix', action='store_true', dest='fix', default=False,
+            help='Rebuild the documents that do not match.'),
+    )
+
+    def handle(self, *project_ids, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        projects = Project.objects.all()
+        if project_ids:
+            projects = projects.filter(pk__in=project_ids)
+
+        mismatched = 0
+        checked = 0
+        for project_id in projects.order_by('pk').values_list('pk', flat=True).iterator():
+            checked += 1
+            keys = check_document(project_id)
+            if not keys:
+                continue
+
+            mismatched += 1
+            self.stdout.write('Project %s: document differs in %s' % (project_id, ', '.join(keys)))
+            if options['fix']:
+                rebuild_document(project_id)
+                if verbosity > 1:
+                    self.stdout.write('Project %s: document rebuilt' % (project_id,))
+
+        if verbosity > 0:
+            self.stdout.write('Checked %s project document(s); %s did not match.' % (checked, mismatched))
+        if mismatched and not options['fix']:
+            raise CommandError('%s project document(s) did not match.' % (mismatched,))
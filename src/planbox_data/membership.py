@@ -0,0 +1,144 @@
+"""
+Team membership resolution.
+
+Teams are profiles, and a team's members may themselves be teams, so a user
+is a member of a team if their profile is a member of the team, or of any team
+that is (transitively) a member of the team. Rather than walking down from the
+team one profile at a time, we walk up from the user's profile through the
+Profile.teams table, collecting every team the user belongs to. This is done
+in a single recursive query where the database supports it (PostgreSQL, and
+SQLite 3.8.3 and up), and one query per level of nesting otherwise. Cycles in
+the membership graph are fine either way.
+
+The set of team ids is memoized on the user object. Since each request gets
+its own user object, repeated permission checks within a request are free.
+Memos are dropped whenever memberships change in this process (see the
+m2m_changed handler in planbox_data.models).
+"""
+
+from __future__ import unicode_literals
+
+import sqlite3
+from django.apps import apps
+from django.db import connection
+
+
+MEMO_ATTR = '_planbox_team_ids'
+
+# Bumped whenever memberships change, so that memos made before the change
+# are not used after it.
+_generation = [0]
+
+
+def get_memberships_table():
+    Profile = apps.get_model('planbox_data', 'Profile')
+    Membership = Profile.teams.through
+    return (
+        Membership,
+        Membership._meta.db_table,
+        Membership._meta.get_field('from_profile').column,
+        Membership._meta.get_field('to_profile').column,
+    )
+
+
+def supports_recursive_queries():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 8, 3)
+    return False
+
+
+def get_team_ids_recursive(profile_ids):
+    _, table, member_column, team_column = get_memberships_table()
+    qn = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(profile_ids))
+
+    # UNION (as opposed to UNION ALL) discards rows that have already been
+    # seen, so the recursion stops even if the graph has a cycle.
+    sql = '''
+        WITH RECURSIVE closure (team_id) AS (
+            SELECT {team} FROM {table} WHERE {member} IN ({placeholders})
+          UNION
+            SELECT m.{team} FROM {table} AS m
+              JOIN closure AS c ON m.{member} = c.team_id
+        )
+        SELECT team_id FROM closure
+    '''.format(table=qn(table), member=qn(member_column),
+               team=qn(team_column), placeholders=placeholders)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, list(profile_ids))
+        return set(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def get_team_ids_iterative(profile_ids):
+    Membership, _, _, _ = get_memberships_table()
+    team_ids = set()
+    frontier = set(profile_ids)
+    while frontier:
+        parent_ids = set(
+            Membership.objects
+                .filter(from_profile_id__in=frontier)
+                .values_list('to_profile_id', flat=True))
+        frontier = parent_ids - team_ids
+        team_ids |= frontier
+    return team_ids
+
+
+def get_team_ids_for_profiles(profile_ids):
+    """
+    Get the ids of all the teams that any of the given profiles belong to,
+    directly or through other teams.
+    """
+    profile_ids = list(profile_ids)
+    if not profile_ids:
+        return set()
+    if supports_recursive_queries():
+        return get_team_ids_recursive(profile_ids)
+    return get_team_ids_iterative(profile_ids)
+
+
+def get_memberships(user):
+    """
+    Get the ids of the given user's own profiles, and of all the teams that
+    the user belongs to, directly or through other teams. The result is
+    memoized on the user.
+    """
+    if user is None or user.id is None:
+        return frozenset(), frozenset()
+
+    generation, profile_ids, team_ids = getattr(user, MEMO_ATTR, (None, None, None))
+    if generation != _generation[0]:
+        Profile = apps.get_model('planbox_data', 'Profile')
+        profile_ids = frozenset(Profile.objects.filter(auth_id=user.id).values_list('id', flat=True))
+        team_ids = frozenset(get_team_ids_for_profiles(profile_ids))
+        setattr(user, MEMO_ATTR, (_generation[0], profile_ids, team_ids))
+    return profile_ids, team_ids
+
+
+def get_team_ids(user):
+    """
+    Get the set of ids of all the teams that the given user belongs to,
+    directly or through other teams.
+    """
+    return get_memberships(user)[1]
+
+
+def get_authorizing_profile_ids(user):
+    """
+    Get the set of ids of all the profiles that the given user may act on
+    behalf of -- their own profile, and every team they belong to.
+    """
+    profile_ids, team_ids = get_memberships(user)
+    return profile_ids | team_ids
+
+
+def memberships_changed():
+    """
+    Invalidate all of the memoized team ids in this process.
+    """
+    _generation[0] += 1
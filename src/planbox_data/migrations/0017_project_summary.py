@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def fill_in_project_summaries(apps, schema_editor):
+    Project = apps.get_model('planbox_data', 'Project')
+    Section = apps.get_model('planbox_data', 'Section')
+
+    # The summary is the content of the project's first text section.
+    summaries = {}
+    for section in Section.objects.filter(type='text').order_by('project', 'index'):
+        if section.project_id not in summaries:
+            summaries[section.project_id] = section.details.get('content', '')
+
+    for project_id, summary in summaries.items():
+        if summary:
+            Project.objects.filter(pk=project_id).update(summary=summary)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planbox_data', '0016_add_details_to_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='summary',
+            field=models.TextField(default='', help_text='The content of the first text section, kept up to date automatically', blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(fill_in_project_summaries),
+    ]
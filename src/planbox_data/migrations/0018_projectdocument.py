@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+def create_project_documents(apps, schema_editor):
+    # Every project has a document row, which starts out stale and is built
+    # the first time the project is read.
+    Project = apps.get_model('planbox_data', 'Project')
+    ProjectDocument = apps.get_model('planbox_data', 'ProjectDocument')
+    ProjectDocument.objects.bulk_create([
+        ProjectDocument(project_id=project_id)
+        for project_id in Project.objects.values_list('pk', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planbox_data', '0017_project_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectDocument',
+            fields=[
+                ('project', models.OneToOneField(related_name='document', primary_key=True, serialize=False, to='planbox_data.Project')),
+                ('data', jsonfield.fields.JSONField(null=True, blank=True)),
+                ('generation', models.PositiveIntegerField(default=0)),
+                ('built_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(create_project_documents),
+    ]
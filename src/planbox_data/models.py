@@ -1,10 +1,13 @@
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 from django.conf import settings
 from django.contrib import auth
 from django.contrib.contenttypes.generic import GenericForeignKey, GenericRelation
 from django.contrib.gis.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import Signal
 from django.utils.text import slugify
 from django.utils.encoding import python_2_unicode_compatible
@@ -12,6 +15,14 @@ from django.utils.html import strip_tags
 from django.utils.timezone import now, timedelta
 from django.utils.translation import ugettext as _
 from jsonfield import JSONField
+from planbox_data import presence
+from planbox_data.cache import touch_project, touch_roundup, touch_template_catalogue
+from planbox_data.cloning import (clone_pre_save, clone_post_save,
+    clone_pre_save_batch, clone_post_save_batch, clone_related_in_bulk,
+    send_clone_pre_save, send_clone_post_save)
+from planbox_data.slugs import allocate_slug, SLUG_ALLOCATION_ATTEMPTS
+from planbox_data.membership import (get_team_ids, get_team_ids_for_profiles,
+    get_authorizing_profile_ids, memberships_changed)
 
 
 # ============================================================
@@ -44,15 +55,21 @@ class OrderedModelMixin (object):
 
 
 
-clone_pre_save = Signal(providing_args=["orig_inst", "new_inst"])
-clone_post_save = Signal(providing_args=["orig_inst", "new_inst"])
+# Sent when objects related to an instance have been written in bulk, in
+# which case no save signals are sent for the objects themselves.
+bulk_related_saved = Signal(providing_args=["instance", "model"])
 
 class CloneableModelMixin (object):
     """
     Mixin providing a clone method that copies all of a models instance's
     fields to a new instance of the model, allowing overrides.
 
+    The objects in the reverse relations named in cloned_relations are cloned
+    along with the instance, in bulk (see planbox_data.cloning).
+
     """
+    cloned_relations = ()
+
     def get_ignore_fields(self, ModelClass):
         fields = ModelClass._meta.fields
         pk_name = ModelClass._meta.pk.name
@@ -75,31 +92,42 @@ class CloneableModelMixin (object):
         return {}
 
     def clone_related(self, onto):
-        pass
+        clone_related_in_bulk([(self, onto)])
 
-    def clone(self, overrides=None, commit=True):
+    def make_clone(self, overrides=None):
         """
-        Create a duplicate of the model instance, replacing any properties
-        specified as keyword arguments. This is a simple base implementation
-        and may need to be extended for specific classes, since it is
-        does not address related fields in any way.
+        Create an unsaved duplicate of the model instance, replacing any
+        properties specified in overrides. No signals are sent.
         """
         fields = self._meta.fields
         ignore_field_names = self.get_ignore_fields(self.__class__)
+        overrides = overrides or {}
         inst_kwargs = {}
 
+        # Copy foreign keys by their ids, so that the related objects don't
+        # have to be fetched.
         for fld in fields:
-            if fld.name not in ignore_field_names:
-                fld_value = getattr(self, fld.name)
-                inst_kwargs[fld.name] = fld_value
+            if fld.name not in ignore_field_names and fld.name not in overrides and fld.attname not in overrides:
+                inst_kwargs[fld.attname] = getattr(self, fld.attname)
 
-        if overrides:
-            inst_kwargs.update(overrides)
+        inst_kwargs.update(overrides)
+        return self.__class__(**inst_kwargs)
 
-        new_inst = self.__class__(**inst_kwargs)
-        clone_pre_save.send(sender=self.__class__, orig_inst=self, new_inst=new_inst)
+    def clone(self, overrides=None, commit=True):
+        """
+        Create a duplicate of the model instance, replacing any properties
+        specified as keyword arguments. Objects in the cloned_relations are
+        duplicated as well.
+        """
+        new_inst = self.make_clone(overrides)
+        send_clone_pre_save(self.__class__, [(self, new_inst)])
 
         if commit:
+            self.save_clone(new_inst)
+        return new_inst
+
+    def save_clone(self, new_inst):
+        with transaction.atomic():
             save_kwargs = self.get_clone_save_kwargs()
             new_inst.save(**save_kwargs)
 
@@ -107,9 +135,7 @@ class CloneableModelMixin (object):
             # you will have to call clone_related manually on the cloned
             # instance once it is saved.
             self.clone_related(onto=new_inst)
-            clone_post_save.send(sender=self.__class__, orig_inst=self, new_inst=new_inst)
-
-        return new_inst
+            send_clone_post_save(self.__class__, [(self, new_inst)])
 
 
 def uniquify_slug(slug, existing_slugs):
@@ -147,14 +173,16 @@ class ModelWithSlugMixin (object):
     the following methods:
 
     get_slug_basis -- Get the string off that will be slugified to construct the slug.
-    get_all_slugs -- Generate the set of all mututally unique slugs with
-        respect to this model.
+    get_slug_queryset -- Get the queryset of all the objects with respect to
+        which the slug must be unique.
 
     """
-    def ensure_slug(self, force=False, basis=None):
+    def ensure_slug(self, force=False, basis=None, existing_slugs=None):
         """
         Determines a slug based on the slug's basis if no slug is set. When
-        force is True, the slug is set even if it already has a value.
+        force is True, the slug is set even if it already has a value. If
+        existing_slugs is given, it is used instead of querying for the slugs
+        in use (e.g., when creating many instances at once).
         """
         if self.slug and not force:
             return self.slug
@@ -166,22 +194,38 @@ class ModelWithSlugMixin (object):
             # Leave some room in the slug length for the uniquifier.
             max_length -= 16
 
-            self.slug = uniquify_slug(
-                slugify(strip_tags(basis))[:max_length],
-                self.get_all_slugs()
-            )
+            slug = slugify(strip_tags(basis))[:max_length]
+            if existing_slugs is None:
+                self.slug = allocate_slug(slug, self.get_slug_queryset())
+            else:
+                self.slug = uniquify_slug(slug, existing_slugs)
         return self.slug
 
     def save(self, *args, **kwargs):
-        self.ensure_slug()
-        return super(ModelWithSlugMixin, self).save(*args, **kwargs)
+        if self.slug:
+            return super(ModelWithSlugMixin, self).save(*args, **kwargs)
+
+        # Another process may take the slug that we pick before we save, in
+        # which case pick again.
+        for attempt in range(SLUG_ALLOCATION_ATTEMPTS):
+            if not self.ensure_slug():
+                return super(ModelWithSlugMixin, self).save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super(ModelWithSlugMixin, self).save(*args, **kwargs)
+            except IntegrityError:
+                # Only pick again if it was the slug that was taken, and not
+                # some other constraint that failed.
+                if attempt == SLUG_ALLOCATION_ATTEMPTS - 1 or \
+                   not self.get_slug_queryset().filter(slug=self.slug).exists():
+                    raise
+                self.slug = ''
 
     def clone(self, commit=True, *args, **kwargs):
         new_inst = super(ModelWithSlugMixin, self).clone(commit=False, *args, **kwargs)
         new_inst.ensure_slug(force=True, basis=self.slug)
         if commit:
-            new_inst.save()
-            self.clone_related(onto=new_inst)
+            self.save_clone(new_inst)
         return new_inst
 
 
@@ -282,8 +326,8 @@ class Profile (ModelWithSlugMixin, TimeStampedModel):
     def get_slug_basis(self):
         return self.name
 
-    def get_all_slugs(self):
-        return set([p['slug'] for p in Profile.objects.all().values('slug')])
+    def get_slug_queryset(self):
+        return Profile.objects.all()
 
     def slug_exists(self, slug):
         return Profile.objects.filter(slug__iexact=slug).exists()
@@ -295,11 +339,11 @@ class Profile (ModelWithSlugMixin, TimeStampedModel):
         return (user.id == self.auth_id)
 
     def has_member(self, user):
-        members = list(self.members.all())
-        if user.id in [profile.auth_id for profile in members]:
-            return True
-        else:
-            return any(profile.has_member(user) for profile in members)
+        """
+        Test whether the given user belongs to this team, either directly or
+        through another team.
+        """
+        return self.id in get_team_ids(user)
 
     def is_synced_with_auth(self, auth=None):
         auth = auth or self.auth
@@ -369,6 +413,16 @@ def create_roundup_for_new_team(sender, instance, created, **kwargs):
 post_save.connect(create_roundup_for_new_team, sender=Profile, dispatch_uid="user-team-profile-create-roundup-signal")
 
 
+def invalidate_team_memberships(sender, **kwargs):
+    """
+    Drop any memoized team memberships when memberships change.
+    """
+    if kwargs.get('action', 'post_').startswith('post_'):
+        memberships_changed()
+m2m_changed.connect(invalidate_team_memberships, sender=Profile.teams.through, dispatch_uid="profile-teams-changed-signal")
+post_delete.connect(invalidate_team_memberships, sender=Profile, dispatch_uid="profile-delete-memberships-signal")
+
+
 # ============================================================
 # Projects
 
@@ -388,21 +442,72 @@ class ProjectQuerySet (models.query.QuerySet):
     def Q_member(self, member):
         UserAuth = auth.get_user_model()
         if isinstance(member, UserAuth):
-            member = member.profile
-        profile_ids = [member.id] + [team['id'] for team in member.teams.values('id')]
+            profile_ids = get_authorizing_profile_ids(member)
+        else:
+            profile_ids = set([member.id]) | get_team_ids_for_profiles([member.id])
 
-        return models.Q(owner_id__in=profile_ids)
+        return models.Q(owner_id__in=list(profile_ids))
 
     def filter_by_member_or_public(self, member):
         member_query = self.Q_member(member)
         public_query = models.Q(public=True)
         return self.filter(member_query | public_query)
 
+    def annotate_permissions(self, user):
+        """
+        Mark each project with whether the given user may edit it (can_edit)
+        and view it (can_view). The flags are computed in the same query that
+        loads the projects, instead of once per project. Project.editable_by
+        uses the flag when it is asked about the same user.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        owner_column = '%s.%s' % (qn(opts.db_table), qn(opts.get_field('owner').column))
+        public_column = '%s.%s' % (qn(opts.db_table), qn(opts.get_field('public').column))
+
+        if user is None or not user.is_authenticated():
+            can_edit_sql = '1 = 0'
+        elif user.is_superuser:
+            can_edit_sql = '1 = 1'
+        else:
+            # Profile ids come from the database, so it's safe to put them in
+            # the SQL directly.
+            profile_ids = sorted(get_authorizing_profile_ids(user))
+            if profile_ids:
+                can_edit_sql = '%s IN (%s)' % (owner_column, ', '.join(str(int(pk)) for pk in profile_ids))
+            else:
+                can_edit_sql = '1 = 0'
+
+        user_id = getattr(user, 'id', None)
+        return self.extra(select={
+            'can_edit': 'CASE WHEN %s THEN 1 ELSE 0 END' % (can_edit_sql,),
+            'can_view': 'CASE WHEN %s OR %s THEN 1 ELSE 0 END' % (public_column, can_edit_sql),
+            'permissions_user_id': str(int(user_id)) if user_id is not None else 'NULL',
+        })
+
+    def prefetch_for_serialization(self):
+        """
+        Load everything that the project serializers walk over -- the owner
+        (and its auth, for the username), the theme, the sections, the events,
+        and each event's attachments -- so that serializing a project takes
+        the same number of queries no matter how many events, attachments, or
+        sections it has.
+        """
+        return self\
+            .select_related('owner', 'owner__auth', 'theme')\
+            .prefetch_related('sections', 'events', 'events__attachments')
+
 
 class ProjectManager (models.GeoManager):
     def get_queryset(self):
         return ProjectQuerySet(self.model, using=self._db)
 
+    def annotate_permissions(self, user):
+        return self.get_queryset().annotate_permissions(user)
+
+    def prefetch_for_serialization(self):
+        return self.get_queryset().prefetch_for_serialization()
+
     def filter_by_owner_or_public(self, owner):
         return self.get_queryset().filter_by_owner_or_public(owner)
 
@@ -443,6 +548,7 @@ class Project (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
 
     title = models.TextField(blank=True)
     slug = models.CharField(max_length=128, blank=True)
+    summary = models.TextField(help_text=_("The content of the first text section, kept up to date automatically"), default='', blank=True)
     public = models.BooleanField(default=False, blank=True)
     status = models.CharField(help_text=_("A string representing the project's status"), choices=STATUS_CHOICES, default='not-started', max_length=32, blank=True)
     location = models.TextField(help_text=_("The general location of the project, e.g. \"Philadelphia, PA\", \"Clifton Heights, Louisville, KY\", \"4th St. Corridor, Brooklyn, NY\", etc."), default='', blank=True)
@@ -481,6 +587,7 @@ class Project (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
     last_saved_at = models.DateTimeField(null=True, blank=True)
 
     objects = ProjectManager()
+    cloned_relations = ('events', 'sections')
 
     class Meta:
         unique_together = [('owner', 'slug')]
@@ -493,25 +600,54 @@ class Project (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
             if section.type == 'text':
                 return section.details.get('content', '')
 
+    def update_summary(self):
+        """
+        Store the project's current summary (see get_summary) in the summary
+        field, so that listings of projects don't have to load the sections
+        of each one. Returns whether the summary changed.
+        """
+        return update_project_summary(self.pk)
+
     def mark_opened_by(self, user, opened_at=None):
-        # TODO: This could just be done in the cache.
-        self.last_opened_at = opened_at or now()
-        self.last_opened_by = user if (user and user.is_authenticated()) else None
-        self.save()
+        """
+        Mark the project as open in the given user's editor, unless someone
+        else already has it open. Returns the outcome of the claim (see
+        planbox_data.presence).
+        """
+        if not (user and user.is_authenticated()):
+            self.mark_closed()
+            return presence.OPENED
+
+        outcome, current = presence.claim(self.pk, user.id, opened_at)
+        self.load_presence(current, user)
+        return outcome
+
+    def mark_closed(self, user=None):
+        return presence.release(self.pk, getattr(user, 'id', None))
+
+    def load_presence(self, current, user=None):
+        """
+        Copy presence information onto the last_opened_* attributes, so that
+        it gets serialized along with the project. Returns the user that has
+        the project open, if any.
+        """
+        if current is None:
+            return None
 
-    def mark_closed(self):
-        self.mark_opened_by(None)
+        self.last_opened_at = current['opened_at']
+        if user is not None and user.id == current['user_id']:
+            self.last_opened_by = user
+        elif self.last_opened_by_id != current['user_id']:
+            UserAuth = auth.get_user_model()
+            self.last_opened_by = UserAuth.objects.filter(pk=current['user_id']).first()
+        return self.last_opened_by
 
     def is_opened_by(self, user):
-        two_minutes = timedelta(minutes=2)
-        return self.last_opened_by == user and (now() - self.last_opened_at) < two_minutes
+        current = presence.get_presence(self.pk)
+        return current is not None and current['user_id'] == user.id
 
     def get_opened_by(self):
-        two_minutes = timedelta(minutes=2)
-        if self.last_opened_at and (now() - self.last_opened_at) < two_minutes:
-            return self.last_opened_by
-        else:
-            return None
+        return self.load_presence(presence.get_presence(self.pk))
 
     def natural_key(self):
         return self.owner.natural_key() + (self.slug,)
@@ -522,29 +658,16 @@ class Project (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
         """
         return self.title
 
-    def get_all_slugs(self):
+    def get_slug_queryset(self):
         """
-        Generate the set of all mututally unique slugs with respect to this
-        model.
+        Get the queryset of all the objects with respect to which the slug
+        must be unique.
         """
-        return [p.slug for p in self.owner.projects.all()]
+        return self.owner.projects.all()
 
     def slug_exists(self, slug):
         return self.owner.projects.filter(slug__iexact=slug).exists()
 
-    def clone_related(self, onto):
-        kwargs = dict(project=onto)
-        for e in self.events.all(): e.clone(overrides=kwargs)
-        for s in self.sections.all(): s.clone(overrides=kwargs)
-
-        # TODO: This should be handled by signals in shareabouts_integration.
-        # Maybe a pre_clone_related signal.
-        from django.core.exceptions import ObjectDoesNotExist
-        try:
-            self.shareabouts_preauthorization.clone(overrides=kwargs)
-        except ObjectDoesNotExist:
-            pass
-
     def owned_by(self, obj):
         UserAuth = auth.get_user_model()
         if isinstance(obj, UserAuth):
@@ -558,13 +681,21 @@ class Project (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
             return False
 
         if isinstance(obj, UserAuth):
-            try: obj = obj.profile
-            except Profile.DoesNotExist: return False
+            user = obj
+        elif obj.auth is not None:
+            user = obj.auth
+        else:
+            return self.owned_by(obj)
 
-        if obj.auth.is_superuser:
+        # Use the flag from ProjectQuerySet.annotate_permissions if it was
+        # computed for this user.
+        if hasattr(self, 'can_edit') and getattr(self, 'permissions_user_id', None) == user.id:
+            return bool(self.can_edit)
+
+        if user.is_superuser:
             return True
 
-        return self.owned_by(obj) or (obj in self.owner.members.all())
+        return self.owner_id in get_authorizing_profile_ids(user)
 
     def reset_trial_period(self):
         if hasattr(settings, 'TRIAL_DURATION'):
@@ -613,6 +744,7 @@ class Event (OrderedModelMixin, ModelWithSlugMixin, CloneableModelMixin, models.
                                   content_type_field='attached_to_type')
 
     objects = EventManager()
+    cloned_relations = ('attachments',)
 
     class Meta:
         ordering = ('project', 'index',)
@@ -630,8 +762,8 @@ class Event (OrderedModelMixin, ModelWithSlugMixin, CloneableModelMixin, models.
     def get_slug_basis(self):
         return self.label
 
-    def get_all_slugs(self):
-        return [e.slug for e in self.project.events.all()]
+    def get_slug_queryset(self):
+        return self.project.events.all()
 
     def slug_exists(self, slug):
         return self.project.events.filter(slug__iexact=slug).exists()
@@ -639,10 +771,6 @@ class Event (OrderedModelMixin, ModelWithSlugMixin, CloneableModelMixin, models.
     def get_siblings(self):
         return self.project.events.all()
 
-    def clone_related(self, onto):
-        kwargs = dict(attached_to=onto)
-        for a in self.attachments.all(): a.clone(overrides=kwargs)
-
 
 class Attachment (OrderedModelMixin, CloneableModelMixin, TimeStampedModel):
     url = models.URLField(max_length=2048)
@@ -731,8 +859,8 @@ class Section (OrderedModelMixin, ModelWithSlugMixin, CloneableModelMixin, TimeS
     def get_slug_basis(self):
         return self.menu_label or self.type
 
-    def get_all_slugs(self):
-        return [s.slug for s in self.project.sections.all()]
+    def get_slug_queryset(self):
+        return self.project.sections.all()
 
     def slug_exists(self, slug):
         return self.project.sections.filter(slug__iexact=slug).exists()
@@ -796,8 +924,209 @@ class Roundup (ModelWithSlugMixin, CloneableModelMixin, TimeStampedModel):
     def get_slug_basis(self):
         return self.title
 
-    def get_all_slugs(self):
-        return [r.slug for r in self.owner.roundups.all()]
+    def get_slug_queryset(self):
+        return self.owner.roundups.all()
 
     def slug_exists(self, slug):
         return self.owner.roundups.filter(slug__iexact=slug).exists()
+
+
+# ============================================================
+# Materialized project documents
+
+@python_2_unicode_compatible
+class ProjectDocument (models.Model):
+    """
+    The serialized form of a project, kept up to date so that reading a
+    project doesn't mean serializing it all over again (see
+    planbox_data.documents). A document with no data is stale.
+    """
+    project = models.OneToOneField('Project', primary_key=True, related_name='document')
+    data = JSONField(null=True, blank=True, load_kwargs={'object_pairs_hook': OrderedDict})
+    generation = models.PositiveIntegerField(default=0)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Document for project %s' % (self.project_id,)
+
+
+# ============================================================
+# Project versions
+
+def get_changed_project_id(instance):
+    """
+    Get the id of the project that a saved or deleted object belongs to.
+    """
+    if isinstance(instance, Project):
+        return instance.pk
+    elif isinstance(instance, Attachment):
+        # The attached object may already be gone if we're in the middle of a
+        # cascading delete; the attached object will touch the project itself.
+        return getattr(instance.attached_to, 'project_id', None)
+    else:
+        return instance.project_id
+
+def touch_project_version(sender, instance, **kwargs):
+    """
+    Bump the cached version of the project that a saved or deleted object
+    belongs to, so that any cached renderings of the project are invalidated.
+    """
+    project_id = get_changed_project_id(instance)
+    if project_id is not None:
+        touch_project(project_id)
+
+post_save.connect(touch_project_version, sender=Project, dispatch_uid="project-save-touch-version-signal")
+post_save.connect(touch_project_version, sender=Event, dispatch_uid="event-save-touch-version-signal")
+post_save.connect(touch_project_version, sender=Section, dispatch_uid="section-save-touch-version-signal")
+post_save.connect(touch_project_version, sender=Attachment, dispatch_uid="attachment-save-touch-version-signal")
+post_delete.connect(touch_project_version, sender=Project, dispatch_uid="project-delete-touch-version-signal")
+post_delete.connect(touch_project_version, sender=Event, dispatch_uid="event-delete-touch-version-signal")
+post_delete.connect(touch_project_version, sender=Section, dispatch_uid="section-delete-touch-version-signal")
+post_delete.connect(touch_project_version, sender=Attachment, dispatch_uid="attachment-delete-touch-version-signal")
+bulk_related_saved.connect(touch_project_version, sender=Project, dispatch_uid="project-bulk-related-touch-version-signal")
+bulk_related_saved.connect(touch_project_version, sender=Event, dispatch_uid="event-bulk-related-touch-version-signal")
+
+
+# ============================================================
+# Template catalogue versions
+
+def touch_template_catalogue_for_profile(sender, instance, **kwargs):
+    if instance.slug == settings.TEMPLATES_PROFILE:
+        touch_template_catalogue()
+
+def touch_template_catalogue_for_project(sender, instance, **kwargs):
+    # Use the project's owner if it's already loaded, to save a query.
+    owner = getattr(instance, Project._meta.get_field('owner').get_cache_name(), None)
+    if owner is not None:
+        is_template = (owner.slug == settings.TEMPLATES_PROFILE)
+    else:
+        is_template = Profile.objects.filter(pk=instance.owner_id, slug=settings.TEMPLATES_PROFILE).exists()
+
+    if is_template:
+        touch_template_catalogue()
+
+def touch_template_catalogue_for_project_template(sender, instance, **kwargs):
+    touch_template_catalogue()
+
+post_save.connect(touch_template_catalogue_for_profile, sender=Profile, dispatch_uid="profile-save-touch-template-catalogue-signal")
+post_save.connect(touch_template_catalogue_for_project, sender=Project, dispatch_uid="project-save-touch-template-catalogue-signal")
+post_save.connect(touch_template_catalogue_for_project_template, sender=ProfileProjectTemplate, dispatch_uid="project-template-save-touch-template-catalogue-signal")
+post_delete.connect(touch_template_catalogue_for_profile, sender=Profile, dispatch_uid="profile-delete-touch-template-catalogue-signal")
+post_delete.connect(touch_template_catalogue_for_project, sender=Project, dispatch_uid="project-delete-touch-template-catalogue-signal")
+post_delete.connect(touch_template_catalogue_for_project_template, sender=ProfileProjectTemplate, dispatch_uid="project-template-delete-touch-template-catalogue-signal")
+
+
+# ============================================================
+# Denormalized project summaries
+
+def update_project_summary(project_id):
+    """
+    Copy the content of the project's first text section into the project's
+    summary field. This is done with an UPDATE, so that the project's save
+    signals (and its updated_at) are left alone. Returns whether the summary
+    changed.
+    """
+    summary = ''
+    for section in Section.objects.filter(project_id=project_id, type='text').order_by('index')[:1]:
+        summary = section.details.get('content', '')
+
+    changed = Project.objects.filter(pk=project_id).exclude(summary=summary).update(summary=summary)
+    if changed:
+        for owner_id in Project.objects.filter(pk=project_id).values_list('owner_id', flat=True):
+            touch_roundup(owner_id)
+    return bool(changed)
+
+def update_summary_for_section(sender, instance, **kwargs):
+    update_project_summary(instance.project_id)
+
+def update_summary_for_bulk_sections(sender, instance, model, **kwargs):
+    if model is Section:
+        update_project_summary(instance.pk)
+
+post_save.connect(update_summary_for_section, sender=Section, dispatch_uid="section-save-update-summary-signal")
+post_delete.connect(update_summary_for_section, sender=Section, dispatch_uid="section-delete-update-summary-signal")
+bulk_related_saved.connect(update_summary_for_bulk_sections, sender=Project, dispatch_uid="project-bulk-sections-update-summary-signal")
+
+
+# ============================================================
+# Roundup versions
+
+def touch_roundup_for_project(sender, instance, **kwargs):
+    touch_roundup(instance.owner_id)
+
+def touch_roundup_for_profile(sender, instance, **kwargs):
+    touch_roundup(instance.pk)
+
+post_save.connect(touch_roundup_for_project, sender=Project, dispatch_uid="project-save-touch-roundup-signal")
+post_save.connect(touch_roundup_for_profile, sender=Profile, dispatch_uid="profile-save-touch-roundup-signal")
+post_delete.connect(touch_roundup_for_project, sender=Project, dispatch_uid="project-delete-touch-roundup-signal")
+post_delete.connect(touch_roundup_for_profile, sender=Profile, dispatch_uid="profile-delete-touch-roundup-signal")
+
+
+# ============================================================
+# Project document invalidation
+
+def invalidate_project_documents(**filters):
+    """
+    Mark the project documents matching the given filters as stale. This
+    happens in the same transaction as the change that made them stale, and
+    bumps their generation, so that a document built from the old data can't
+    be saved over the change (see planbox_data.documents).
+    """
+    ProjectDocument.objects\
+        .filter(**filters)\
+        .update(data=None, generation=F('generation') + 1)
+
+def invalidate_document_for_part(sender, instance, **kwargs):
+    # Objects cloned in bulk are accounted for once per batch, below.
+    if getattr(instance, '_cloning_in_batch', False):
+        return
+    project_id = get_changed_project_id(instance)
+    if project_id is not None:
+        invalidate_project_documents(project_id=project_id)
+
+def create_or_invalidate_document_for_project(sender, instance, created, **kwargs):
+    # Every project gets a document row as soon as it's created, so that the
+    # row is always there to be invalidated.
+    if created:
+        ProjectDocument.objects.create(project=instance)
+    else:
+        invalidate_project_documents(project_id=instance.pk)
+
+def mark_batch_clones(sender, pairs, **kwargs):
+    # A batch of clones may still be saved (or have their own relations
+    # cloned) one object at a time; rather than invalidating the document
+    # of their project for each of them, do it once when the batch is done.
+    for _, clone in pairs:
+        clone._cloning_in_batch = True
+
+def invalidate_documents_for_batch_clones(sender, pairs, **kwargs):
+    # Cloned attachments are covered by their events: either the events were
+    # cloned in a batch too, or bulk_related_saved is sent for them.
+    project_ids = set(clone.project_id for _, clone in pairs)
+    invalidate_project_documents(project_id__in=project_ids)
+
+def invalidate_documents_for_profile(sender, instance, **kwargs):
+    # Each project document includes its owner's details.
+    invalidate_project_documents(project__owner=instance)
+
+def invalidate_documents_for_user(sender, instance, **kwargs):
+    # ...including the owner's username.
+    invalidate_project_documents(project__owner__auth=instance)
+
+post_save.connect(create_or_invalidate_document_for_project, sender=Project, dispatch_uid="project-save-document-signal")
+post_save.connect(invalidate_document_for_part, sender=Event, dispatch_uid="event-save-document-signal")
+post_save.connect(invalidate_document_for_part, sender=Section, dispatch_uid="section-save-document-signal")
+post_save.connect(invalidate_document_for_part, sender=Attachment, dispatch_uid="attachment-save-document-signal")
+post_delete.connect(invalidate_document_for_part, sender=Event, dispatch_uid="event-delete-document-signal")
+post_delete.connect(invalidate_document_for_part, sender=Section, dispatch_uid="section-delete-document-signal")
+post_delete.connect(invalidate_document_for_part, sender=Attachment, dispatch_uid="attachment-delete-document-signal")
+bulk_related_saved.connect(invalidate_document_for_part, sender=Project, dispatch_uid="project-bulk-related-document-signal")
+bulk_related_saved.connect(invalidate_document_for_part, sender=Event, dispatch_uid="event-bulk-related-document-signal")
+clone_pre_save_batch.connect(mark_batch_clones, sender=Event, dispatch_uid="event-clone-mark-document-signal")
+clone_pre_save_batch.connect(mark_batch_clones, sender=Section, dispatch_uid="section-clone-mark-document-signal")
+clone_pre_save_batch.connect(mark_batch_clones, sender=Attachment, dispatch_uid="attachment-clone-mark-document-signal")
+clone_post_save_batch.connect(invalidate_documents_for_batch_clones, sender=Event, dispatch_uid="event-clone-batch-document-signal")
+clone_post_save_batch.connect(invalidate_documents_for_batch_clones, sender=Section, dispatch_uid="section-clone-batch-document-signal")
+post_save.connect(invalidate_documents_for_profile, sender=Profile, dispatch_uid="profile-save-document-signal")
+post_save.connect(invalidate_documents_for_user, sender=settings.AUTH_USER_MODEL, dispatch_uid="user-save-document-signal")
@@ -17,7 +17,10 @@ class OwnerAuthorizesOrReadOnly (permissions.IsAuthenticatedOrReadOnly):
         if not user.is_authenticated():
             return False
 
-        return project.owner.authorizes(user)
+        # This is the same as asking whether the project owner authorizes the
+        # user, but uses the flag from ProjectQuerySet.annotate_permissions
+        # when there is one.
+        return project.editable_by(user)
 
     def has_object_permission(self, request, view, project):
         if request.user and request.user.is_superuser:
@@ -0,0 +1,103 @@
+"""
+Tracking of who has a project open in the editor.
+
+Editors announce that they have a project open when they load it and then
+every couple of minutes after that. Presence is kept in the Django cache
+rather than on the project row, so those heartbeats don't rewrite the
+project, bump its updated_at, or invalidate cached renderings of it. A
+presence entry expires on its own if its holder stops sending heartbeats.
+
+Claims are made with cache.add, so when two people open a project at the same
+time exactly one of them gets it. When someone new opens a project, the
+opener and time are also written back to the project's last_opened_by and
+last_opened_at columns (with a plain UPDATE, so no signals fire), unless
+the PROJECT_PRESENCE_WRITE_BACK setting is False.
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now, timedelta
+
+
+PRESENCE_TIMEOUT = timedelta(minutes=2)
+
+# The possible outcomes of a claim
+OPENED = 'opened'
+REFRESHED = 'refreshed'
+CONFLICT = 'conflict'
+
+
+def get_presence_key(project_id):
+    return 'planbox:project-presence:%s' % (project_id,)
+
+
+def get_timeout_seconds():
+    return int(PRESENCE_TIMEOUT.total_seconds())
+
+
+def get_presence(project_id):
+    """
+    Get a dict with the user_id and opened_at time of whoever currently has
+    the project open, or None if nobody does.
+    """
+    presence = cache.get(get_presence_key(project_id))
+    if presence is None or now() - presence['opened_at'] >= PRESENCE_TIMEOUT:
+        return None
+    return presence
+
+
+def claim(project_id, user_id, opened_at=None):
+    """
+    Try to mark the project as open by the given user. Returns a pair of the
+    outcome (OPENED, REFRESHED, or CONFLICT) and the presence of whoever has
+    the project open afterwards.
+    """
+    key = get_presence_key(project_id)
+    presence = {'user_id': user_id, 'opened_at': opened_at or now()}
+
+    for _ in range(2):
+        if cache.add(key, presence, get_timeout_seconds()):
+            write_back(project_id, presence)
+            return OPENED, presence
+
+        current = get_presence(project_id)
+        if current is None:
+            # The entry expired or was released since we tried to add ours.
+            cache.delete(key)
+            continue
+
+        if current['user_id'] == user_id:
+            cache.set(key, presence, get_timeout_seconds())
+            return REFRESHED, presence
+
+        return CONFLICT, current
+
+    # Someone else keeps beating us to it; report whoever holds it now.
+    current = get_presence(project_id)
+    return (CONFLICT, current) if current else (OPENED, presence)
+
+
+def release(project_id, user_id=None):
+    """
+    Mark the project as no longer open. If a user_id is given, only release
+    the project if that user is the one that has it open.
+    """
+    if user_id is not None:
+        current = get_presence(project_id)
+        if current is None or current['user_id'] != user_id:
+            return False
+    cache.delete(get_presence_key(project_id))
+    return True
+
+
+def write_back(project_id, presence):
+    if not getattr(settings, 'PROJECT_PRESENCE_WRITE_BACK', True):
+        return
+
+    # Avoid a circular import; models uses this module.
+    from planbox_data.models import Project
+    Project.objects.filter(pk=project_id).update(
+        last_opened_by=presence['user_id'],
+        last_opened_at=presence['opened_at'])
@@ -0,0 +1,71 @@
+"""
+Pages of the project listings on roundup pages.
+
+A roundup lists the public projects of its owner. Rather than serializing
+all of them at once, they are listed a page at a time, in order of id; each
+page comes with a cursor (the id of its last project) from which to start
+the next one. Pages are fetched with a constant number of queries, however
+many projects the owner has: the projects' summaries are read from their
+denormalized summary field instead of from their sections, and their owner
+comes along in the same query.
+
+The first page of each roundup, which is embedded in the roundup page, is
+cached under the owner's roundup version stamp (see planbox_data.cache).
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from planbox_data.cache import get_roundup_version
+from planbox_data.models import Project
+from planbox_data.serializers import ProjectSummarySerializer
+
+
+# The number of projects in each page of a roundup's listing
+ROUNDUP_PAGE_SIZE = getattr(settings, 'ROUNDUP_PAGE_SIZE', 20)
+# The most projects a client may ask for in one page
+ROUNDUP_MAX_PAGE_SIZE = getattr(settings, 'ROUNDUP_MAX_PAGE_SIZE', 100)
+# Seconds for which to cache the first page of each roundup
+ROUNDUP_CACHE_TIMEOUT = getattr(settings, 'ROUNDUP_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_roundup_projects(owner_id):
+    return Project.objects\
+        .filter(owner_id=owner_id, public=True)\
+        .select_related('owner', 'owner__auth')\
+        .order_by('pk')
+
+
+def get_project_page(owner_id, after=None, page_size=None):
+    """
+    Get a page of the serialized public projects of the given owner,
+    starting after the project with the given id. Returns the serialized
+    projects, and the cursor for the next page (None if this is the last).
+    """
+    page_size = max(1, min(page_size or ROUNDUP_PAGE_SIZE, ROUNDUP_MAX_PAGE_SIZE))
+    projects = get_roundup_projects(owner_id)
+    if after is not None:
+        projects = projects.filter(pk__gt=after)
+
+    # Get one more than we need, to know whether there is another page.
+    projects = list(projects[:page_size + 1])
+    has_more = len(projects) > page_size
+    projects = projects[:page_size]
+
+    serializer = ProjectSummarySerializer(projects, many=True)
+    next_cursor = projects[-1].pk if has_more else None
+    return serializer.data, next_cursor
+
+
+def get_first_project_page(owner_id):
+    """
+    Get the first page of the given owner's projects, from the cache if it's
+    there.
+    """
+    key = 'planbox:roundup-projects:%s:%s' % (owner_id, get_roundup_version(owner_id))
+    page = cache.get(key)
+    if page is None:
+        page = get_project_page(owner_id)
+        cache.set(key, page, ROUNDUP_CACHE_TIMEOUT)
+    return page
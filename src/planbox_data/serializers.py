@@ -1,6 +1,11 @@
+from django.contrib.contenttypes.generic import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Model
+from django.utils.timezone import now
 from rest_framework import serializers
-from planbox_data import models, fields
+from planbox_data import models, fields, bulk
 import bleach, re, json
 
 
@@ -56,15 +61,30 @@ class AddRemoveModelSerializer (serializers.ModelSerializer):
     See https://github.com/tomchristie/django-rest-framework/pull/1902 for
     more information.
 
+    When bulk_save_related is True, nested lists of related objects are
+    written in bulk instead of one object at a time: the incoming objects are
+    compared with the existing rows, and only the rows that were added,
+    changed, or removed are written, with one INSERT, a batched UPDATE, and
+    one DELETE per list, all in a single transaction. No save signals are
+    sent for objects written in bulk; bulk_related_saved is sent for their
+    parent instead.
+
     TODO: This mixin may be unnecessary after DRF3.
 
     """
+    bulk_save_related = False
+
     def save_object(self, obj, **kwargs):
         """
         Save the deserialized object.
         """
-        from rest_framework.serializers import RelationsList
+        if self.bulk_save_related:
+            with transaction.atomic():
+                self._save_object(obj, **kwargs)
+        else:
+            self._save_object(obj, **kwargs)
 
+    def _save_object(self, obj, **kwargs):
         if getattr(obj, '_nested_forward_relations', None):
             # Nested relationships need to be saved before we can save the
             # parent instance.
@@ -74,10 +94,19 @@ class AddRemoveModelSerializer (serializers.ModelSerializer):
                 setattr(obj, field_name, sub_object)
 
         obj.save(**kwargs)
+        self.save_related(obj)
+
+    def save_related(self, obj):
+        from rest_framework.serializers import RelationsList
 
         if getattr(obj, '_m2m_data', None):
             for accessor_name, object_list in obj._m2m_data.items():
-                setattr(obj, accessor_name, object_list)
+                field = obj._meta.get_field_by_name(accessor_name)[0]
+                if isinstance(field, GenericRelation) and self.can_save_in_bulk(object_list):
+                    # Nested generic relationship, in bulk
+                    self.save_generic_in_bulk(obj, object_list, field)
+                else:
+                    setattr(obj, accessor_name, object_list)
             del(obj._m2m_data)
 
         if getattr(obj, '_related_data', None):
@@ -87,7 +116,12 @@ class AddRemoveModelSerializer (serializers.ModelSerializer):
                 in obj._meta.get_all_related_objects_with_model()
             ])
             for accessor_name, related in obj._related_data.items():
-                if isinstance(related, RelationsList):
+                if isinstance(related, RelationsList) and self.can_save_in_bulk(related):
+                    # Nested reverse fk relationship, in bulk
+                    fk_field = related_fields[accessor_name].field.name
+                    self.save_in_bulk(obj, related, related_fields[accessor_name].model, {fk_field: obj})
+
+                elif isinstance(related, RelationsList):
                     # Delete any removed objects
                     if related._deleted:
                         [self.delete_object(item) for item in related._deleted]
@@ -108,6 +142,109 @@ class AddRemoveModelSerializer (serializers.ModelSerializer):
                     setattr(obj, accessor_name, related)
             del(obj._related_data)
 
+    def can_save_in_bulk(self, items):
+        # Objects that have nested forward relations need those saved first,
+        # so leave them to the one-at-a-time path.
+        return self.bulk_save_related and all(
+            isinstance(item, Model) and
+            not getattr(item, '_nested_forward_relations', None)
+            for item in items)
+
+    def save_generic_in_bulk(self, parent, items, field):
+        RelatedModel = field.rel.to
+        for virtual_field in RelatedModel._meta.virtual_fields:
+            if (isinstance(virtual_field, GenericForeignKey) and
+                    virtual_field.ct_field == field.content_type_field_name and
+                    virtual_field.fk_field == field.object_id_field_name):
+                # Set the parent object itself too, so that it doesn't get
+                # looked up again for each item.
+                for item in items:
+                    setattr(item, virtual_field.name, parent)
+
+        self.save_in_bulk(parent, items, RelatedModel, {
+            field.content_type_field_name: ContentType.objects.get_for_model(parent),
+            field.object_id_field_name: parent.pk,
+        })
+
+    def save_in_bulk(self, parent, items, RelatedModel, parent_fields):
+        """
+        Make the set of RelatedModel instances that belong to the parent match
+        the given items, writing only what has changed.
+
+        parent_fields -- A dict of the field values that relate a RelatedModel
+            instance to the parent (e.g., {'project': project}).
+        """
+        for item in items:
+            for name, value in parent_fields.items():
+                setattr(item, name, value)
+
+        existing = dict((original.pk, original) for original in RelatedModel.objects.filter(**parent_fields))
+        new_items = [item for item in items if item.pk is None]
+        current_time = now()
+
+        # Remove the rows that are not in the incoming data. This happens
+        # first, so that their slugs are free to be reused below.
+        incoming_pks = set(item.pk for item in items)
+        deleted_pks = [pk for pk in existing if pk not in incoming_pks]
+        if deleted_pks:
+            RelatedModel.objects.filter(pk__in=deleted_pks).delete()
+
+        # Update the rows that changed. The timestamps are left out of the
+        # comparison, since they lose their microseconds on the round trip
+        # through the API, and aren't for clients to change anyway.
+        changes = []
+        for item in items:
+            if item.pk in existing:
+                changed = bulk.get_changed_fields(existing[item.pk], item, exclude=['created_at', 'updated_at'])
+                if changed and isinstance(item, models.TimeStampedModel):
+                    item.updated_at = current_time
+                    changed.append('updated_at')
+                if changed:
+                    changes.append((item, changed))
+        bulk.bulk_update(RelatedModel, changes)
+
+        # Insert the new rows, assigning their indexes and slugs in memory.
+        if new_items:
+            self.prepare_new_items(items, new_items, current_time)
+            self.insert_in_bulk(RelatedModel, new_items)
+
+        if changes or new_items:
+            models.bulk_related_saved.send(sender=parent.__class__, instance=parent, model=RelatedModel)
+
+        # Finally, save anything nested within the items (e.g., an event's
+        # attachments).
+        for item in items:
+            self.save_related(item)
+
+    def prepare_new_items(self, items, new_items, current_time):
+        next_index = None
+        slugs = set(item.slug for item in items if getattr(item, 'slug', None))
+
+        for item in new_items:
+            if isinstance(item, models.OrderedModelMixin) and item.index is None:
+                if next_index is None:
+                    indexes = [other.index for other in items if other.index is not None]
+                    next_index = max(indexes) + 1 if indexes else 0
+                item.index = next_index
+                next_index += 1
+
+            if isinstance(item, models.ModelWithSlugMixin):
+                slugs.add(item.ensure_slug(existing_slugs=slugs))
+
+            if isinstance(item, models.TimeStampedModel):
+                item.created_at = item.updated_at = current_time
+
+    def insert_in_bulk(self, RelatedModel, new_items):
+        """
+        Insert the new items, and set their primary keys. Bulk inserts are
+        only used when the rows can be found again by a unique key (e.g., a
+        section's project and slug); otherwise the rows are inserted one at a
+        time.
+        """
+        if not bulk.bulk_create_with_pks(RelatedModel, new_items):
+            for item in new_items:
+                item.save()
+
 
 class SlugValidationMixin (object):
     def validate_slug(self, attrs, source):
@@ -281,6 +418,8 @@ class EventSerializer (OrderedSerializerMixin, AddRemoveModelSerializer):
     attachments = AttachmentSerializer(many=True, required=False, allow_add_remove=True)
     details = serializers.WritableField(required=False)
 
+    bulk_save_related = True
+
     class Meta:
         model = models.Event
         exclude = ('project', 'index')
@@ -291,10 +430,31 @@ class SectionSerializer (OrderedSerializerMixin, AddRemoveModelSerializer):
     # CharField. We want something more direct.
     details = serializers.WritableField(required=False)
 
+    # Keys that the server sets in a section's details after the section is
+    # saved (e.g., the URL of a Shareabouts dataset that is cloned in the
+    # background). Clients may not have seen them yet; when the incoming
+    # details leave out any that the section has, they were loaded before the
+    # server set them, so the section's values for all of these keys are kept.
+    server_detail_keys = ('dataset_url', 'dataset_status')
+
     class Meta:
         model = models.Section
         exclude = ('project', 'index')
 
+    def restore_object(self, attrs, instance=None):
+        details = attrs.get('details')
+        if instance is not None and isinstance(details, dict) and isinstance(instance.details, dict):
+            if any(key in instance.details and key not in details
+                   for key in self.server_detail_keys):
+                details = dict(details)
+                for key in self.server_detail_keys:
+                    if key in instance.details:
+                        details[key] = instance.details[key]
+                    else:
+                        details.pop(key, None)
+                attrs['details'] = details
+        return super(SectionSerializer, self).restore_object(attrs, instance)
+
 
 class ProjectSerializer (SlugValidationMixin, AddRemoveModelSerializer):
     events = EventSerializer(many=True, allow_add_remove=True)
@@ -313,14 +473,16 @@ class ProjectSerializer (SlugValidationMixin, AddRemoveModelSerializer):
 
     geometry = fields.GeometryField(required=False)
 
+    bulk_save_related = True
+
     class Meta:
         model = models.Project
-        exclude = ('last_opened_at', 'last_opened_by', 'last_saved_at', 'last_saved_by', 'expires_at', 'payment_type',)
+        exclude = ('summary', 'last_opened_at', 'last_opened_by', 'last_saved_at', 'last_saved_by', 'expires_at', 'payment_type',)
 
 
 class FullProjectSerializer (ProjectSerializer):
     class Meta (ProjectSerializer.Meta):
-        exclude = ('last_opened_at', 'last_opened_by', 'last_saved_at', 'last_saved_by')
+        exclude = ('summary', 'last_opened_at', 'last_opened_by', 'last_saved_at', 'last_saved_by')
         read_only_fields = ('expires_at', 'payment_type',)
 
 
@@ -338,33 +500,44 @@ class ProjectActivitySerializer (AddRemoveModelSerializer):
 
 class ProjectSummarySerializer (AddRemoveModelSerializer):
     owner = AssociatedProfileSerializer(required=True)
-    summary = serializers.SerializerMethodField('get_project_summary')
     geometry = fields.GeometryField(required=False)
     details = serializers.WritableField()
 
     class Meta:
         model = models.Project
         fields = ('id', 'slug', 'title', 'summary', 'owner', 'geometry', 'location', 'details', 'expires_at')
-        read_only_fields = ('expires_at',)
-
-    def get_project_summary(self, project):
-        return project.get_summary()
+        read_only_fields = ('summary', 'expires_at',)
 
 
 class RoundupSerializer (AddRemoveModelSerializer):
     projects = serializers.SerializerMethodField('get_project_summaries')
+    projects_next = serializers.SerializerMethodField('get_next_projects_url')
     owner = AssociatedProfileSerializer(include=['description'])
 
     class Meta:
         model = models.Roundup
 
+    def get_first_project_page(self, roundup):
+        # Avoid a circular import; roundups uses this module.
+        from planbox_data.roundups import get_first_project_page
+        return get_first_project_page(roundup.owner_id)
+
     def get_project_summaries(self, roundup):
-        # For now, we just serialize the complete set of projects owned by the
-        # roundup owner.
-        qs = roundup.owner.projects.all().filter(public=True)
+        # Only the first page of the owner's public projects is included;
+        # the rest can be fetched from the projects_next URL.
+        projects, _ = self.get_first_project_page(roundup)
+        return projects
+
+    def get_next_projects_url(self, roundup):
+        _, next_cursor = self.get_first_project_page(roundup)
+        return get_roundup_projects_url(roundup, next_cursor)
+
 
-        serializer = ProjectSummarySerializer(qs, many=True)
-        return serializer.data
+def get_roundup_projects_url(roundup, cursor):
+    if cursor is None:
+        return None
+    path = reverse('roundup-project-list', kwargs={'roundup_pk': roundup.pk})
+    return '%s?after=%s' % (path, cursor)
 
 
 # ============================================================
@@ -396,5 +569,5 @@ class TemplateProjectSerializer (serializers.ModelSerializer):
 
     class Meta:
         model = models.Project
-        exclude = ('owner', 'slug', 'id', 'public', 'expires_at',
+        exclude = ('owner', 'slug', 'id', 'public', 'expires_at', 'summary',
             'last_opened_at', 'last_opened_by', 'last_saved_at', 'last_saved_by')
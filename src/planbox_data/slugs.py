@@ -0,0 +1,66 @@
+"""
+Allocation of unique slugs.
+
+To find a free version of a slug, we only ask the database about the slugs
+that could conflict with it -- the slug itself, and the slugs that share its
+prefix -- so that the lookups can be answered from the index on the slug
+column instead of scanning every slug in the table. If the slug is taken, the
+new slug gets the suffix after the largest numeric suffix in use, e.g.:
+
+    my-team, my-team-2, my-team-7  =>  my-team-8
+
+Only that one slug is fetched: the database orders the numerically suffixed
+slugs by length and then by value (which, without leading zeros, orders them
+by their suffixes), and returns the first.
+
+Another process may still take the same slug between our choosing it and
+saving it, so ModelWithSlugMixin retries the save with a fresh slug if it
+fails with an IntegrityError and the slug turns out to be taken.
+"""
+
+from __future__ import unicode_literals
+
+import re
+from django.db import connections
+
+
+# How many times to try saving with a freshly allocated slug before giving up
+SLUG_ALLOCATION_ATTEMPTS = 3
+
+
+def get_max_suffix(slug, taken_slugs):
+    """
+    Get the largest integer n such that "<slug>-<n>" is in taken_slugs, or 1
+    if there is none.
+    """
+    pattern = re.compile('^%s-([0-9]+)$' % (re.escape(slug),))
+    suffixes = [int(match.group(1)) for match in map(pattern.match, taken_slugs) if match]
+    return max(suffixes + [1])
+
+
+def allocate_slug(slug, queryset, field_name='slug'):
+    """
+    Get a version of the given slug that is not used by any of the objects
+    in the queryset.
+
+    Arguments:
+
+    slug -- The preferred slug.
+    queryset -- The objects with respect to which the slug must be unique
+        (e.g., the other projects belonging to the same owner).
+    field_name -- The name of the slug field on the queryset's model.
+
+    """
+    if not queryset.filter(**{field_name: slug}).exists():
+        return slug
+
+    qn = connections[queryset.db].ops.quote_name
+    column = '%s.%s' % (qn(queryset.model._meta.db_table),
+                        qn(queryset.model._meta.get_field(field_name).column))
+    taken_slugs = queryset\
+        .filter(**{field_name + '__startswith': slug + '-',
+                   field_name + '__regex': r'^%s-[1-9][0-9]*$' % (re.escape(slug),)})\
+        .extra(select={'slug_length': 'LENGTH(%s)' % (column,)},
+               order_by=['-slug_length', '-' + field_name])\
+        .values_list(field_name, flat=True)[:1]
+    return '%s-%s' % (slug, get_max_suffix(slug, taken_slugs) + 1)
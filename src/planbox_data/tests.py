@@ -1,16 +1,26 @@
 from __future__ import unicode_literals
 
+import json
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django_nose.tools import assert_num_queries
-from nose.tools import assert_equal, assert_in, assert_raises, ok_, assert_not_equal
-from rest_framework.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_raises, ok_, assert_not_equal
+from rest_framework.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
 
 from django.contrib.auth.models import User as UserAuth, AnonymousUser
-from planbox_data.models import Profile, Project, Event, Attachment
+from planbox_data import catalogue, documents, presence, roundups
+from planbox_data.cache import get_project_version, get_template_catalogue_version
+from planbox_data.cloning import clone_post_save, clone_post_save_batch, clone_pre_save_batch
+from planbox_data.membership import get_team_ids_iterative, get_team_ids_recursive, supports_recursive_queries
+from planbox_data.models import Profile, Project, Event, Attachment, Section, ProfileProjectTemplate, Roundup, ProjectDocument
 from planbox_data.permissions import OwnerAuthorizesOrReadOnly
-from planbox_data.serializers import ProjectSerializer, ProfileSerializer
+from planbox_data.serializers import ProjectSerializer, ProfileSerializer, RoundupSerializer
 from planbox_data.views import router
 
 
@@ -168,6 +178,69 @@ class ProjectModelTests (TestCase):
             [events[0].pk] * len(attachments))
 
 
+    def create_project_tree(self, owner, slug, num_events, num_sections):
+        project = Project.objects.create(slug=slug, title='x', location='x', owner=owner)
+        for i in range(num_events):
+            event = Event.objects.create(project=project, slug='event-%s' % i, label='Event %s' % i)
+            for j in range(2):
+                Attachment.objects.create(attached_to=event, url='http://example.com/file-%s' % j)
+        for i in range(num_sections):
+            Section.objects.create(project=project, type='text', slug='section-%s' % i)
+        return project
+
+    def test_clone_query_count_does_not_depend_on_project_size(self):
+        owner = Profile.objects.create(slug='owner')
+        small = self.create_project_tree(owner, 'small', num_events=2, num_sections=2)
+        large = self.create_project_tree(owner, 'large', num_events=20, num_sections=30)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            small.clone()
+        with CaptureQueriesContext(connection) as large_queries:
+            new_project = large.clone()
+
+        assert_equal(len(small_queries), len(large_queries))
+        assert_equal(new_project.slug, 'large-2')
+        assert_equal([s.slug for s in new_project.sections.all()], ['section-%s' % i for i in range(30)])
+        assert_equal(Attachment.objects.filter(attached_to_id__in=new_project.events.values('pk')).count(), 40)
+        ok_(all(e.attachments.count() == 2 for e in new_project.events.all()))
+
+    def test_clone_sends_batch_signals_once_per_level(self):
+        owner = Profile.objects.create(slug='owner')
+        project = self.create_project_tree(owner, 'project', num_events=3, num_sections=4)
+
+        received = []
+        def receiver(sender, pairs, **kwargs):
+            received.append((sender, len(pairs), all(new.pk is None for _, new in pairs)))
+        clone_pre_save_batch.connect(receiver, dispatch_uid='test-clone-receiver')
+        try:
+            project.clone()
+        finally:
+            clone_pre_save_batch.disconnect(dispatch_uid='test-clone-receiver')
+
+        assert_equal(received, [(Project, 1, True), (Event, 3, True), (Attachment, 6, True), (Section, 4, True)])
+
+    def test_clone_post_save_is_only_sent_for_clones_with_keys(self):
+        owner = Profile.objects.create(slug='owner')
+        project = self.create_project_tree(owner, 'project', num_events=1, num_sections=1)
+
+        received, received_batches = [], []
+        def receiver(sender, orig_inst, new_inst, **kwargs):
+            received.append((sender, new_inst.pk is not None))
+        def batch_receiver(sender, pairs, **kwargs):
+            received_batches.append((sender, len(pairs)))
+        clone_post_save.connect(receiver, dispatch_uid='test-clone-receiver')
+        clone_post_save_batch.connect(batch_receiver, dispatch_uid='test-clone-batch-receiver')
+        try:
+            project.clone()
+        finally:
+            clone_post_save.disconnect(dispatch_uid='test-clone-receiver')
+            clone_post_save_batch.disconnect(dispatch_uid='test-clone-batch-receiver')
+
+        # The attachments are inserted without their keys.
+        assert_equal(received, [(Event, True), (Section, True), (Project, True)])
+        assert_equal(received_batches, [(Attachment, 2), (Event, 1), (Section, 1), (Project, 1)])
+
+
 class UserModelTests (PlanBoxTestCase):
     def test_str_requires_no_extra_queries(self):
         '''
@@ -237,6 +310,123 @@ class ProfileModelTests (PlanBoxTestCase):
         ok_(user.profile.authorizes(member))
         ok_(not member.profile.authorizes(user))
 
+    def test_profile_authorizes_members_of_nested_teams(self):
+        member = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        outsider = UserAuth.objects.create_user(username='someone-else', password='345')
+        org = Profile.objects.create(slug='org')
+        department = Profile.objects.create(slug='department')
+        group = Profile.objects.create(slug='group')
+
+        department.teams.add(org)
+        group.teams.add(department)
+        member.profile.teams.add(group)
+
+        ok_(org.authorizes(member))
+        ok_(department.authorizes(member))
+        ok_(group.authorizes(member))
+        ok_(not org.authorizes(outsider))
+        ok_(not member.profile.authorizes(outsider))
+
+    def test_team_membership_with_cycles(self):
+        member = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        outsider = UserAuth.objects.create_user(username='someone-else', password='345')
+        team1 = Profile.objects.create(slug='team1')
+        team2 = Profile.objects.create(slug='team2')
+        team3 = Profile.objects.create(slug='team3')
+
+        team1.teams.add(team2)
+        team2.teams.add(team3)
+        team3.teams.add(team1)
+        member.profile.teams.add(team2)
+
+        ok_(team1.has_member(member))
+        ok_(team2.has_member(member))
+        ok_(team3.has_member(member))
+        ok_(not team1.has_member(outsider))
+
+        expected = set([team1.id, team2.id, team3.id])
+        assert_equal(get_team_ids_iterative([member.profile.id]), expected)
+        if supports_recursive_queries():
+            assert_equal(get_team_ids_recursive([member.profile.id]), expected)
+
+    def test_team_membership_is_memoized_on_the_user(self):
+        member = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        team1 = Profile.objects.create(slug='team1')
+        team2 = Profile.objects.create(slug='team2')
+        member.profile.teams.add(team1)
+
+        ok_(team1.authorizes(member))
+        with assert_num_queries(0):
+            ok_(team1.authorizes(member))
+            ok_(not team2.authorizes(member))
+
+        # Changing memberships invalidates the memo
+        member.profile.teams.add(team2)
+        ok_(team2.authorizes(member))
+
+
+class SlugAllocationTests (PlanBoxTestCase):
+    def test_slug_gets_the_suffix_after_the_largest_in_use(self):
+        for slug in ['my-team', 'my-team-2', 'my-team-7', 'my-team-other', 'my-team-10a']:
+            Profile.objects.create(slug=slug)
+
+        team = Profile.objects.create(name='My Team')
+        assert_equal(team.slug, 'my-team-8')
+
+        team = Profile.objects.create(name='My Team Other')
+        assert_equal(team.slug, 'my-team-other-2')
+
+    def test_slug_lookup_does_not_scan_all_slugs(self):
+        Profile.objects.create(slug='my-team')
+        Profile.objects.create(slug='another-team')
+        team = Profile(name='My Team')
+
+        with CaptureQueriesContext(connection) as captured:
+            team.ensure_slug()
+        assert_equal(team.slug, 'my-team-2')
+        ok_(all('WHERE' in q['sql'] for q in captured.captured_queries))
+
+    def test_slug_is_reallocated_if_taken_before_save(self):
+        Profile.objects.create(slug='my-team')
+        team = Profile(name='My Team')
+
+        # Simulate another process having taken the slug after we looked.
+        calls = []
+        def get_slug_queryset():
+            calls.append(None)
+            return Profile.objects.none() if len(calls) == 1 else Profile.objects.all()
+        team.get_slug_queryset = get_slug_queryset
+
+        team.save()
+        assert_equal(team.slug, 'my-team-2')
+        # Allocate, check that the slug was taken, and allocate again.
+        assert_equal(len(calls), 3)
+
+    def test_other_integrity_errors_are_not_retried(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        team = Profile(name='My Team', auth=auth)
+
+        calls = []
+        def get_slug_queryset():
+            calls.append(None)
+            return Profile.objects.all()
+        team.get_slug_queryset = get_slug_queryset
+
+        # The profile's user already has a profile.
+        with assert_raises(IntegrityError):
+            team.save()
+        assert_equal(len(calls), 2)
+
+    def test_slug_suffixes_are_compared_as_numbers(self):
+        for slug in ['my-team', 'my-team-9', 'my-team-10', 'my-team-010', 'my-team-3-4']:
+            Profile.objects.create(slug=slug)
+        team = Profile(name='My Team')
+
+        with CaptureQueriesContext(connection) as captured:
+            team.ensure_slug()
+        assert_equal(team.slug, 'my-team-11')
+        ok_(all('LIMIT' in q['sql'] for q in captured.captured_queries))
+
 
 class ProjectSerializerTests (PlanBoxTestCase):
     def test_project_with_empty_title_is_invalid(self):
@@ -384,6 +574,68 @@ class ProjectSerializerTests (PlanBoxTestCase):
         assert_equal(new_event.attachments.all()[0].pk, attachments[1].pk)
         assert_equal(new_event.attachments.all()[2].pk, attachments[0].pk)
 
+    def test_nested_data_is_saved_in_bulk(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        profile = auth.profile
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=profile)
+        sections = [Section.objects.create(project=project, type='text', slug='section-%s' % i, label='section %s' % i)
+                    for i in range(10)]
+        event = Event.objects.create(label='test label', project=project)
+        attachments = [
+            Attachment.objects.create(attached_to=event, label='attachment 1', url='http://example.com/1'),
+            Attachment.objects.create(attached_to=event, label='attachment 2', url='http://example.com/2'),
+        ]
+        version = get_project_version(project.pk)
+
+        data = ProjectSerializer(project).data
+        data['sections'][3]['label'] = 'changed'
+        data['sections'][5]['label'] = 'also changed'
+        del data['sections'][9]
+        data['sections'].append({'type': 'text'})
+        data['sections'].append({'type': 'text'})
+        data['events'][0]['attachments'].pop(0)
+        del data['geometry']
+
+        serializer = ProjectSerializer(project, data=data)
+        ok_(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as captured:
+            serializer.save()
+
+        # The two changed sections are written with one UPDATE, and the new
+        # ones with one INSERT.
+        section_updates = [q for q in captured.captured_queries if 'UPDATE "planbox_data_section"' in q['sql']]
+        section_inserts = [q for q in captured.captured_queries if 'INSERT INTO "planbox_data_section"' in q['sql']]
+        assert_equal(len(section_updates), 1)
+        assert_equal(len(section_inserts), 1)
+
+        assert_equal([s.label for s in project.sections.all()][2:7], ['section 2', 'changed', 'section 4', 'also changed', 'section 6'])
+        assert_equal(project.sections.count(), 11)
+        assert_equal(list(project.sections.values_list('slug', flat=True))[-2:], ['text', 'text-2'])
+        assert_equal(list(project.sections.values_list('index', flat=True)), list(range(11)))
+        ok_(all(s['id'] is not None for s in ProjectSerializer(project).data['sections']))
+        assert_equal(Section.objects.get(pk=sections[4].pk).updated_at, sections[4].updated_at)
+
+        # Only the removed attachment is deleted; the kept one is not re-created.
+        assert_equal([a.pk for a in event.attachments.all()], [attachments[1].pk])
+        assert_not_equal(get_project_version(project.pk), version)
+
+    def test_json_details_are_saved_in_bulk_as_values(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        profile = auth.profile
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=profile)
+        section = Section.objects.create(project=project, type='text', slug='section', label='section',
+                                         details={'content': 'old content'})
+
+        data = ProjectSerializer(project).data
+        data['sections'][0]['details'] = {'content': 'new content'}
+        del data['geometry']
+
+        serializer = ProjectSerializer(project, data=data)
+        ok_(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        assert_equal(Section.objects.get(pk=section.pk).details, {'content': 'new content'})
+
     def test_invalid_project_does_not_raise_exception(self):
         serializer = ProjectSerializer(data={
             # Title and owner is required
@@ -463,6 +715,561 @@ class ProjectSerializerTests (PlanBoxTestCase):
         assert_equal(project.geometry.y, 5.0)
 
 
+class ProjectQuerySetTests (PlanBoxTestCase):
+    def create_project(self, owner, slug, num_events, num_attachments):
+        project = Project.objects.create(slug=slug, title='x', location='x', owner=owner)
+        for i in range(num_events):
+            event = Event.objects.create(label='event %s' % i, project=project)
+            for j in range(num_attachments):
+                Attachment.objects.create(attached_to=event, label='attachment %s' % j, url='http://example.com/%s' % j)
+        Section.objects.create(project=project, type='text', menu_label='Intro')
+        return project
+
+    def count_serialization_queries(self, project):
+        with CaptureQueriesContext(connection) as captured:
+            project = Project.objects.prefetch_for_serialization().get(pk=project.pk)
+            data = ProjectSerializer(project).data
+        return len(captured), data
+
+    def test_serialization_query_count_does_not_depend_on_project_size(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        small_project = self.create_project(auth.profile, 'small', 1, 1)
+        large_project = self.create_project(auth.profile, 'large', 40, 5)
+
+        # Serialize once up front so that lazily cached lookups (e.g., content
+        # types for the generic attachments) don't get counted.
+        self.count_serialization_queries(small_project)
+
+        small_count, small_data = self.count_serialization_queries(small_project)
+        large_count, large_data = self.count_serialization_queries(large_project)
+        assert_equal(small_count, large_count)
+
+        assert_equal(len(large_data['events']), 40)
+        assert_equal([len(e['attachments']) for e in large_data['events']], [5] * 40)
+        assert_equal(large_data['owner']['username'], 'mjumbewu')
+
+    def test_prefetched_serialization_matches_lazy_serialization(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        project = self.create_project(auth.profile, 'test', 3, 2)
+
+        _, prefetched_data = self.count_serialization_queries(project)
+        lazy_data = ProjectSerializer(Project.objects.get(pk=project.pk)).data
+        assert_equal(prefetched_data, lazy_data)
+
+    def test_annotate_permissions(self):
+        owner = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        member = UserAuth.objects.create_user(username='atogle', password='456')
+        outsider = UserAuth.objects.create_user(username='someone', password='789')
+        superuser = UserAuth.objects.create_user(username='admin', password='admin')
+        superuser.is_superuser = True
+        superuser.save()
+
+        team = Profile.objects.create(slug='team')
+        subteam = Profile.objects.create(slug='subteam')
+        subteam.teams.add(team)
+        member.profile.teams.add(subteam)
+
+        Project.objects.create(slug='owned-public', title='x', location='x', owner=owner.profile, public=True)
+        Project.objects.create(slug='owned-private', title='x', location='x', owner=owner.profile, public=False)
+        Project.objects.create(slug='team-private', title='x', location='x', owner=team, public=False)
+
+        def permissions_for(user):
+            projects = Project.objects.annotate_permissions(user)\
+                .filter(slug__in=['owned-public', 'owned-private', 'team-private'])
+            return dict((p.slug, (bool(p.can_view), bool(p.can_edit))) for p in projects)
+
+        assert_equal(permissions_for(owner), {
+            'owned-private': (True, True), 'owned-public': (True, True), 'team-private': (False, False)})
+        assert_equal(permissions_for(member), {
+            'owned-private': (False, False), 'owned-public': (True, False), 'team-private': (True, True)})
+        assert_equal(permissions_for(outsider), {
+            'owned-private': (False, False), 'owned-public': (True, False), 'team-private': (False, False)})
+        assert_equal(permissions_for(superuser), {
+            'owned-private': (True, True), 'owned-public': (True, True), 'team-private': (True, True)})
+        assert_equal(permissions_for(AnonymousUser()), {
+            'owned-private': (False, False), 'owned-public': (True, False), 'team-private': (False, False)})
+
+    def test_annotated_permissions_take_constant_queries(self):
+        owner = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        member = UserAuth.objects.create_user(username='atogle', password='456')
+        team = Profile.objects.create(slug='team')
+        member.profile.teams.add(team)
+        for i in range(10):
+            Project.objects.create(slug='team-%s' % i, title='x', location='x', owner=team)
+            Project.objects.create(slug='owned-%s' % i, title='x', location='x', owner=owner.profile)
+
+        member = UserAuth.objects.get(pk=member.pk)
+        with CaptureQueriesContext(connection) as captured:
+            projects = list(Project.objects.annotate_permissions(member).filter(title='x'))
+            editable = [project.slug for project in projects if project.editable_by(member)]
+
+        # One query for the user's profile, one for their teams, and one for
+        # the projects
+        assert_equal(len(captured), 3)
+        assert_equal(sorted(editable), ['team-%s' % i for i in range(10)])
+
+
+class ProjectPresenceTests (PlanBoxTestCase):
+    def set_up(self):
+        super(ProjectPresenceTests, self).set_up()
+        cache.clear()
+
+    def init_test_assets(self):
+        owner = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        member = UserAuth.objects.create_user(username='atogle', password='456')
+        team = Profile.objects.create(slug='team')
+        owner.profile.teams.add(team)
+        member.profile.teams.add(team)
+        project = Project.objects.create(slug='test-slug', title='x', location='x', owner=team)
+        url = reverse('project-activity', kwargs={'pk': project.pk})
+        return owner, member, project, url
+
+    def test_heartbeats_do_not_write_the_project(self):
+        owner, _, project, url = self.init_test_assets()
+        updated_at = Project.objects.get(pk=project.pk).updated_at
+        version = get_project_version(project.pk)
+        self.client.login(username='mjumbewu', password='123')
+
+        response = self.client.post(url)
+        assert_equal(response.status_code, 200)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url)
+        assert_equal(response.status_code, 204)
+        ok_(not any('UPDATE "planbox_data_project"' in q['sql'] for q in captured.captured_queries))
+
+        project = Project.objects.get(pk=project.pk)
+        assert_equal(project.updated_at, updated_at)
+        assert_equal(get_project_version(project.pk), version)
+
+        # The first open is written back to the project's columns
+        assert_equal(project.last_opened_by_id, owner.id)
+
+    def test_second_opener_gets_a_conflict_until_the_first_closes(self):
+        owner, member, project, url = self.init_test_assets()
+
+        self.client.login(username='mjumbewu', password='123')
+        assert_equal(self.client.post(url).status_code, 200)
+
+        self.client.login(username='atogle', password='456')
+        response = self.client.post(url)
+        assert_equal(response.status_code, 409)
+        assert_equal(response.data['last_opened_by']['username'], 'mjumbewu')
+        assert_equal(self.client.delete(url).status_code, 400)
+
+        self.client.login(username='mjumbewu', password='123')
+        assert_equal(self.client.delete(url).status_code, 204)
+
+        self.client.login(username='atogle', password='456')
+        assert_equal(self.client.post(url).status_code, 200)
+        ok_(Project.objects.get(pk=project.pk).is_opened_by(member))
+
+    def test_only_one_simultaneous_claim_succeeds(self):
+        owner, member, project, _ = self.init_test_assets()
+
+        outcome1, holder1 = presence.claim(project.pk, owner.id)
+        outcome2, holder2 = presence.claim(project.pk, member.id)
+
+        assert_equal(outcome1, presence.OPENED)
+        assert_equal(outcome2, presence.CONFLICT)
+        assert_equal(holder2['user_id'], owner.id)
+
+
+class TemplateCatalogueTests (PlanBoxTestCase):
+    def set_up(self):
+        super(TemplateCatalogueTests, self).set_up()
+        cache.clear()
+        self.templates, _ = Profile.objects.get_or_create(slug=settings.TEMPLATES_PROFILE)
+        ProfileProjectTemplate.objects.all().delete()
+        # Saving a project in the templates profile adds it to the catalogue
+        self.template = Project.objects.create(slug='bikes', title='Bike Plan', location='x', owner=self.templates)
+        Section.objects.create(project=self.template, type='text', slug='intro', label='Intro')
+
+    def test_project_templates_are_serialized_once(self):
+        data = catalogue.get_project_templates_data()
+        assert_equal([t['label'] for t in data], ['Bike Plan'])
+        assert_equal(data[0]['project']['slug'], 'bikes')
+        assert_equal(catalogue.get_template_choices(), [(self.template.pk, 'Bike Plan')])
+
+        with assert_num_queries(0):
+            assert_equal(catalogue.get_project_templates_data(), data)
+            assert_equal(catalogue.get_template_choices(), [(self.template.pk, 'Bike Plan')])
+
+    def test_catalogue_is_invalidated_when_templates_change(self):
+        catalogue.get_project_templates_data()
+
+        template = ProfileProjectTemplate.objects.get(project=self.template)
+        template.label = 'Bicycle Plan'
+        template.save()
+        assert_equal([t['label'] for t in catalogue.get_project_templates_data()], ['Bicycle Plan'])
+
+        self.template.title = 'Bicycle Master Plan'
+        self.template.save()
+        assert_equal(catalogue.get_project_templates_data()[0]['project']['title'], 'Bicycle Master Plan')
+
+        Project.objects.create(slug='parks', title='Park Plan', location='x', owner=self.templates)
+        assert_equal(len(catalogue.get_project_templates_data()), 2)
+        assert_equal(len(catalogue.get_template_choices()), 2)
+
+    def test_catalogue_is_kept_when_other_projects_change(self):
+        owner = Profile.objects.create(slug='someone')
+        project = Project.objects.create(slug='mine', title='x', location='x', owner=owner)
+        version = get_template_catalogue_version()
+
+        project.title = 'y'
+        project.save()
+        Project.objects.get(pk=project.pk).save()
+        assert_equal(get_template_catalogue_version(), version)
+
+    def test_template_project_data_is_cached_per_project_version(self):
+        data = catalogue.get_template_project_data(settings.TEMPLATES_PROFILE, 'bikes')
+        assert_equal(data['title'], 'Bike Plan')
+        assert_equal(data['template'], self.template.pk)
+        assert_equal([s['label'] for s in data['sections']], ['Intro'])
+
+        # Only the project's id is looked up
+        with assert_num_queries(1):
+            assert_equal(catalogue.get_template_project_data(settings.TEMPLATES_PROFILE, 'bikes'), data)
+
+        Section.objects.create(project=self.template, type='text', slug='outro', label='Outro')
+        data = catalogue.get_template_project_data(settings.TEMPLATES_PROFILE, 'bikes')
+        assert_equal([s['label'] for s in data['sections']], ['Intro', 'Outro'])
+
+        assert_equal(catalogue.get_template_project_data(settings.TEMPLATES_PROFILE, 'nope'), None)
+
+
+class RoundupProjectTests (PlanBoxTestCase):
+    def set_up(self):
+        super(RoundupProjectTests, self).set_up()
+        cache.clear()
+        self.owner = Profile.objects.create(slug='team', name='Team')
+        self.roundup = Roundup.objects.get(owner=self.owner)
+
+    def create_projects(self, count, public=True, prefix='plan'):
+        return [Project.objects.create(slug='%s-%s' % (prefix, i), title='Plan %s' % i, location='x', owner=self.owner, public=public)
+                for i in range(count)]
+
+    def test_summary_follows_the_first_text_section(self):
+        project, = self.create_projects(1)
+        Section.objects.create(project=project, type='image', slug='image', details={'content': 'not me'})
+        intro = Section.objects.create(project=project, type='text', slug='intro', details={'content': '<p>Hello</p>'})
+        assert_equal(Project.objects.get(pk=project.pk).summary, '<p>Hello</p>')
+
+        intro.details = {'content': '<p>Goodbye</p>'}
+        intro.save()
+        assert_equal(Project.objects.get(pk=project.pk).summary, '<p>Goodbye</p>')
+
+        intro.delete()
+        assert_equal(Project.objects.get(pk=project.pk).summary, '')
+
+    def test_summary_follows_sections_saved_in_bulk(self):
+        project, = self.create_projects(1)
+        serializer = ProjectSerializer(project, data={'sections': [
+            {'type': 'text', 'slug': 'intro', 'details': {'content': 'From the API'}}]}, partial=True)
+        ok_(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        assert_equal(Project.objects.get(pk=project.pk).summary, 'From the API')
+
+    def test_pages_take_the_same_number_of_queries_for_any_number_of_projects(self):
+        projects = self.create_projects(5)
+        for project in projects:
+            Section.objects.create(project=project, type='text', slug='intro', details={'content': 'About %s' % project.slug})
+        self.create_projects(1, public=False, prefix='private')
+
+        with assert_num_queries(1):
+            data, next_cursor = roundups.get_project_page(self.owner.pk, page_size=2)
+        assert_equal([p['slug'] for p in data], ['plan-0', 'plan-1'])
+        assert_equal(data[0]['summary'], 'About plan-0')
+        assert_equal(next_cursor, projects[1].pk)
+
+        with assert_num_queries(1):
+            data, next_cursor = roundups.get_project_page(self.owner.pk, after=projects[3].pk, page_size=2)
+        assert_equal([p['slug'] for p in data], ['plan-4'])
+        assert_equal(next_cursor, None)
+
+    def test_project_list_api_follows_cursors(self):
+        self.create_projects(3)
+        url = reverse('roundup-project-list', kwargs={'roundup_pk': self.roundup.pk})
+
+        slugs = []
+        next_url = url + '?page_size=2'
+        while next_url:
+            response = self.client.get(next_url)
+            assert_equal(response.status_code, HTTP_200_OK, response.content)
+            slugs.extend(p['slug'] for p in response.data['results'])
+            next_url = response.data['next']
+        assert_equal(slugs, ['plan-0', 'plan-1', 'plan-2'])
+
+    def test_project_list_api_rejects_page_sizes_below_one(self):
+        self.create_projects(1)
+        url = reverse('roundup-project-list', kwargs={'roundup_pk': self.roundup.pk})
+
+        for page_size in ('0', '-1'):
+            response = self.client.get(url + '?page_size=' + page_size)
+            assert_equal(response.status_code, HTTP_400_BAD_REQUEST, response.content)
+
+    def test_first_page_is_cached_until_a_project_changes(self):
+        project, = self.create_projects(1)
+        data = RoundupSerializer(self.roundup).data
+        assert_equal([p['title'] for p in data['projects']], ['Plan 0'])
+        assert_equal(data['projects_next'], None)
+
+        with assert_num_queries(0):
+            RoundupSerializer(self.roundup).data
+
+        project.title = 'Renamed'
+        project.save()
+        assert_equal([p['title'] for p in RoundupSerializer(self.roundup).data['projects']], ['Renamed'])
+
+
+class ProjectDocumentTests (PlanBoxTestCase):
+    def create_project(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        project = Project.objects.create(slug='test-slug', title='x', location='x', owner=auth.profile, public=True)
+        Section.objects.create(project=project, type='text', slug='intro', details={'content': 'Hello'})
+        event = Event.objects.create(project=project, label='Event', slug='event')
+        Attachment.objects.create(attached_to=event, url='http://example.com/a.png')
+        # Get a fresh copy, as a view would.
+        return Project.objects.get(pk=project.pk)
+
+    def test_document_is_built_once_and_matches_the_serializers(self):
+        project = self.create_project()
+        full = documents.get_project_data(project, full=True)
+        assert_equal(full, documents.serialize_project(project.pk))
+        assert_in('expires_at', full)
+
+        with assert_num_queries(1):
+            public = documents.get_project_data(project)
+        assert_not_in('expires_at', public)
+        project = Project.objects.prefetch_for_serialization().get(pk=project.pk)
+        assert_equal(public, documents.normalize(ProjectSerializer(project).data))
+
+    def test_document_is_invalidated_by_changes_to_parts_and_owner(self):
+        project = self.create_project()
+        documents.get_project_data(project)
+
+        self.client.login(username='mjumbewu', password='123')
+        section = project.sections.get()
+        url = reverse('project-section-detail', kwargs={'project_pk': project.pk, 'pk': section.pk})
+        response = self.client.patch(url, data='{"label": "New label"}', content_type='application/json')
+        assert_equal(response.status_code, HTTP_200_OK, response.content)
+        assert_equal(documents.get_project_data(project)['sections'][0]['label'], 'New label')
+
+        owner = Profile.objects.get(pk=project.owner_id)
+        owner.name = 'Mjumbe'
+        owner.save()
+        assert_equal(documents.get_project_data(project)['owner']['name'], 'Mjumbe')
+
+        Event.objects.get(slug='event').attachments.get().delete()
+        assert_equal(documents.get_project_data(project)['events'][0]['attachments'], [])
+
+    def test_cloned_project_has_its_own_document(self):
+        project = self.create_project()
+        documents.get_project_data(project)
+
+        clone = project.clone()
+        data = documents.get_project_data(Project.objects.get(pk=clone.pk))
+        assert_equal(data['id'], clone.pk)
+        assert_equal([e['slug'] for e in data['events']], ['event'])
+        assert_equal(len(data['events'][0]['attachments']), 1)
+        assert_equal(documents.check_document(clone.pk), [])
+
+    def test_stale_build_is_not_saved(self):
+        project = self.create_project()
+        row = ProjectDocument.objects.get(project=project)
+        data = documents.serialize_project(project.pk)
+
+        # A write lands between reading the row and saving the rebuilt document.
+        project.title = 'Changed'
+        project.save()
+        ProjectDocument.objects.filter(project=project, generation=row.generation).update(data=data)
+        assert_equal(ProjectDocument.objects.get(project=project).data, None)
+        assert_equal(documents.get_project_data(project)['title'], 'Changed')
+
+    def test_detail_api_serves_the_document(self):
+        project = self.create_project()
+        ProjectDocument.objects.filter(project=project).update(data={'title': 'From the document'})
+
+        url = reverse('project-detail', kwargs={'pk': project.pk})
+        response = self.client.get(url)
+        assert_equal(response.status_code, HTTP_200_OK, response.content)
+        assert_equal(response.data, {'title': 'From the document'})
+
+    def test_check_command_finds_and_fixes_mismatches(self):
+        project = self.create_project()
+        documents.get_project_data(project)
+        call_command('check_project_documents', verbosity=0)
+
+        tampered = documents.get_project_data(project, full=True)
+        tampered['title'] = 'Tampered'
+        ProjectDocument.objects.filter(project=project).update(data=tampered)
+        assert_equal(documents.check_document(project.pk), ['title'])
+        assert_raises(CommandError, call_command, 'check_project_documents', verbosity=0)
+
+        call_command('check_project_documents', fix=True, verbosity=0)
+        assert_equal(documents.check_document(project.pk), [])
+        assert_equal(documents.get_project_data(project)['title'], 'x')
+
+
+class ConditionalGetTests (PlanBoxTestCase):
+    def create_assets(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        team = Profile.objects.create(slug='team', name='Team')
+        team.members.add(auth.profile)
+        project = Project.objects.create(slug='test-slug', title='x', location='x', owner=team, public=True)
+        event = Event.objects.create(project=project, label='Event', slug='event')
+        return auth, team, project, event
+
+    def test_unchanged_project_is_not_modified(self):
+        _, _, project, _ = self.create_assets()
+        url = reverse('project-detail', kwargs={'pk': project.pk})
+
+        response = self.client.get(url)
+        assert_equal(response.status_code, HTTP_200_OK)
+        ok_(response['ETag'].startswith('W/'))
+        assert_in('no-cache', response['Cache-Control'])
+
+        # Only the project (with its owner and theme) is looked up; the
+        # document isn't read.
+        with assert_num_queries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert_equal(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        assert_equal(response.status_code, 304)
+
+    def test_project_is_modified_when_its_parts_or_owner_change(self):
+        _, team, project, event = self.create_assets()
+        url = reverse('project-detail', kwargs={'pk': project.pk})
+        etag = self.client.get(url)['ETag']
+
+        event.label = 'New label'
+        event.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, HTTP_200_OK)
+        assert_equal(response.data['events'][0]['label'], 'New label')
+
+        etag = response['ETag']
+        team.name = 'New name'
+        team.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, HTTP_200_OK)
+
+        # Different formats get different tags.
+        response = self.client.get(url + '?format=api', HTTP_IF_NONE_MATCH=response['ETag'])
+        assert_equal(response.status_code, HTTP_200_OK)
+
+    def test_profile_is_modified_when_its_projects_or_members_change(self):
+        auth, team, project, _ = self.create_assets()
+        self.client.login(username='mjumbewu', password='123')
+        url = reverse('profile-detail', kwargs={'pk': team.pk})
+
+        response = self.client.get(url)
+        assert_equal(response.status_code, HTTP_200_OK)
+        etag = response['ETag']
+        assert_equal(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        project.title = 'New title'
+        project.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, HTTP_200_OK)
+
+        etag = response['ETag']
+        other = Profile.objects.create(slug='other')
+        team.members.add(other)
+        assert_equal(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, HTTP_200_OK)
+
+
+class ProjectPartViewTests (PlanBoxTestCase):
+    def init_test_assets(self, public=True):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        project = Project.objects.create(slug='test-slug', title='x', location='x', owner=auth.profile, public=public)
+        sections = [Section.objects.create(project=project, type='text', menu_label='Section %s' % i, slug='section-%s' % i)
+                    for i in range(5)]
+        event = Event.objects.create(project=project, label='Event', slug='event')
+        return auth, project, sections, event
+
+    def test_owner_can_PATCH_one_section(self):
+        _, project, sections, _ = self.init_test_assets()
+        url = reverse('project-section-detail', kwargs={'project_pk': project.pk, 'pk': sections[2].pk})
+        self.client.login(username='mjumbewu', password='123')
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.patch(url, data='{"label": "New label"}', content_type='application/json')
+        assert_equal(response.status_code, HTTP_200_OK, response.content)
+        assert_equal(response.data['label'], 'New label')
+
+        section_updates = [q for q in captured.captured_queries if 'UPDATE "planbox_data_section"' in q['sql']]
+        assert_equal(len(section_updates), 1)
+        assert_equal(Section.objects.get(pk=sections[2].pk).label, 'New label')
+        assert_equal(Section.objects.get(pk=sections[3].pk).label, '')
+        assert_equal(Project.objects.get(pk=project.pk).last_saved_by.username, 'mjumbewu')
+
+    def test_non_owner_cannot_change_sections(self):
+        _, project, sections, _ = self.init_test_assets()
+        UserAuth.objects.create_user(username='atogle', password='456')
+        self.client.login(username='atogle', password='456')
+
+        url = reverse('project-section-detail', kwargs={'project_pk': project.pk, 'pk': sections[0].pk})
+        assert_equal(self.client.get(url).status_code, HTTP_200_OK)
+        response = self.client.patch(url, data='{"label": "New label"}', content_type='application/json')
+        assert_equal(response.status_code, HTTP_403_FORBIDDEN)
+
+        url = reverse('project-section-list', kwargs={'project_pk': project.pk})
+        response = self.client.post(url, data='{"type": "text"}', content_type='application/json')
+        assert_equal(response.status_code, HTTP_403_FORBIDDEN)
+
+    def test_anonymous_cannot_see_sections_of_non_public_project(self):
+        _, project, sections, _ = self.init_test_assets(public=False)
+        url = reverse('project-section-detail', kwargs={'project_pk': project.pk, 'pk': sections[0].pk})
+        assert_equal(self.client.get(url).status_code, HTTP_404_NOT_FOUND)
+
+    def test_owner_can_create_and_delete_sections(self):
+        _, project, sections, _ = self.init_test_assets()
+        self.client.login(username='mjumbewu', password='123')
+
+        url = reverse('project-section-list', kwargs={'project_pk': project.pk})
+        response = self.client.post(url, data='{"type": "text", "menu_label": "Last"}', content_type='application/json')
+        assert_equal(response.status_code, 201, response.content)
+        new_section = Section.objects.get(pk=response.data['id'])
+        assert_equal(new_section.project_id, project.pk)
+        assert_equal(new_section.index, 5)
+
+        url = reverse('project-section-detail', kwargs={'project_pk': project.pk, 'pk': sections[0].pk})
+        assert_equal(self.client.delete(url).status_code, HTTP_204_NO_CONTENT)
+        assert_equal(project.sections.count(), 5)
+
+    def test_reorder_sections(self):
+        _, project, sections, _ = self.init_test_assets()
+        self.client.login(username='mjumbewu', password='123')
+        url = reverse('project-section-reorder', kwargs={'project_pk': project.pk})
+        version = get_project_version(project.pk)
+
+        order = [sections[1].pk, sections[0].pk] + [s.pk for s in sections[2:]]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url, data=json.dumps({'order': order}), content_type='application/json')
+        assert_equal(response.status_code, HTTP_200_OK, response.content)
+        assert_equal([s['id'] for s in response.data], order)
+        assert_equal(list(project.sections.values_list('pk', flat=True)), order)
+        assert_not_equal(get_project_version(project.pk), version)
+
+        # Only the two sections that moved were written
+        section_updates = [q for q in captured.captured_queries if 'UPDATE "planbox_data_section"' in q['sql']]
+        assert_equal(len(section_updates), 2)
+
+        response = self.client.post(url, data=json.dumps({'order': order[1:]}), content_type='application/json')
+        assert_equal(response.status_code, 400)
+
+    def test_owner_can_add_attachments_to_an_event(self):
+        _, project, _, event = self.init_test_assets()
+        self.client.login(username='mjumbewu', password='123')
+
+        url = reverse('project-event-attachment-list', kwargs={'project_pk': project.pk, 'event_pk': event.pk})
+        response = self.client.post(url, data='{"url": "http://example.com/a.png", "label": "A"}', content_type='application/json')
+        assert_equal(response.status_code, 201, response.content)
+        assert_equal([a.label for a in event.attachments.all()], ['A'])
+
+
 class ProfileSerializerTests (PlanBoxTestCase):
     def test_can_create_a_profile(self):
         serializer = ProfileSerializer(data={
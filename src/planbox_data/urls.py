@@ -1,6 +1,22 @@
 from django.conf.urls import patterns, url
 from planbox_data import views
 
+project = r'projects/(?P<project_pk>[^/]+)'
+event = project + r'/events/(?P<event_pk>[^/]+)'
+
 urlpatterns = views.router.urls + patterns('',
-    url(r'projects/(?P<pk>[^/]+)/activity$', views.project_activity_view, name='project-activity')
+    url(r'projects/(?P<pk>[^/]+)/activity$', views.project_activity_view, name='project-activity'),
+    url(r'roundups/(?P<roundup_pk>[^/]+)/projects$', views.roundup_project_list_view, name='roundup-project-list'),
+
+    url(project + r'/sections$', views.section_list_view, name='project-section-list'),
+    url(project + r'/sections/reorder$', views.section_reorder_view, name='project-section-reorder'),
+    url(project + r'/sections/(?P<pk>[^/]+)$', views.section_detail_view, name='project-section-detail'),
+
+    url(project + r'/events$', views.event_list_view, name='project-event-list'),
+    url(project + r'/events/reorder$', views.event_reorder_view, name='project-event-reorder'),
+    url(project + r'/events/(?P<pk>[^/]+)$', views.event_detail_view, name='project-event-detail'),
+
+    url(event + r'/attachments$', views.attachment_list_view, name='project-event-attachment-list'),
+    url(event + r'/attachments/reorder$', views.attachment_reorder_view, name='project-event-attachment-reorder'),
+    url(event + r'/attachments/(?P<pk>[^/]+)$', views.attachment_detail_view, name='project-event-attachment-detail'),
 )
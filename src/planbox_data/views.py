@@ -1,17 +1,50 @@
 from __future__ import unicode_literals
 
+from django.db import transaction
 from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from rest_framework import response
 from rest_framework import routers
 from rest_framework import viewsets
 
+from planbox_data import conditional
+from planbox_data import documents
 from planbox_data import models
 from planbox_data import serializers
 from planbox_data import permissions
+from planbox_data import presence
+from planbox_data import roundups
 
 
-class ProfileViewSet (viewsets.ModelViewSet):
+class ConditionalRetrieveMixin (object):
+    """
+    Answer requests for a single object with 304 Not Modified when the client
+    already has its current representation, before anything is serialized.
+    """
+    def get_validators(self, obj):
+        raise NotImplementedError('You must specify how to get validators')
+
+    def get_object_data(self, obj):
+        return self.get_serializer(obj).data
+
+    def retrieve(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        validators = self.get_validators(self.object)
+
+        if conditional.is_not_modified(request, *validators):
+            result = conditional.not_modified_response(*validators)
+        else:
+            result = response.Response(self.get_object_data(self.object))
+            conditional.set_validators(result, *validators)
+
+        # Clients may keep the data, as long as they check back before using
+        # it again.
+        result['Cache-Control'] = 'private, no-cache'
+        return result
+
+
+class ProfileViewSet (ConditionalRetrieveMixin, viewsets.ModelViewSet):
     serializer_class = serializers.ProfileSerializer
     permission_classes = (permissions.AuthedUserForUserProfile, permissions.TeamMemberForTeamProfile,)
     model = models.Profile
@@ -36,8 +69,11 @@ class ProfileViewSet (viewsets.ModelViewSet):
         else:
             return models.Profile.objects.empty()
 
+    def get_validators(self, profile):
+        return conditional.get_profile_validators(profile, self.request.accepted_renderer.format)
+
 
-class ProjectViewSet (viewsets.ModelViewSet):
+class ProjectViewSet (ConditionalRetrieveMixin, viewsets.ModelViewSet):
     serializer_class = serializers.ProjectSerializer
     permission_classes = (permissions.OwnerAuthorizesOrReadOnly,)
     model = models.Project
@@ -52,16 +88,36 @@ class ProjectViewSet (viewsets.ModelViewSet):
         # For other requests, limit the queryset to those project to whic the
         # user has access.
         user = self.request.user
+        queryset = models.Project.objects.all()
+
+        # Projects that we're going to serialize should come with all of their
+        # related data, so that we don't query for each event, section, etc.
+        # A single project is served from its stored document instead, and
+        # only needs what goes into its validators.
+        if self.request.method.lower() == 'get':
+            if self.action == 'retrieve':
+                queryset = queryset.select_related('owner', 'theme')
+            else:
+                queryset = queryset.prefetch_for_serialization()
+
+        # Work out whether the user can edit each project in the same query,
+        # instead of checking once per project.
+        queryset = queryset.annotate_permissions(user)
 
         if user.is_superuser:
-            return models.Project.objects.all()
+            return queryset
 
         if user.is_authenticated():
-            owner = self.request.user.profile
-            return models.Project.objects.filter_by_member_or_public(owner)
+            return queryset.filter_by_member_or_public(user)
 
         else:
-            return models.Project.objects.filter(public=True)
+            return queryset.filter(public=True)
+
+    def get_validators(self, project):
+        return conditional.get_project_validators(project, self.request.accepted_renderer.format)
+
+    def get_object_data(self, project):
+        return documents.get_project_data(project)
 
     def pre_save(self, obj):
         user = self.request.user
@@ -70,44 +126,189 @@ class ProjectViewSet (viewsets.ModelViewSet):
 
     def notify_of_open(self, request, pk):
         self.project = self.get_object()
-        user = self.project.get_opened_by()
+        outcome = self.project.mark_opened_by(request.user)
 
-        # If the current user is the last opening user, then save some
+        # If the current user already had the project open, then save some
         # bandwidth and computation, and just return success with no
         # content (204).
-        if user == request.user:
-            self.project.mark_opened_by(request.user)
+        if outcome == presence.REFRESHED:
             return HttpResponse('', status=204)  # No Content
 
         serializer = serializers.ProjectActivitySerializer(self.project)
 
-        # If there is no user with the project open, then mark it as opened by
-        # the current user, and let them know.
-        if user is None:
-            self.project.mark_opened_by(request.user)
+        # If there was no user with the project open, then it's now opened by
+        # the current user; let them know.
+        if outcome == presence.OPENED:
             return response.Response(serializer.data, status=200)
 
-        # Otherwise, if the current user is not the one who last opened the
-        # project, and they still have it open, return a conflict code (409).
-        if user != request.user:
-            return response.Response(serializer.data, status=409)  # Conflict
+        # Otherwise, someone else has the project open, so return a conflict
+        # code (409).
+        return response.Response(serializer.data, status=409)  # Conflict
 
     def notify_of_close(self, request, pk):
         self.project = self.get_object()
-        user = self.project.get_opened_by()
-
-        serializer = serializers.ProjectActivitySerializer(self.project)
 
         # If the current user is the last opening user, then close them out.
-        if user == request.user:
-            self.project.mark_closed()
+        if self.project.mark_closed(request.user):
             return HttpResponse('', status=204)
 
         # Otherwise, respond with an invalid (400).
         else:
+            self.project.get_opened_by()
+            serializer = serializers.ProjectActivitySerializer(self.project)
             return response.Response(serializer.data, status=400)  # Invalid
 
 
+class ProjectPartMixin (object):
+    """
+    Common behavior for the viewsets on the parts of a project (its sections,
+    events, and event attachments). Access to a part is decided by access to
+    the project it belongs to, so that a part can be edited by anyone who can
+    edit the project, and viewed by anyone who can view the project.
+    """
+    permission_classes = (permissions.OwnerAuthorizesOrReadOnly,)
+
+    def get_project(self):
+        if not hasattr(self, 'project'):
+            user = self.request.user
+            queryset = models.Project.objects.all()
+            if not user.is_superuser:
+                if user.is_authenticated():
+                    queryset = queryset.filter_by_member_or_public(user)
+                else:
+                    queryset = queryset.filter(public=True)
+            self.project = get_object_or_404(queryset, pk=self.kwargs['project_pk'])
+        return self.project
+
+    def check_permissions(self, request):
+        super(ProjectPartMixin, self).check_permissions(request)
+        self.check_object_permissions(request, None)
+
+    def check_object_permissions(self, request, obj):
+        # Check the permissions against the project, whatever the part.
+        super(ProjectPartMixin, self).check_object_permissions(request, self.get_project())
+
+    def mark_project_saved(self):
+        # Record the save without going through Project.save, which would
+        # write the whole project row.
+        user = self.request.user
+        models.Project.objects.filter(pk=self.get_project().pk).update(
+            last_saved_by=user if user.is_authenticated() else None,
+            last_saved_at=now())
+
+    def post_save(self, obj, created=False):
+        self.mark_project_saved()
+
+    def post_delete(self, obj):
+        self.mark_project_saved()
+
+    def reorder(self, request, **kwargs):
+        """
+        Set the order of the parts from a list of their ids, e.g.:
+
+            {"order": [3, 1, 2]}
+
+        Only the parts whose positions change are written.
+        """
+        order = request.DATA.get('order') if hasattr(request.DATA, 'get') else None
+        if not isinstance(order, (list, tuple)):
+            return response.Response({'order': ['must be an array of ids']}, status=400)
+
+        queryset = self.get_queryset()
+        current = dict(queryset.values_list('pk', 'index'))
+        try:
+            order = [int(pk) for pk in order]
+        except (TypeError, ValueError):
+            return response.Response({'order': ['must be an array of ids']}, status=400)
+        if sorted(order) != sorted(current):
+            return response.Response({'order': ['must list each id exactly once']}, status=400)
+
+        with transaction.atomic():
+            for index, pk in enumerate(order):
+                if current[pk] != index:
+                    queryset.filter(pk=pk).update(index=index)
+            self.mark_project_saved()
+
+        # Updating through the queryset skips the model save signals, so let
+        # the project know that its parts were written in bulk (which bumps
+        # the project version, and updates its summary).
+        models.bulk_related_saved.send(sender=models.Project, instance=self.get_project(), model=self.model)
+
+        serializer = self.get_serializer(queryset.all(), many=True)
+        return response.Response(serializer.data)
+
+
+class SectionViewSet (ProjectPartMixin, viewsets.ModelViewSet):
+    serializer_class = serializers.SectionSerializer
+    model = models.Section
+
+    def get_queryset(self):
+        return self.get_project().sections.all()
+
+    def pre_save(self, obj):
+        obj.project = self.get_project()
+        super(SectionViewSet, self).pre_save(obj)
+
+
+class EventViewSet (ProjectPartMixin, viewsets.ModelViewSet):
+    serializer_class = serializers.EventSerializer
+    model = models.Event
+
+    def get_queryset(self):
+        return self.get_project().events.all().prefetch_related('attachments')
+
+    def pre_save(self, obj):
+        obj.project = self.get_project()
+        super(EventViewSet, self).pre_save(obj)
+
+
+class AttachmentViewSet (ProjectPartMixin, viewsets.ModelViewSet):
+    serializer_class = serializers.AttachmentSerializer
+    model = models.Attachment
+
+    def get_event(self):
+        if not hasattr(self, 'event'):
+            self.event = get_object_or_404(self.get_project().events.all(), pk=self.kwargs['event_pk'])
+        return self.event
+
+    def get_queryset(self):
+        return self.get_event().attachments.all()
+
+    def pre_save(self, obj):
+        obj.attached_to = self.get_event()
+        super(AttachmentViewSet, self).pre_save(obj)
+
+
+class RoundupProjectViewSet (viewsets.ViewSet):
+    def list(self, request, roundup_pk):
+        """
+        List a page of the public projects in a roundup, e.g.:
+
+            GET /api/v1/roundups/1/projects?after=42&page_size=20
+
+        The response has the projects as its results, and the URL of the next
+        page (or null) as next.
+        """
+        roundup = get_object_or_404(models.Roundup, pk=roundup_pk)
+        try:
+            after = int(request.QUERY_PARAMS['after']) if 'after' in request.QUERY_PARAMS else None
+            page_size = int(request.QUERY_PARAMS['page_size']) if 'page_size' in request.QUERY_PARAMS else None
+        except ValueError:
+            return response.Response({'detail': 'after and page_size must be integers'}, status=400)
+        if page_size is not None and page_size < 1:
+            return response.Response({'detail': 'page_size must be at least 1'}, status=400)
+
+        if after is None and page_size is None:
+            projects, next_cursor = roundups.get_first_project_page(roundup.owner_id)
+        else:
+            projects, next_cursor = roundups.get_project_page(roundup.owner_id, after, page_size)
+
+        return response.Response({
+            'results': projects,
+            'next': serializers.get_roundup_projects_url(roundup, next_cursor),
+        })
+
+
 router = routers.DefaultRouter(trailing_slash=False)
 router.register('profiles', ProfileViewSet)
 router.register('projects', ProjectViewSet)
@@ -116,3 +317,21 @@ project_activity_view = ProjectViewSet.as_view({
     'post': 'notify_of_open',
     'delete': 'notify_of_close',
 })
+
+roundup_project_list_view = RoundupProjectViewSet.as_view({'get': 'list'})
+
+part_list_actions = {'get': 'list', 'post': 'create'}
+part_detail_actions = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+part_reorder_actions = {'post': 'reorder'}
+
+section_list_view = SectionViewSet.as_view(part_list_actions)
+section_detail_view = SectionViewSet.as_view(part_detail_actions)
+section_reorder_view = SectionViewSet.as_view(part_reorder_actions)
+
+event_list_view = EventViewSet.as_view(part_list_actions)
+event_detail_view = EventViewSet.as_view(part_detail_actions)
+event_reorder_view = EventViewSet.as_view(part_reorder_actions)
+
+attachment_list_view = AttachmentViewSet.as_view(part_list_actions)
+attachment_detail_view = AttachmentViewSet.as_view(part_detail_actions)
+attachment_reorder_view = AttachmentViewSet.as_view(part_reorder_actions)
@@ -0,0 +1,185 @@
+"""
+An in-process cache of the compiled detail templates for map flavors.
+
+The details of each map flavor page come from a template hosted under
+PLANBOX_FLAVORS_ROOT_URL. Rather than downloading and compiling the template
+on every view of the page, each process keeps the compiled template for each
+flavor, along with the ETag and Last-Modified headers it came with.
+
+Once an entry is older than FLAVOR_DETAILS_CACHE_TTL, it is revalidated with a
+conditional GET; a 304 just renews the entry. The stale template keeps being
+served while the revalidation runs in the background, and for as long as the
+flavors host is down or answering with errors (the revalidation is tried
+again every FLAVOR_DETAILS_ERROR_TTL seconds). Only a request for a flavor
+that isn't cached at all waits on the flavors host, and concurrent requests
+for the same uncached flavor wait on a single download.
+
+Flavors that don't exist (404s) are cached too, for FLAVOR_DETAILS_MISSING_TTL
+seconds, after which they are forgotten rather than revalidated. At most
+FLAVOR_DETAILS_CACHE_SIZE flavors are kept; the least recently used ones are
+dropped first, so that requests for made-up flavor slugs can't fill up the
+process's memory.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import requests
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.template import Template
+from planbox.outbound import http
+
+log = logging.getLogger(__name__)
+
+
+# Seconds after which a cached template is revalidated
+FLAVOR_DETAILS_CACHE_TTL = getattr(settings, 'FLAVOR_DETAILS_CACHE_TTL', 5 * 60)
+# Seconds for which to remember that a flavor does not exist
+FLAVOR_DETAILS_MISSING_TTL = getattr(settings, 'FLAVOR_DETAILS_MISSING_TTL', 60)
+# Seconds to wait before revalidating again after the flavors host fails
+FLAVOR_DETAILS_ERROR_TTL = getattr(settings, 'FLAVOR_DETAILS_ERROR_TTL', 30)
+# Seconds to wait on the flavors host
+FLAVOR_DETAILS_TIMEOUT = getattr(settings, 'FLAVOR_DETAILS_TIMEOUT', 5)
+# The most flavors (including missing ones) to keep in each process
+FLAVOR_DETAILS_CACHE_SIZE = getattr(settings, 'FLAVOR_DETAILS_CACHE_SIZE', 200)
+
+
+class FlavorDetailsError (Exception):
+    pass
+
+
+class FlavorEntry (object):
+    def __init__(self, template, etag, last_modified, expires_at):
+        # A template of None means that the flavor does not exist.
+        self.template = template
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+
+def spawn(func, *args):
+    thread = threading.Thread(target=func, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+class FlavorTemplateCache (object):
+    def __init__(self, clock=time.time, spawn=spawn, max_entries=None):
+        self.clock = clock
+        self.spawn = spawn
+        self.max_entries = max_entries if max_entries is not None else FLAVOR_DETAILS_CACHE_SIZE
+        self.lock = threading.Lock()
+        # Notified whenever a flavor is done being fetched
+        self.fetched = threading.Condition(self.lock)
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # Least recently used first
+            self.entries = OrderedDict()
+            # The slugs of the flavors being fetched or revalidated
+            self.refreshing = set()
+
+    def get_url(self, slug):
+        return '%s/%s/details.html' % (settings.PLANBOX_FLAVORS_ROOT_URL.strip('/'), slug)
+
+    def fetch(self, slug, entry=None):
+        """
+        Get the flavor's template from the flavors host, revalidating the
+        given entry if there is one. Return a new entry.
+        """
+        headers = {}
+        if entry is not None and entry.template is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        url = self.get_url(slug)
+        try:
+            response = http.get(url, headers=headers, timeout=FLAVOR_DETAILS_TIMEOUT)
+        except requests.RequestException as e:
+            raise FlavorDetailsError('Could not retrieve flavor details from %s: %s' % (url, e))
+
+        now = self.clock()
+        if response.status_code == 304 and headers:
+            return FlavorEntry(entry.template, entry.etag, entry.last_modified,
+                               now + FLAVOR_DETAILS_CACHE_TTL)
+        elif response.status_code == 200:
+            return FlavorEntry(Template(response.text),
+                               response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                               now + FLAVOR_DETAILS_CACHE_TTL)
+        elif response.status_code == 404:
+            return FlavorEntry(None, None, None, now + FLAVOR_DETAILS_MISSING_TTL)
+        else:
+            raise FlavorDetailsError('Invalid response while retrieving flavor details: %s %s' % (response.status_code, response.content))
+
+    def store(self, slug, entry):
+        with self.lock:
+            self.entries.pop(slug, None)
+            self.entries[slug] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def done_refreshing(self, slug):
+        with self.lock:
+            self.refreshing.discard(slug)
+            self.fetched.notify_all()
+
+    def refresh(self, slug, entry):
+        try:
+            try:
+                new_entry = self.fetch(slug, entry)
+            except FlavorDetailsError as e:
+                log.warning('%s; serving the cached flavor details for now.', e)
+                new_entry = FlavorEntry(entry.template, entry.etag, entry.last_modified,
+                                        self.clock() + FLAVOR_DETAILS_ERROR_TTL)
+            self.store(slug, new_entry)
+        finally:
+            self.done_refreshing(slug)
+
+    def get(self, slug):
+        """
+        Get the compiled details template for the flavor, or None if there
+        is no such flavor. Raises a FlavorDetailsError if the flavor isn't
+        cached and can't be retrieved.
+        """
+        with self.lock:
+            while True:
+                entry = self.entries.get(slug)
+                if entry is not None and entry.template is None and self.clock() >= entry.expires_at:
+                    # Forget missing flavors once they expire.
+                    del self.entries[slug]
+                    entry = None
+                if entry is not None or slug not in self.refreshing:
+                    break
+                # Another request is already downloading the flavor; wait
+                # for it rather than downloading it again.
+                self.fetched.wait()
+
+            start_refresh = False
+            if entry is None:
+                self.refreshing.add(slug)
+            else:
+                # Mark the flavor as the most recently used.
+                self.entries[slug] = self.entries.pop(slug)
+                if self.clock() >= entry.expires_at and slug not in self.refreshing:
+                    self.refreshing.add(slug)
+                    start_refresh = True
+
+        if entry is None:
+            try:
+                entry = self.fetch(slug)
+                self.store(slug, entry)
+            finally:
+                self.done_refreshing(slug)
+        elif start_refresh:
+            self.spawn(self.refresh, slug, entry)
+
+        return entry.template
+
+
+flavor_templates = FlavorTemplateCache()
@@ -0,0 +1,149 @@
+"""
+Server-side rendering of the Handlebars templates in the jstemplates
+directories, with pybars.
+
+Compiled templates are kept per process, keyed by the template file's path,
+its modification time, and the active language (the templates' i18n tags are
+translated before they're compiled), so each template is compiled once, and
+again only if the file changes.
+
+Helpers that are specific to one render (e.g., to the current request) are
+passed to each render call, instead of being written into pybars' global
+helper registry, which is shared by every request (and greenlet) in the
+process. The templates rendered on the server so far (see
+planbox_ui.prerender) don't use any, since their output is cached and shared
+by every visitor.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import re
+import threading
+import pybars
+from pybars._compiler import _each as pybars_each
+from django.conf import settings
+from django.utils import translation
+from jstemplate.conf import conf as jstemplate_conf
+from jstemplate.loading import find, JSTemplateNotFound
+from planbox_ui import jsbundles
+
+
+class HandlebarsTemplateNotFound (Exception):
+    pass
+
+
+def is_helper(this, options, a, b):
+    if a == b: return options['fn'](this)
+    else: return options['inverse'](this)
+
+
+def each_helper(this, options, context):
+    # Like Handlebars, and unlike pybars, render the else block for a missing
+    # or empty list.
+    if not context: return options['inverse'](this)
+    else: return pybars_each(this, options, context)
+
+
+def gte_helper(this, options, value, test):
+    if value >= test: return options['fn'](this)
+    else: return options['inverse'](this)
+
+
+def gte_active_section_length_helper(this, options, sections, length):
+    active_length = len([s for s in (sections or []) if s.get('active') and s.get('menu_label')])
+    if active_length >= length: return options['fn'](this)
+    else: return options['inverse'](this)
+
+
+def static_url_helper(this):
+    return settings.STATIC_URL
+
+
+# Helpers that don't depend on the request (the server-side versions of the
+# ones in handlebars-helpers.js and Swag that the templates use)
+DEFAULT_HELPERS = {
+    'is': is_helper,
+    'each': each_helper,
+    'gte': gte_helper,
+    'gte_active_section_length': gte_active_section_length_helper,
+    'static_url': static_url_helper,
+}
+
+
+def make_helpers(**helpers):
+    """
+    Get the helpers for a render call: the default helpers, along with the
+    given ones.
+    """
+    all_helpers = dict(DEFAULT_HELPERS)
+    all_helpers.update(helpers)
+    return all_helpers
+
+
+def find_template_path(name):
+    # Look the name up as a pattern, since the regex finders (unlike the glob
+    # finders) find templates in app directories given by relative paths.
+    try:
+        matches = dict(find('(%s)' % (re.escape(name),)))
+    except JSTemplateNotFound:
+        matches = {}
+    if name not in matches:
+        raise HandlebarsTemplateNotFound(name)
+    return matches[name]
+
+
+class HandlebarsTemplateCache (object):
+    def __init__(self):
+        # The pybars compiler keeps its state on the class, so only one
+        # template can be compiled at a time.
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+        self.paths = {}
+
+    def compile(self, path):
+        source = jsbundles.read_template_source(path)
+        with self.lock:
+            return pybars.Compiler().compile(source)
+
+    def get_path(self, path):
+        """
+        Get the compiled template for the file at the given path.
+        """
+        mtime = os.path.getmtime(path)
+        key = (path, translation.get_language())
+
+        # Entries are replaced whole, so a concurrent reader sees either the
+        # old entry or the new one.
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != mtime:
+            entry = self.entries[key] = (mtime, self.compile(path))
+        return entry[1]
+
+    def get(self, name):
+        """
+        Get the compiled template with the given jstemplate name (e.g.,
+        'project-tpl' or 'common/shutdown-message-tpl').
+        """
+        # Finding a template walks the template directories, so remember
+        # where each one was found.
+        key = (name, tuple(jstemplate_conf.JSTEMPLATE_DIRS))
+        path = self.paths.get(key)
+        if path is None or not os.path.exists(path):
+            path = self.paths[key] = find_template_path(name)
+        return self.get_path(path)
+
+    def render(self, name, context, helpers=None, partials=None):
+        """
+        Render the named template with the given context. The helpers are
+        added to the default helpers for this call only; partials map partial
+        names to compiled templates.
+        """
+        template = self.get(name)
+        return unicode(template(context, helpers=make_helpers(**(helpers or {})), partials=partials))
+
+
+handlebars_templates = HandlebarsTemplateCache()
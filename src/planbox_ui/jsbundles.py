@@ -0,0 +1,206 @@
+"""
+Bundles of the Handlebars templates in the jstemplates directories.
+
+Each page family (the project page, the project editor, the dashboard, etc.)
+uses a set of jstemplates, which the pages used to emit inline with one
+{% handlebarsjs ... precompile register_partials %} tag per pattern. The
+bundle_jstemplates management command instead writes each family's
+templates into a JavaScript file with a content-hashed name in STATIC_ROOT
+(along with a manifest of the bundles' names), so that browsers can cache
+them across pages and deploys. The {% jstemplate_bundle %} tag (see
+planbox_ui.templatetags.planbox_utils) refers to the bundle by URL.
+
+When USE_JSTEMPLATE_BUNDLES is off (by default, when DEBUG is on), or a
+bundle hasn't been built, the tag emits the templates inline as before, so
+that template changes show up without a build step.
+
+Like the inline templates, a bundle compiles each template lazily, and
+registers it both in Handlebars.templates and as a partial. It also adds a
+<script type="text/x-handlebars-template"> element for each template to the
+page, since the Marionette views look their templates up by element id. If
+more than one pattern in a family gives a template with the same name, the
+first one wins, as it did with the inline <script> tags.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from django.conf import settings
+from django.template import Context
+from django.utils import translation
+from django.utils.six.moves.urllib.parse import urljoin
+from jstemplate.conf import conf as jstemplate_conf
+from jstemplate.loading import find, preprocess
+from jstemplate.templatetags.handlebarsjs import HandlebarsJSNode
+
+
+log = logging.getLogger(__name__)
+
+USE_JSTEMPLATE_BUNDLES = getattr(settings, 'USE_JSTEMPLATE_BUNDLES', not settings.DEBUG)
+
+# The directory under STATIC_ROOT that bundles are written to
+BUNDLE_DIR = 'jstemplates'
+MANIFEST_NAME = 'manifest.json'
+
+# The jstemplate patterns that make up each bundle, in order of precedence
+BUNDLES = OrderedDict([
+    ('project', ('common/(.*)', 'shareabouts/(.*)', '([^/]*)')),
+    ('project-shareabouts', ('common/(.*)', 'shareabouts/(.*)', 'project-layout-shareabouts/(.*)', '([^/]*)')),
+    ('editor-v2', ('project-editor-v2/(.*)', 'common/(.*)', '(.*)')),
+    ('dashboard', ('shareabouts-dashboard/(.*)', 'project-dashboard/(.*)', 'common/(.*)')),
+    ('roundup', ('roundup/(.*)', 'common/(.*)', '(.*)')),
+    ('profiles', ('profiles/(.*)', 'common/(.*)')),
+])
+
+BUNDLE_TEMPLATE = (
+    '/* Built by the bundle_jstemplates management command. */\n'
+    '(function(H) {{\n'
+    '  var sources = {sources},\n'
+    '      name, element;\n'
+    '  H.templates = H.templates || {{}};\n'
+    '  for (name in sources) {{\n'
+    '    if (sources.hasOwnProperty(name)) {{\n'
+    '      element = document.createElement("script");\n'
+    '      element.type = "text/x-handlebars-template";\n'
+    '      element.id = name;\n'
+    '      element.text = sources[name];\n'
+    '      document.body.appendChild(element);\n'
+    '\n'
+    '      H.templates[name] = H.compile(sources[name]);\n'
+    '      H.registerPartial(name, H.templates[name]);\n'
+    '    }}\n'
+    '  }}\n'
+    '}})(Handlebars);\n'
+)
+
+
+def read_template_source(filepath):
+    with open(filepath, 'rb') as template_file:
+        content = template_file.read().decode(jstemplate_conf.FILE_CHARSET)
+    return preprocess(content)
+
+
+def get_bundle_sources(name):
+    """
+    Get an ordered mapping from template name to (preprocessed) source for
+    the named bundle.
+    """
+    sources = OrderedDict()
+    for pattern in BUNDLES[name]:
+        for template_name, filepath in sorted(find(pattern)):
+            if template_name not in sources:
+                sources[template_name] = read_template_source(filepath)
+    return sources
+
+
+def render_bundle(name):
+    """
+    Get the JavaScript for the named bundle.
+    """
+    # The templates' i18n tags are translated when the bundle is built.
+    with translation.override(settings.LANGUAGE_CODE):
+        sources = get_bundle_sources(name)
+    return BUNDLE_TEMPLATE.format(sources=json.dumps(sources, indent=2, separators=(',', ': ')))
+
+
+def get_bundle_root(static_root=None):
+    return os.path.join(static_root or settings.STATIC_ROOT, BUNDLE_DIR)
+
+
+def write_bundles(names=None, static_root=None):
+    """
+    Write the named bundles (all of them, by default) into STATIC_ROOT, with
+    content-hashed file names, and update the manifest. Returns a mapping
+    from bundle name to the path of its file, relative to STATIC_ROOT.
+    """
+    bundle_root = get_bundle_root(static_root)
+    if not os.path.isdir(bundle_root):
+        os.makedirs(bundle_root)
+
+    manifest = read_manifest(static_root)
+    written = OrderedDict()
+    for name in (names or BUNDLES):
+        content = render_bundle(name).encode('utf-8')
+        content_hash = hashlib.md5(content).hexdigest()[:12]
+        filename = '%s.%s.js' % (name, content_hash)
+
+        # Files from earlier builds are left in place, for pages that are
+        # still referring to them.
+        with open(os.path.join(bundle_root, filename), 'wb') as bundle_file:
+            bundle_file.write(content)
+        written[name] = manifest[name] = '/'.join([BUNDLE_DIR, filename])
+
+    with open(os.path.join(bundle_root, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return written
+
+
+def read_manifest(static_root=None):
+    try:
+        with open(os.path.join(get_bundle_root(static_root), MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+_manifest_cache = {}
+
+def get_manifest():
+    """
+    Get the bundle manifest for STATIC_ROOT, reading it again only if it has
+    changed since it was last read.
+    """
+    path = os.path.join(get_bundle_root(), MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+
+    if _manifest_cache.get('key') != (path, mtime):
+        _manifest_cache['manifest'] = read_manifest()
+        _manifest_cache['key'] = (path, mtime)
+    return _manifest_cache['manifest']
+
+
+def get_bundle_url(name):
+    """
+    Get the URL of the named bundle, or None if it hasn't been built.
+    """
+    bundle_path = get_manifest().get(name)
+    if bundle_path is None:
+        return None
+    return urljoin(settings.STATIC_URL, bundle_path)
+
+
+def render_inline(name, context=None):
+    """
+    Render the templates of the named bundle inline, as the handlebarsjs
+    template tag does.
+    """
+    if context is None:
+        context = Context()
+    nodes = [HandlebarsJSNode("'%s'" % (pattern,), 'precompile', 'register_partials')
+             for pattern in BUNDLES[name]]
+    return ''.join(node.render(context) for node in nodes)
+
+
+def render_bundle_tags(name, context=None):
+    """
+    Get the HTML that loads the named bundle: a <script> tag referring to the
+    built bundle, or the templates inline.
+    """
+    if name not in BUNDLES:
+        raise ValueError('Unknown jstemplate bundle: %r' % (name,))
+
+    if USE_JSTEMPLATE_BUNDLES:
+        url = get_bundle_url(name)
+        if url is not None:
+            return '<script src="%s"></script>' % (url,)
+        log.warning('The %r jstemplate bundle has not been built; run '
+                    'bundle_jstemplates. Rendering the templates inline.' % (name,))
+
+    return render_inline(name, context)
@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+from optparse import make_option
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from planbox_ui.jsbundles import BUNDLES, write_bundles
+
+
+class Command (BaseCommand):
+    args = '[bundle ...]'
+    help = ('Bundle the Handlebars jstemplates into content-hashed JavaScript '
+            'files in STATIC_ROOT (all bundles, unless names are given). Run '
+            'this after collectstatic.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--static-root', dest='static_root', default=None,
+            help='The directory to write the bundles to, instead of STATIC_ROOT.'),
+    )
+
+    def handle(self, *names, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        unknown = [name for name in names if name not in BUNDLES]
+        if unknown:
+            raise CommandError('Unknown bundle(s): %s. Choices are: %s' % (
+                ', '.join(unknown), ', '.join(BUNDLES)))
+
+        static_root = options['static_root']
+        written = write_bundles(names, static_root=static_root)
+
+        # Compress the bundles ahead of time too, like the rest of the static
+        # files (see planbox.storage).
+        precompress = getattr(staticfiles_storage, 'precompress', None)
+        if precompress is not None and static_root in (None, settings.STATIC_ROOT):
+            for path in written.values():
+                precompress(path)
+
+        if verbosity > 0:
+            for name, path in written.items():
+                self.stdout.write('Wrote the %s bundle to %s' % (name, path))
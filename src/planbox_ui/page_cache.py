@@ -0,0 +1,125 @@
+"""
+A full-response cache for read-only project pages.
+
+Public project pages look the same to every anonymous visitor, and they only
+change when someone edits the project, or when the date changes (the page's
+pre-rendered timeline marks events past or future by it; see
+planbox_ui.prerender). Responses are cached under a key that includes the
+project's timestamps, its cached version stamp (see planbox_data.cache) and
+the date, so any save or delete of the project or its parts, and each new
+day, makes the old entries unreachable.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from planbox_data.cache import get_project_version
+from planbox_ui import prerender
+
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PROJECT_PAGE_CACHE_TIMEOUT', 60 * 60)
+HITS_KEY = 'planbox:project-page-cache:hits'
+MISSES_KEY = 'planbox:project-page-cache:misses'
+
+
+def is_cacheable_request(request):
+    """
+    Only anonymous GET requests get cached pages. Anyone who is signed in may
+    see user-specific details on the page.
+    """
+    if settings.DEBUG:
+        return False
+    if request.method != 'GET':
+        return False
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated()
+
+
+def timestamp(dt):
+    return dt.isoformat() if dt else ''
+
+
+def get_page_cache_key(request, project):
+    """
+    Build a cache key for a request to a project's page. The key changes
+    whenever the project, its owner, its theme, or any of its events,
+    sections, or attachments change, and every day, and differs across
+    custom domains.
+    """
+    mapping = getattr(request, 'domain_mapping', None)
+    if mapping is not None:
+        domain, root_path = mapping.domain, mapping.root_path
+    else:
+        domain, root_path = request.get_host(), '/'
+
+    theme = project.theme
+    key_parts = [
+        project.pk,
+        get_project_version(project.pk),
+        timestamp(project.updated_at),
+        timestamp(project.last_saved_at),
+        timestamp(project.owner.updated_at),
+        timestamp(theme.updated_at) if theme else '',
+        'https' if request.is_secure() else 'http',
+        domain, root_path,
+        request.path_info,
+        request.META.get('QUERY_STRING', ''),
+        prerender.get_render_date().isoformat(),
+    ]
+    key_string = '|'.join('%s' % (part,) for part in key_parts)
+    key_hash = hashlib.md5(key_string.encode('utf-8')).hexdigest()
+    return 'planbox:project-page:%s:%s' % (project.pk, key_hash)
+
+
+def increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_cached_page(key):
+    """
+    Get the cached response for the given key, if there is one, and record
+    a cache hit or miss.
+    """
+    response = cache.get(key)
+    if response is None:
+        increment(MISSES_KEY)
+    else:
+        increment(HITS_KEY)
+    return response
+
+
+def cache_page_when_rendered(key, response):
+    """
+    Store the response in the page cache once it has been rendered.
+    """
+    def _cache_page(rendered_response):
+        if rendered_response.status_code == 200:
+            cache.set(key, rendered_response, PAGE_CACHE_TIMEOUT)
+
+    if hasattr(response, 'add_post_render_callback'):
+        response.add_post_render_callback(_cache_page)
+    else:
+        _cache_page(response)
+    return response
+
+
+def get_page_cache_stats():
+    """
+    Get the number of page cache hits and misses recorded since the counters
+    were last reset.
+    """
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        'hits': counts.get(HITS_KEY, 0),
+        'misses': counts.get(MISSES_KEY, 0),
+    }
+
+
+def reset_page_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
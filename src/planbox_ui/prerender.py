@@ -0,0 +1,292 @@
+"""
+Server-side rendering of the body of the read-only project page.
+
+Project pages carry the serialized project, and the app draws everything in
+the browser with the Handlebars templates, so until the scripts have loaded
+and run, visitors (and crawlers) see an empty page. Instead, the project body
+is rendered on the server from the same jstemplates, with pybars (see
+planbox_ui.handlebars), into the markup that the Marionette views in
+views/display.js build: the project template, with the active sections in
+#section-list, the events (and their attachments) in each timeline, and the
+questions in each FAQ list. The page shows that markup until the app starts;
+the app then shows its views in its place (see app.js).
+
+Rendered bodies are cached under a key made from the same stamps as the page
+cache key, so they are rendered again whenever the project or any of its
+parts change. The key also includes the date, since timeline events are
+marked past or future as the timeline view marks them (by the server's date,
+rather than the visitor's), and ETAG_SALT, so that bodies are rendered again
+after the templates change.
+
+Only the default layout is rendered on the server; pybars can't parse the
+shareabouts layout's project template. Raw HTML sections that contain scripts
+are left empty, so that the scripts don't run twice.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import re
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+from django.utils.timezone import is_aware, localtime, now
+from planbox_data.cache import get_project_version
+from planbox_data.conditional import make_etag, timestamp
+from planbox_ui.handlebars import handlebars_templates
+
+
+log = logging.getLogger(__name__)
+
+PRERENDER_PROJECT_PAGES = getattr(settings, 'PRERENDER_PROJECT_PAGES', True)
+PRERENDER_CACHE_TIMEOUT = getattr(settings, 'PROJECT_PRERENDER_CACHE_TIMEOUT', 60 * 60 * 24)
+
+PRERENDERED_LAYOUTS = ('generic',)
+
+# The number of upcoming events that the timeline shows before "Show More
+# Events" (see TimelineSectionView.onRender)
+VISIBLE_FUTURE_EVENTS = 4
+
+
+class JSArray (list):
+    """
+    A list with a `length`, for templates that use it (e.g., `sections.length`)
+    as they would in JavaScript.
+    """
+    def get(self, name, default=None):
+        if name == 'length':
+            return len(self)
+        try:
+            return self[int(name)]
+        except (ValueError, IndexError):
+            return default
+
+
+def to_template_data(value):
+    if isinstance(value, dict):
+        return dict((key, to_template_data(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return JSArray(to_template_data(item) for item in value)
+    return value
+
+
+# Markup manipulation ========================================================
+#
+# The views fill in (or change the classes on) elements that are empty in
+# the templates, so these only look for empty elements.
+
+def find_empty_element(html, attr, value):
+    if attr == 'class':
+        value_pattern = r'(?:[^"]*\s)?%s(?:\s[^"]*)?' % (re.escape(value),)
+    else:
+        value_pattern = re.escape(value)
+    return re.search(r'(<([a-zA-Z0-9]+)\s[^>]*%s="%s"[^>]*>)(</\2>)' % (attr, value_pattern), html)
+
+
+def append_to(html, content, attr, value):
+    """
+    Insert the content into the first empty element whose attribute has the
+    given value (or, for `class`, includes it), as a region or an item view
+    container would.
+    """
+    match = find_empty_element(html, attr, value)
+    if match is None:
+        return html
+    return html[:match.end(1)] + content + html[match.start(3):]
+
+
+def remove_class(html, marker_class, class_name):
+    """
+    Remove a class from the first element with the marker class.
+    """
+    pattern = r'(<[a-zA-Z0-9]+\s[^>]*class=")((?:[^"]*\s)?%s(?:\s[^"]*)?)(")' % (re.escape(marker_class),)
+    def _remove(match):
+        classes = [c for c in match.group(2).split() if c != class_name]
+        return match.group(1) + ' '.join(classes) + match.group(3)
+    return re.sub(pattern, _remove, html, count=1)
+
+
+def make_element(tag_name, content, attrs=()):
+    """
+    Wrap the content in an element, as Backbone makes a view's element (the
+    id, and then the class).
+    """
+    attr_string = ''.join(' %s="%s"' % (name, escape(value)) for name, value in attrs)
+    return '<%s%s>%s</%s>' % (tag_name, attr_string, content, tag_name)
+
+
+def section_attrs(section, type_name):
+    return [('id', 'section-%s-wrapper' % (section.get('slug'),)),
+            ('class', 'project-section-%s' % (type_name,))]
+
+
+# Sections ===================================================================
+
+def get_event_date(event):
+    """
+    Get the date of an event, as the event view reads it from the event's
+    rendered datetime, or None if it has no (valid) date.
+    """
+    if not event.get('datetime_label'):
+        return None
+    start = parse_datetime(event.get('start_datetime') or '')
+    if start is None:
+        return None
+    return (localtime(start) if is_aware(start) else start).date()
+
+
+def render_attachment_list(event):
+    items = ''.join(
+        make_element('li', handlebars_templates.render('attachment-tpl', attachment), [('class', 'attachment')])
+        for attachment in (event.get('attachments') or []))
+    html = handlebars_templates.render('attachments-section-tpl', event)
+    return make_element('div', append_to(html, items, 'class', 'attachment-list'))
+
+
+def render_event(event, classes):
+    html = handlebars_templates.render('event-tpl', event)
+    html = append_to(html, render_attachment_list(event), 'class', 'attachments-region')
+    return make_element('li', html, [('class', ' '.join(['event'] + classes))])
+
+
+def render_timeline_section(section, project, today):
+    events = project.get('events') or []
+
+    # The section shows the tags of all the events, sorted and de-duplicated
+    # (see TimelineSectionView.serializeData).
+    data = dict(section)
+    data['tags'] = JSArray(sorted(set(
+        tag for event in events for tag in ((event.get('details') or {}).get('tags') or []))))
+
+    # Past events are hidden, as are the upcoming ones after the first few
+    # (see EventView.onRender and TimelineSectionView.onRender).
+    items = []
+    past_count = future_count = 0
+    for event in events:
+        event_date = get_event_date(event)
+        if event_date is not None and event_date < today:
+            past_count += 1
+            classes = ['past-event', 'hide']
+        else:
+            future_count += 1
+            classes = ['future-event']
+            if future_count > VISIBLE_FUTURE_EVENTS:
+                classes.append('hide')
+        items.append(render_event(event, classes))
+
+    html = handlebars_templates.render('timeline-section-tpl', data)
+    html = append_to(html, ''.join(items), 'class', 'event-list')
+    if past_count:
+        html = remove_class(html, 'show-more-past-events', 'hide')
+    if future_count > VISIBLE_FUTURE_EVENTS:
+        html = remove_class(html, 'show-more-future-events', 'hide')
+    return make_element('section', html, section_attrs(section, 'timeline'))
+
+
+def render_faqs_section(section, project, today):
+    items = ''.join(
+        make_element('div', handlebars_templates.render('faq-tpl', faq), [('class', 'faq')])
+        for faq in (section.get('details') or []))
+    html = handlebars_templates.render('faqs-section-tpl', section)
+    html = append_to(html, items, 'class', 'faq-list')
+    return make_element('section', html, section_attrs(section, 'faqs'))
+
+
+def render_raw_section(section, project, today):
+    content = (section.get('details') or {}).get('content') or ''
+    if re.search(r'<script\b', content, re.IGNORECASE):
+        return make_element('section', '', section_attrs(section, 'raw'))
+    return render_item_section('raw', section)
+
+
+def render_item_section(type_name, section):
+    html = handlebars_templates.render('%s-section-tpl' % (type_name,), section)
+    return make_element('section', html, section_attrs(section, type_name))
+
+
+def item_section_renderer(type_name):
+    return lambda section, project, today: render_item_section(type_name, section)
+
+
+# The section renderers, by type (see ProjectSectionListView.sectionViews)
+SECTION_RENDERERS = {
+    'timeline': render_timeline_section,
+    'text': item_section_renderer('text'),
+    'image': item_section_renderer('image'),
+    'faqs': render_faqs_section,
+    'shareabouts': item_section_renderer('shareabouts'),
+    'raw': render_raw_section,
+}
+
+
+# Projects ===================================================================
+
+def render_project_body(project_data, today=None):
+    """
+    Render the body of the page for the given serialized project, as the
+    ProjectView would. Returns None if the project can't be rendered on the
+    server.
+    """
+    project = to_template_data(project_data)
+    if project.get('layout', 'generic') not in PRERENDERED_LAYOUTS:
+        return None
+    if today is None:
+        today = get_render_date()
+
+    sections = [section for section in (project.get('sections') or []) if section.get('active')]
+    unknown_types = set(section.get('type') for section in sections) - set(SECTION_RENDERERS)
+    if unknown_types:
+        # The app won't be able to show the project either.
+        log.warning('Not pre-rendering project %s, with unrecognized section '
+                    'type(s): %s' % (project.get('id'), ', '.join(map(unicode, unknown_types))))
+        return None
+
+    section_list = ''.join(SECTION_RENDERERS[section['type']](section, project, today)
+                           for section in sections)
+    html = handlebars_templates.render('project-tpl', project)
+    html = append_to(html, make_element('div', section_list), 'id', 'section-list')
+    return make_element('div', html, [('class', '%s-page' % (project.get('layout', 'generic'),))])
+
+
+def get_render_date():
+    """
+    Get the date by which rendered timelines mark events past or future.
+    Anything that caches or validates a page with a rendered body has to vary
+    by it too.
+    """
+    return localtime(now()).date()
+
+
+def get_prerender_cache_key(project, today):
+    theme = project.theme
+    key_hash = make_etag(
+        'prerender', project.pk,
+        get_project_version(project.pk),
+        timestamp(project.updated_at),
+        timestamp(project.last_saved_at),
+        timestamp(project.owner.updated_at),
+        timestamp(theme.updated_at) if theme else '',
+        translation.get_language(),
+        settings.STATIC_URL,
+        today.isoformat())
+    return 'planbox:project-prerender:%s:%s' % (project.pk, key_hash)
+
+
+def get_prerendered_project(project, project_data):
+    """
+    Get the rendered body of the page for the given project (and its
+    serialized data), from the cache if it has already been rendered.
+    Returns None if the project isn't rendered on the server.
+    """
+    if not PRERENDER_PROJECT_PAGES or project.layout not in PRERENDERED_LAYOUTS:
+        return None
+
+    today = get_render_date()
+    cache_key = get_prerender_cache_key(project, today)
+    html = cache.get(cache_key)
+    if html is None:
+        html = render_project_body(project_data, today) or ''
+        cache.set(cache_key, html, PRERENDER_CACHE_TIMEOUT)
+    return html or None
@@ -0,0 +1,189 @@
+"""
+Sitemaps for the public project pages.
+
+/sitemap.xml is a sitemap index that lists one sitemap shard
+(/sitemap-<n>.xml) for every SITEMAP_SHARD_SIZE URLs, which is the most a
+single sitemap may hold. Each URL's lastmod comes from its project's own
+updated_at and last_saved_at, and each shard's lastmod in the index is the
+latest among its projects, so crawlers only re-fetch the shards that changed.
+Projects that aren't public or have expired are left out.
+
+Shards are streamed straight from a database iterator, so no more than one
+shard's worth of rows is held at a time, however many public projects there
+are. The index only takes a few small queries per shard, and is cached for
+SITEMAP_CACHE_TIMEOUT seconds per host and path, since custom domains (see
+custom_domains) each get a sitemap scoped to the profile or project that
+they are mapped to.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.utils.timezone import now
+from planbox_data.models import Project
+from xml.sax.saxutils import escape
+
+
+# The most URLs to put in one sitemap
+SITEMAP_SHARD_SIZE = getattr(settings, 'SITEMAP_SHARD_SIZE', 50000)
+# Seconds for which to cache sitemap indexes, and to let clients cache sitemaps
+SITEMAP_CACHE_TIMEOUT = getattr(settings, 'SITEMAP_CACHE_TIMEOUT', 60 * 60)
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def format_lastmod(value):
+    return value.replace(microsecond=0).isoformat()
+
+
+def get_deploy_lastmod():
+    deploy_date = getattr(settings, 'LAST_DEPLOY_DATE', None)
+    return deploy_date[:10] if deploy_date else None
+
+
+def get_sitemap_projects(owner_slug=None, project_slug=None):
+    """
+    Get the projects that belong in a sitemap, in a stable order. The
+    sitemap may be scoped to a single owner, or a single project.
+    """
+    projects = Project.objects\
+        .filter(public=True)\
+        .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now()))
+    if owner_slug is not None:
+        projects = projects.filter(owner__slug=owner_slug)
+    if project_slug is not None:
+        projects = projects.filter(slug=project_slug)
+    return projects.order_by('pk')
+
+
+class Sitemap (object):
+    """
+    The URLs for one scope (everything, an owner, or a project), split into
+    shards. If the sitemap is for the whole site, the site's home page comes
+    before the projects, in the first shard.
+    """
+    def __init__(self, owner_slug=None, project_slug=None, shard_size=None):
+        self.projects = get_sitemap_projects(owner_slug, project_slug)
+        self.include_home_page = (owner_slug is None)
+        self.shard_size = shard_size or SITEMAP_SHARD_SIZE
+
+    @property
+    def offset(self):
+        # The number of URLs that come before the projects.
+        return 1 if self.include_home_page else 0
+
+    def get_shard_count(self):
+        total = self.projects.count() + self.offset
+        return max(1, (total + self.shard_size - 1) // self.shard_size)
+
+    def get_project_range(self, number):
+        """
+        Get the [start, end) range of the projects in the given shard
+        (numbered from 1).
+        """
+        start = max(0, (number - 1) * self.shard_size - self.offset)
+        end = number * self.shard_size - self.offset
+        return start, end
+
+    def get_shard_lastmods(self):
+        """
+        Get the lastmod of each shard. Each shard's projects are found by
+        primary key range, so that the latest modification times come from
+        index-friendly aggregate queries instead of from reading every row.
+        """
+        shard_count = self.get_shard_count()
+        boundaries = []
+        for number in range(1, shard_count + 1):
+            start, _ = self.get_project_range(number)
+            pks = list(self.projects.values_list('pk', flat=True)[start:start + 1])
+            boundaries.append(pks[0] if pks else None)
+
+        lastmods = []
+        for index, boundary in enumerate(boundaries):
+            candidates = []
+            if index == 0 and self.include_home_page:
+                candidates.append(get_deploy_lastmod())
+
+            if boundary is not None:
+                shard_projects = self.projects.filter(pk__gte=boundary)
+                if index + 1 < len(boundaries) and boundaries[index + 1] is not None:
+                    shard_projects = shard_projects.filter(pk__lt=boundaries[index + 1])
+                latest = shard_projects.aggregate(updated_at=Max('updated_at'), last_saved_at=Max('last_saved_at'))
+                candidates.extend(format_lastmod(value) for value in latest.values() if value)
+
+            candidates = [candidate for candidate in candidates if candidate]
+            lastmods.append(max(candidates) if candidates else None)
+        return lastmods
+
+    def iter_index(self, shard_url_format):
+        """
+        Generate the sitemap index, given a format string for the shards'
+        URLs (e.g., 'http://example.com/sitemap-%s.xml').
+        """
+        yield XML_HEADER
+        yield '<sitemapindex xmlns="%s">\n' % (XMLNS,)
+        for number, lastmod in enumerate(self.get_shard_lastmods(), 1):
+            yield '  <sitemap>\n'
+            yield '    <loc>%s</loc>\n' % (escape(shard_url_format % (number,)),)
+            if lastmod:
+                yield '    <lastmod>%s</lastmod>\n' % (lastmod,)
+            yield '  </sitemap>\n'
+        yield '</sitemapindex>\n'
+
+    def iter_shard(self, number, root_url, fix_url=None):
+        """
+        Generate a sitemap shard (numbered from 1). Project page paths are
+        passed through fix_url, so that they're correct for the domain being
+        served, and appended to the root_url (e.g., 'http://example.com').
+        """
+        fix_url = fix_url or (lambda url: url)
+        start, end = self.get_project_range(number)
+        rows = self.projects\
+            .values_list('owner__slug', 'slug', 'updated_at', 'last_saved_at')[start:end]\
+            .iterator()
+
+        yield XML_HEADER
+        yield '<urlset xmlns="%s">\n' % (XMLNS,)
+
+        if number == 1 and self.include_home_page:
+            yield self.render_url(root_url + '/', get_deploy_lastmod(), 'monthly', '1.0')
+
+        for owner_slug, project_slug, updated_at, last_saved_at in rows:
+            # This is the path of the app-project-page URL; building it
+            # directly saves a reverse() per project.
+            path = fix_url('/%s/%s/' % (owner_slug, project_slug))
+            modified = max(updated_at, last_saved_at or updated_at)
+            yield self.render_url(root_url + path, format_lastmod(modified), 'daily', '0.8')
+
+        yield '</urlset>\n'
+
+    def render_url(self, loc, lastmod, changefreq, priority):
+        parts = ['  <url>\n', '    <loc>%s</loc>\n' % (escape(loc),)]
+        if lastmod:
+            parts.append('    <lastmod>%s</lastmod>\n' % (lastmod,))
+        parts.append('    <changefreq>%s</changefreq>\n' % (changefreq,))
+        parts.append('    <priority>%s</priority>\n' % (priority,))
+        parts.append('  </url>\n')
+        return ''.join(parts)
+
+
+def get_index_cache_key(root_url, path):
+    key_string = '%s|%s' % (root_url, path)
+    return 'planbox:sitemap-index:%s' % (hashlib.md5(key_string.encode('utf-8')).hexdigest(),)
+
+
+def get_cached_index(sitemap, root_url, path, shard_url_format):
+    """
+    Get the rendered sitemap index for the given host and path, from the
+    cache if it's there.
+    """
+    key = get_index_cache_key(root_url, path)
+    content = cache.get(key)
+    if content is None:
+        content = ''.join(sitemap.iter_index(shard_url_format))
+        cache.set(key, content, SITEMAP_CACHE_TIMEOUT)
+    return content
@@ -19,6 +19,9 @@ var Planbox = Planbox || {};
       return model.get('active');
     }));
 
+    // The page may already hold the project as rendered on the server (see
+    // planbox_ui/prerender.py). Showing the view replaces that markup with
+    // the same markup, now with the view's events bound.
     NS.app.mainRegion.show(new NS.ProjectView({
       className: NS.app.projectModel.get('layout') + '-page',
       model: NS.app.projectModel,
@@ -184,7 +184,7 @@ var Planbox = Planbox || {};
 
   NS.RoundupModel = NS.DetailModel.extend({
     baseAttrs: ['details', 'id', 'created_at', 'updated_at', 'title', 'slug',
-                'owner', 'template', 'theme', 'projects'],
+                'owner', 'template', 'theme', 'projects', 'projects_next'],
 
     relations: [{
       type: Backbone.HasOne,
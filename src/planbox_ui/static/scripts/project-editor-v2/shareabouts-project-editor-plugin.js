@@ -14,8 +14,15 @@ var Planbox = Planbox || {};
   // (NS.app is defined in base-app.js)
 
   NS.ShareaboutsProjectEditorPlugin = NS.Plugin.extend({
+    datasetClonePollInterval: 5000,
+
     initialize: function() {
       this.config = this.getShareaboutsConfig();
+
+      // A cloned project's dataset is cloned in the background; wait for it.
+      if (this.config && this.config.details.dataset_status === 'pending') {
+        this.pollDatasetCloneStatus(this.config.id);
+      }
     },
 
     getShareaboutsConfig: function() {
@@ -24,11 +31,39 @@ var Planbox = Planbox || {};
       return shareaboutsSection;
     },
 
+    pollDatasetCloneStatus: function(sectionId) {
+      var self = this;
+
+      $.ajax({
+        url: '/shareabouts/dataset-clone-status',
+        data: {section_id: sectionId},
+        success: function(data) {
+          var section = NS.app.projectModel && NS.app.projectModel.get('sections').get(sectionId),
+              details;
+
+          if (data.status === 'done' || data.status === 'failed') {
+            if (section) {
+              details = _.omit(section.get('details'), 'dataset_status');
+              if (data.status === 'done') {
+                details.dataset_url = data.dataset_url;
+              } else {
+                details.dataset_status = data.status;
+              }
+              section.set('details', details);
+            }
+          } else {
+            _.delay(_.bind(self.pollDatasetCloneStatus, self), self.datasetClonePollInterval, sectionId);
+          }
+        }
+      });
+    },
+
     presave: function(project, options) {
       var self = this,
           section = project.get('sections').findWhere({type: 'shareabouts'});
 
-      if (section && !section.get('details').dataset_url) {
+      if (section && !section.get('details').dataset_url &&
+          section.get('details').dataset_status !== 'pending') {
         // Create the dataset and set the dataset url on the section model
         $.ajax({
           url: '/shareabouts/create-dataset',
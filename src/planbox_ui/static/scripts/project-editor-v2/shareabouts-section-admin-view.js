@@ -107,7 +107,8 @@ var Planbox = Planbox || {};
       presave: function() {
         var self = this;
 
-        if (!this.model.get('details').dataset_url) {
+        if (!this.model.get('details').dataset_url &&
+            this.model.get('details').dataset_status !== 'pending') {
           // Create the dataset and set the dataset url on the section model
           $.ajax({
             url: '/shareabouts/create-dataset',
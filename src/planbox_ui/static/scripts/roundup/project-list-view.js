@@ -21,6 +21,33 @@ var Planbox = Planbox || {};
     itemViewContainer: '.project-list',
     emptyView: NS.ProjectListEmptyView,
 
+    events: {
+      'click .load-more-projects-button': 'handleLoadMore'
+    },
+
+    modelEvents: {
+      'change:projects_next': 'render'
+    },
+
+    handleLoadMore: function(evt) {
+      var self = this,
+          $button = $(evt.currentTarget);
+
+      evt.preventDefault();
+      $button.addClass('disabled');
+
+      // Only the first page of projects comes with the roundup; get the
+      // next page, and the URL of the one after that.
+      $.getJSON(this.model.get('projects_next'))
+        .done(function(data) {
+          self.collection.add(data.results);
+          self.model.set('projects_next', data.next);
+        })
+        .fail(function() {
+          $button.removeClass('disabled');
+        });
+    },
+
     showEmptyView: function(){
       var EmptyView = this.getEmptyView();
 
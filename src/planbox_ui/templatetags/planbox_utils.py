@@ -8,6 +8,7 @@ from django.template import Library
 from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe
 
+from planbox_ui import jsbundles
 from planbox_ui.utils import strip_tags
 
 register = Library()
@@ -36,3 +37,8 @@ def force_list(value):
         return value
     else:
         return [value]
+
+@register.simple_tag(takes_context=True)
+def jstemplate_bundle(context, name):
+    """Loads the named bundle of Handlebars templates (see planbox_ui.jsbundles)."""
+    return mark_safe(jsbundles.render_bundle_tags(name, context))
@@ -1,17 +1,54 @@
+from contextlib import contextmanager
 from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import Http404
+from django.core.management import call_command
+from django.template import Context, Template
 from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
 from django.utils.timezone import datetime, now, timedelta, utc
+from datetime import date
 from django_nose.tools import assert_num_queries
 from nose.tools import assert_equal, assert_raises, assert_in, assert_not_in, assert_is_not_none
 from urllib import urlencode
+import json
+import os
+import shutil
+import tempfile
+import time
 import responses
 
 from django.contrib.auth.models import User as UserAuth, AnonymousUser
+from custom_domains.models import DomainMapping
 from planbox_data.models import Profile, Project, Event, Theme
+from planbox.outbound import http
+from planbox_ui import jsbundles, page_cache, prerender
+from planbox_ui.handlebars import HandlebarsTemplateCache
+from planbox_ui.sitemaps import Sitemap
+from planbox_ui.flavors import (FlavorTemplateCache, FlavorDetailsError, FlavorEntry,
+    FLAVOR_DETAILS_CACHE_TTL, FLAVOR_DETAILS_MISSING_TTL)
 from planbox_ui.views import (project_editor_view, project_page_view, new_project_view,
     project_payments_success_view, signup_view, signin_view, profile_view)
+import pybars
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+
+@contextmanager
+def next_day():
+    """
+    Render project pages as though it were tomorrow.
+    """
+    get_render_date = prerender.get_render_date
+    prerender.get_render_date = lambda: get_render_date() + timedelta(days=1)
+    try:
+        yield
+    finally:
+        prerender.get_render_date = get_render_date
 
 
 class PlanBoxUITestCase (TestCase):
@@ -26,6 +63,7 @@ class PlanBoxUITestCase (TestCase):
         Profile.objects.all().delete()
         Project.objects.all().delete()
         Event.objects.all().delete()
+        cache.clear()
 
 
 class SignupViewTests (PlanBoxUITestCase):
@@ -612,6 +650,201 @@ class ProjectPageViewTests (PlanBoxUITestCase):
             response = project_page_view(request, **kwargs)
 
 
+class ProjectPageCacheTests (PlanBoxUITestCase):
+    def get_page(self, owner, project, user=None):
+        kwargs = {
+            'owner_slug': owner.slug,
+            'project_slug': project.slug
+        }
+
+        url = reverse('app-project-page', kwargs=kwargs)
+        request = self.factory.get(url)
+        request.user = user or AnonymousUser()
+        response = project_page_view(request, **kwargs)
+        response.render()
+        return response
+
+    def test_anon_gets_cached_page_on_repeat_visits(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        page_cache.reset_page_cache_stats()
+
+        response1 = self.get_page(owner, project)
+        response2 = self.get_page(owner, project)
+
+        assert_equal(response2.status_code, 200)
+        assert_equal(response1.content, response2.content)
+        assert_equal(page_cache.get_page_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_cached_page_is_invalidated_when_an_event_changes(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        page_cache.reset_page_cache_stats()
+
+        self.get_page(owner, project)
+        Event.objects.create(label='A brand new event', slug='a-brand-new-event', project=project)
+        response = self.get_page(owner, project)
+
+        assert_in('A brand new event', response.content.decode('utf-8'))
+        assert_equal(page_cache.get_page_cache_stats(), {'hits': 0, 'misses': 2})
+
+    def test_cached_page_is_not_used_the_next_day(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        page_cache.reset_page_cache_stats()
+
+        self.get_page(owner, project)
+        with next_day():
+            self.get_page(owner, project)
+
+        assert_equal(page_cache.get_page_cache_stats(), {'hits': 0, 'misses': 2})
+
+    def test_authenticated_users_do_not_use_the_page_cache(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        owner = auth.profile
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        page_cache.reset_page_cache_stats()
+
+        self.get_page(owner, project, user=auth)
+        self.get_page(owner, project, user=auth)
+
+        assert_equal(page_cache.get_page_cache_stats(), {'hits': 0, 'misses': 0})
+
+
+class ProjectPageConditionalGetTests (PlanBoxUITestCase):
+    def get_page(self, owner, project, user=None, **headers):
+        kwargs = {
+            'owner_slug': owner.slug,
+            'project_slug': project.slug
+        }
+
+        url = reverse('app-project-page', kwargs=kwargs)
+        request = self.factory.get(url, **headers)
+        request.user = user or AnonymousUser()
+        response = project_page_view(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_unchanged_page_is_not_modified(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+
+        response = self.get_page(owner, project)
+        assert_equal(response.status_code, 200)
+        assert_in('ETag', response)
+        assert_in('Last-Modified', response)
+        assert_not_in('no-store', response['Cache-Control'])
+
+        with assert_num_queries(1):
+            response = self.get_page(owner, project, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert_equal(response.status_code, 304)
+        assert_equal(response.content, b'')
+
+        response = self.get_page(owner, project, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        assert_equal(response.status_code, 304)
+
+    def test_page_is_modified_the_next_day(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        response = self.get_page(owner, project)
+
+        with next_day():
+            assert_equal(self.get_page(owner, project, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+            assert_equal(self.get_page(owner, project, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_page_is_modified_when_an_event_changes(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        etag = self.get_page(owner, project)['ETag']
+
+        Event.objects.create(label='A brand new event', slug='a-brand-new-event', project=project)
+        response = self.get_page(owner, project, HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, 200)
+        assert_in('A brand new event', response.content.decode('utf-8'))
+
+    def test_authenticated_users_pages_are_not_validated(self):
+        auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        owner = auth.profile
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+
+        response = self.get_page(owner, project, user=auth, HTTP_IF_NONE_MATCH='*')
+        assert_equal(response.status_code, 200)
+        assert_not_in('ETag', response)
+        assert_in('no-store', response['Cache-Control'])
+
+
+class SitemapTests (PlanBoxUITestCase):
+    def set_up(self):
+        super(SitemapTests, self).set_up()
+        self.owner = Profile.objects.create(slug='mjumbewu')
+        self.saved_at = datetime(2014, 6, 1, 12, 30, tzinfo=utc)
+        Project.objects.create(slug='public-plan', title='public', owner=self.owner, public=True, last_saved_at=self.saved_at)
+        Project.objects.create(slug='private-plan', title='private', owner=self.owner, public=False)
+        Project.objects.create(slug='expired-plan', title='expired', owner=self.owner, public=True, expires_at=now() - timedelta(days=1))
+        Project.objects.create(slug='active-plan', title='active', owner=self.owner, public=True, expires_at=now() + timedelta(days=1))
+
+    def tear_down(self):
+        DomainMapping.objects.all().delete()
+        super(SitemapTests, self).tear_down()
+
+    def test_index_lists_the_shards(self):
+        response = self.client.get('/sitemap.xml')
+        content = response.content.decode('utf-8')
+
+        assert_equal(response.status_code, 200)
+        assert_in('<loc>http://testserver/sitemap-1.xml</loc>', content)
+        assert_not_in('sitemap-2.xml', content)
+
+    def test_shard_lists_public_unexpired_projects_with_their_own_lastmod(self):
+        response = self.client.get('/sitemap-1.xml')
+        content = b''.join(response.streaming_content).decode('utf-8')
+
+        assert_in('<loc>http://testserver/</loc>', content)
+        assert_in('<loc>http://testserver/mjumbewu/public-plan/</loc>', content)
+        assert_in('<loc>http://testserver/mjumbewu/active-plan/</loc>', content)
+        assert_not_in('private-plan', content)
+        assert_not_in('expired-plan', content)
+
+        project = Project.objects.get(slug='public-plan')
+        lastmod = max(project.updated_at, self.saved_at).replace(microsecond=0).isoformat()
+        assert_in('<lastmod>%s</lastmod>' % (lastmod,), content)
+
+    def test_projects_are_split_across_shards(self):
+        for index in range(3):
+            Project.objects.create(slug='plan-%s' % (index,), title='plan', owner=self.owner, public=True)
+        sitemap = Sitemap(shard_size=2)
+
+        # The home page, plus five projects
+        assert_equal(sitemap.get_shard_count(), 3)
+        assert_equal(len([lastmod for lastmod in sitemap.get_shard_lastmods() if lastmod]), 3)
+
+        urls = []
+        for number in range(1, 4):
+            shard = ''.join(sitemap.iter_shard(number, 'http://testserver'))
+            assert_equal(shard.count('<url>'), 2)
+            urls.append(shard)
+        assert_equal(len(set(urls)), 3)
+
+    def test_unknown_shard_is_not_found(self):
+        response = self.client.get('/sitemap-2.xml')
+        assert_equal(response.status_code, 404)
+
+    def test_custom_domain_gets_its_own_scoped_sitemap(self):
+        other_owner = Profile.objects.create(slug='someone-else')
+        Project.objects.create(slug='other-plan', title='other', owner=other_owner, public=True)
+        DomainMapping.objects.create(domain='plans.example.com', root_path='/mjumbewu/')
+
+        index = self.client.get('/sitemap.xml', HTTP_HOST='plans.example.com')
+        assert_in('<loc>http://plans.example.com/sitemap-1.xml</loc>', index.content.decode('utf-8'))
+
+        response = self.client.get('/sitemap-1.xml', HTTP_HOST='plans.example.com')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        assert_in('<loc>http://plans.example.com/public-plan/</loc>', content)
+        assert_not_in('other-plan', content)
+        assert_not_in('<loc>http://plans.example.com/</loc>', content)
+
+
 class ProjectThemeTests (PlanBoxUITestCase):
     def test_can_render_project_with_theme(self):
         auth = UserAuth.objects.create_user(username='mjumbewu', password='123')
@@ -711,3 +944,374 @@ class ProfileAdminTests (PlanBoxUITestCase):
         assert_in('profile_data', response.context_data)
         assert_equal(response.context_data['profile_data']['slug'], profile.slug)
 
+
+class FakeClock (object):
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class FlavorTemplateCacheTests (PlanBoxUITestCase):
+    def set_up(self):
+        super(FlavorTemplateCacheTests, self).set_up()
+        http.reset()
+        self.clock = FakeClock()
+        self.spawned = []
+        self.flavors = FlavorTemplateCache(clock=self.clock, spawn=self.spawn)
+        self.url = self.flavors.get_url('bikes')
+
+    def spawn(self, func, *args):
+        # Run background refreshes right away
+        self.spawned.append(args)
+        func(*args)
+
+    def expire(self, ttl=FLAVOR_DETAILS_CACHE_TTL):
+        self.clock.time += ttl + 1
+
+    @responses.activate
+    def test_templates_are_downloaded_once_until_they_expire(self):
+        responses.add(responses.GET, self.url, body='<h1>Bikes</h1>')
+
+        template = self.flavors.get('bikes')
+        assert_equal(template.render(Context({})), '<h1>Bikes</h1>')
+        assert_equal(self.flavors.get('bikes'), template)
+        assert_equal(len(responses.calls), 1)
+
+    @responses.activate
+    def test_expired_templates_are_revalidated(self):
+        responses.add(responses.GET, self.url, body='<h1>Bikes</h1>',
+                      adding_headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Dec 2014 00:00:00 GMT'})
+        template = self.flavors.get('bikes')
+
+        self.expire()
+        responses.reset()
+        responses.add(responses.GET, self.url, status=304, body='')
+
+        # The stale template is served while it's revalidated.
+        assert_equal(self.flavors.get('bikes'), template)
+        assert_equal(len(self.spawned), 1)
+        request = responses.calls[0].request
+        assert_equal(request.headers['If-None-Match'], '"v1"')
+        assert_equal(request.headers['If-Modified-Since'], 'Mon, 01 Dec 2014 00:00:00 GMT')
+
+        # The 304 renews the entry
+        assert_equal(self.flavors.get('bikes'), template)
+        assert_equal(len(responses.calls), 1)
+
+    @responses.activate
+    def test_changed_templates_are_replaced(self):
+        responses.add(responses.GET, self.url, body='<h1>Bikes</h1>', adding_headers={'ETag': '"v1"'})
+        self.flavors.get('bikes')
+
+        self.expire()
+        responses.reset()
+        responses.add(responses.GET, self.url, body='<h1>Bicycles</h1>', adding_headers={'ETag': '"v2"'})
+        self.flavors.get('bikes')
+
+        assert_equal(self.flavors.get('bikes').render(Context({})), '<h1>Bicycles</h1>')
+
+    @responses.activate
+    def test_stale_templates_are_served_while_the_host_is_down(self):
+        responses.add(responses.GET, self.url, body='<h1>Bikes</h1>')
+        template = self.flavors.get('bikes')
+
+        self.expire()
+        responses.reset()
+        responses.add(responses.GET, self.url, status=500)
+
+        assert_equal(self.flavors.get('bikes'), template)
+        assert_equal(self.flavors.get('bikes'), template)
+        assert_equal(len(responses.calls), 1)
+
+    @responses.activate
+    def test_missing_flavors_are_cached_briefly(self):
+        responses.add(responses.GET, self.url, status=404)
+
+        assert_equal(self.flavors.get('bikes'), None)
+        assert_equal(self.flavors.get('bikes'), None)
+        assert_equal(len(responses.calls), 1)
+
+        self.expire(FLAVOR_DETAILS_MISSING_TTL)
+        responses.reset()
+        responses.add(responses.GET, self.url, body='<h1>Bikes</h1>')
+        self.flavors.get('bikes')
+
+        assert_equal(self.flavors.get('bikes').render(Context({})), '<h1>Bikes</h1>')
+
+    @responses.activate
+    def test_uncached_flavors_raise_when_the_host_is_down(self):
+        responses.add(responses.GET, self.url, status=500)
+        with assert_raises(FlavorDetailsError):
+            self.flavors.get('bikes')
+
+    @responses.activate
+    def test_expired_missing_flavors_are_forgotten(self):
+        responses.add(responses.GET, self.url, status=404)
+        self.flavors.get('bikes')
+
+        self.expire(FLAVOR_DETAILS_MISSING_TTL)
+        assert_equal(self.flavors.get('bikes'), None)
+        assert_equal(len(responses.calls), 2)
+        assert_equal(self.spawned, [])
+
+    @responses.activate
+    def test_least_recently_used_flavors_are_dropped(self):
+        self.flavors = FlavorTemplateCache(clock=self.clock, spawn=self.spawn, max_entries=2)
+        for slug in ('bikes', 'buses', 'cars'):
+            responses.add(responses.GET, self.flavors.get_url(slug), status=404)
+
+        self.flavors.get('bikes')
+        self.flavors.get('buses')
+        self.flavors.get('bikes')
+        self.flavors.get('cars')
+        assert_equal(list(self.flavors.entries), ['bikes', 'cars'])
+
+    def test_concurrent_misses_share_one_download(self):
+        downloads = []
+        def fetch(slug, entry=None):
+            downloads.append(slug)
+            # Let the other requests come in while this one downloads.
+            for _ in range(10):
+                yield_to_others()
+            return FlavorEntry(Template('<h1>Bikes</h1>'), None, None, self.clock() + FLAVOR_DETAILS_CACHE_TTL)
+        self.flavors.fetch = fetch
+
+        templates = run_concurrently([lambda: self.flavors.get('bikes')] * 3)
+        assert_equal(downloads, ['bikes'])
+        assert_equal(len(set(templates)), 1)
+        assert_equal(self.flavors.refreshing, set())
+
+
+class JSTemplateBundleTests (PlanBoxUITestCase):
+    def set_up(self):
+        super(JSTemplateBundleTests, self).set_up()
+        self.static_root = tempfile.mkdtemp()
+        self.use_bundles = jsbundles.USE_JSTEMPLATE_BUNDLES
+        jsbundles.USE_JSTEMPLATE_BUNDLES = True
+
+    def tear_down(self):
+        super(JSTemplateBundleTests, self).tear_down()
+        shutil.rmtree(self.static_root)
+        jsbundles.USE_JSTEMPLATE_BUNDLES = self.use_bundles
+
+    def test_command_writes_hashed_bundles_and_a_manifest(self):
+        call_command('bundle_jstemplates', 'project', 'profiles', static_root=self.static_root, verbosity=0)
+
+        with open(os.path.join(self.static_root, 'jstemplates', 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        assert_equal(sorted(manifest), ['profiles', 'project'])
+
+        path = manifest['project']
+        assert_in('jstemplates/project.', path)
+        with open(os.path.join(self.static_root, path)) as bundle_file:
+            content = bundle_file.read()
+        assert_in('"project-expiration-message-tpl"', content)
+        assert_in('H.registerPartial(name, H.templates[name]);', content)
+        assert_in('element.type = "text/x-handlebars-template";', content)
+
+        # Building again without changes gives the same file.
+        call_command('bundle_jstemplates', 'project', static_root=self.static_root, verbosity=0)
+        assert_equal(jsbundles.read_manifest(self.static_root)['project'], path)
+
+    def test_first_pattern_wins_for_templates_with_the_same_name(self):
+        sources = jsbundles.get_bundle_sources('project-shareabouts')
+        layout_path = os.path.join(os.path.dirname(jsbundles.__file__),
+                                   'jstemplates', 'project-layout-shareabouts', 'project-tpl.html')
+        assert_equal(sources['project-tpl'], jsbundles.read_template_source(layout_path))
+        assert_equal(list(sources).count('project-tpl'), 1)
+
+    def test_tag_refers_to_built_bundles(self):
+        template = Template("{% load jstemplate_bundle from planbox_utils %}{% jstemplate_bundle 'roundup' %}")
+        with override_settings(STATIC_ROOT=self.static_root, STATIC_URL='/static/'):
+            jsbundles.write_bundles(['roundup'])
+            path = jsbundles.read_manifest()['roundup']
+            assert_equal(template.render(Context()), '<script src="/static/%s"></script>' % (path,))
+
+    def test_tag_falls_back_to_inline_templates(self):
+        inline = Template(
+            "{% load handlebarsjs from jstemplate %}"
+            "{% handlebarsjs 'profiles/(.*)' precompile register_partials %}"
+            "{% handlebarsjs 'common/(.*)' precompile register_partials %}").render(Context())
+        template = Template("{% load jstemplate_bundle from planbox_utils %}{% jstemplate_bundle 'profiles' %}")
+
+        # Bundles that haven't been built
+        with override_settings(STATIC_ROOT=self.static_root):
+            assert_equal(template.render(Context()), inline)
+
+        # Bundles that are turned off (e.g., in development)
+        jsbundles.USE_JSTEMPLATE_BUNDLES = False
+        with override_settings(STATIC_ROOT=self.static_root):
+            jsbundles.write_bundles(['profiles'])
+            assert_equal(template.render(Context()), inline)
+
+
+def run_concurrently(funcs):
+    """
+    Run the functions in parallel greenlets (or threads, where gevent isn't
+    installed), and return their results.
+    """
+    if gevent is not None:
+        jobs = [gevent.spawn(func) for func in funcs]
+        gevent.joinall(jobs, raise_error=True)
+        return [job.value for job in jobs]
+
+    import threading
+    results = [None] * len(funcs)
+    def run(index, func):
+        results[index] = func()
+    threads = [threading.Thread(target=run, args=(index, func)) for index, func in enumerate(funcs)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+
+def yield_to_others():
+    if gevent is not None:
+        gevent.sleep(0)
+    else:
+        time.sleep(0.001)
+
+
+class HandlebarsRenderTests (PlanBoxUITestCase):
+    def set_up(self):
+        super(HandlebarsRenderTests, self).set_up()
+        self.template_dir = tempfile.mkdtemp()
+        self.templates = HandlebarsTemplateCache()
+
+    def tear_down(self):
+        super(HandlebarsRenderTests, self).tear_down()
+        shutil.rmtree(self.template_dir)
+
+    def write_template(self, name, source):
+        path = os.path.join(self.template_dir, name + '.html')
+        with open(path, 'w') as template_file:
+            template_file.write(source)
+        return path
+
+    def test_templates_are_compiled_once_per_file_version(self):
+        path = self.write_template('greeting-tpl', 'Hello, {{ name }}')
+        with override_settings(JSTEMPLATE_DIRS=[self.template_dir]):
+            template = self.templates.get('greeting-tpl')
+            assert_equal(self.templates.get('greeting-tpl'), template)
+            assert_equal(self.templates.render('greeting-tpl', {'name': 'Mjumbe'}), 'Hello, Mjumbe')
+
+            self.write_template('greeting-tpl', 'Goodbye, {{ name }}')
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            assert_equal(self.templates.render('greeting-tpl', {'name': 'Mjumbe'}), 'Goodbye, Mjumbe')
+
+    def test_request_helpers_are_not_registered_globally(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        global_helpers = dict(pybars._compiler._pybars_['helpers'])
+
+        kwargs = {'owner_slug': owner.slug, 'project_slug': project.slug}
+        request = self.factory.get(reverse('app-project-page', kwargs=kwargs))
+        request.user = AnonymousUser()
+        project_page_view(request, **kwargs).render()
+
+        assert_equal(pybars._compiler._pybars_['helpers'], global_helpers)
+
+    def test_helpers_do_not_leak_across_concurrent_requests(self):
+        self.write_template('whoami-tpl',
+            '{{#is index expected}}{{ user "username" }} at {{ window_location }}{{else}}wrong user{{/is}}')
+
+        def simulate_user(index):
+            request = self.factory.get('/page-%s' % (index,))
+            user_data = {'username': 'user-%s' % (index,)}
+
+            def user_helper(this, attr):
+                # Give the other users a chance to run in the middle of
+                # rendering.
+                yield_to_others()
+                return user_data.get(attr)
+
+            def window_location_helper(this):
+                return request.get_full_path()
+
+            helpers = {'user': user_helper, 'window_location': window_location_helper}
+            return self.templates.render('whoami-tpl', {'index': index, 'expected': index}, helpers=helpers)
+
+        with override_settings(JSTEMPLATE_DIRS=[self.template_dir]):
+            results = run_concurrently([(lambda index=index: simulate_user(index)) for index in range(50)])
+
+        assert_equal(results, ['user-%s at /page-%s' % (index, index) for index in range(50)])
+
+
+
+class ProjectPrerenderTests (PlanBoxUITestCase):
+    fixtures_dir = os.path.join(os.path.dirname(__file__), 'testdata', 'prerender')
+
+    def read_fixture(self, filename):
+        with open(os.path.join(self.fixtures_dir, filename)) as fixture_file:
+            return fixture_file.read().decode('utf-8')
+
+    def get_page(self, owner, project):
+        kwargs = {'owner_slug': owner.slug, 'project_slug': project.slug}
+        request = self.factory.get(reverse('app-project-page', kwargs=kwargs))
+        request.user = AnonymousUser()
+        return project_page_view(request, **kwargs).render()
+
+    def test_fixture_projects_render_as_the_client_renders_them(self):
+        # The .html fixtures hold the markup that the ProjectView builds for
+        # the projects in the .json fixtures.
+        for name in ('all-sections', 'one-section'):
+            project_data = json.loads(self.read_fixture(name + '.json'))
+            expected = self.read_fixture(name + '.html')
+            assert_equal(prerender.render_project_body(project_data, today=date(2015, 2, 15)), expected)
+
+    def test_raw_sections_with_scripts_are_left_empty(self):
+        project_data = json.loads(self.read_fixture('one-section.json'))
+        project_data['sections'].append({
+            'id': 10, 'slug': 'widget', 'type': 'raw', 'active': True,
+            'label': 'Widget', 'menu_label': '', 'index': 1,
+            'details': {'content': '<div id="widget"></div><script>document.write("hi");</script>'}})
+
+        html = prerender.render_project_body(project_data)
+        assert_in('<section id="section-widget-wrapper" class="project-section-raw"></section>', html)
+        assert_not_in('<script', html)
+
+    def test_projects_that_the_client_cannot_show_are_not_prerendered(self):
+        project_data = json.loads(self.read_fixture('one-section.json'))
+        project_data['layout'] = 'shareabouts'
+        assert_equal(prerender.render_project_body(project_data), None)
+
+        project_data = json.loads(self.read_fixture('one-section.json'))
+        project_data['sections'][0]['type'] = 'carousel'
+        assert_equal(prerender.render_project_body(project_data), None)
+
+    def test_page_includes_the_prerendered_project(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+        project.sections.create(type='text', slug='about', label='About', active=True,
+                                details={'content': '<p>All about the project</p>'})
+
+        content = self.get_page(owner, project).content.decode('utf-8')
+        assert_in('<section id="section-about-wrapper" class="project-section-text">', content)
+        assert_in('<p>All about the project</p>', content)
+
+    def test_prerendered_project_is_cached_until_the_project_changes(self):
+        owner = Profile.objects.create(slug='mjumbewu')
+        project = Project.objects.create(slug='test-slug', title='test title', location='test location', owner=owner, public=True)
+
+        renders = []
+        original_render_project_body = prerender.render_project_body
+        def counting_render_project_body(*args, **kwargs):
+            renders.append(args)
+            return original_render_project_body(*args, **kwargs)
+
+        prerender.render_project_body = counting_render_project_body
+        try:
+            self.get_page(owner, project)
+            self.get_page(owner, project)
+            assert_equal(len(renders), 1)
+
+            Event.objects.create(label='A brand new event', slug='a-brand-new-event', project=project)
+            project.sections.create(type='timeline', slug='timeline', label='Timeline', active=True)
+            content = self.get_page(owner, project).content.decode('utf-8')
+            assert_equal(len(renders), 2)
+        finally:
+            prerender.render_project_body = original_render_project_body
+
+        assert_in('<span id="event-a-brand-new-event" class="event-anchor"></span>', content)
@@ -4,7 +4,7 @@ from django.conf.urls import patterns, url
 from .views import (
     # Static site and metadata views
     index_view, about_view, shareabouts_view, open_source_view, map_flavors_view, help_view,
-    robots_view, sitemap_view, project_flavor_view,
+    robots_view, sitemap_index_view, sitemap_view, project_flavor_view,
 
     # User authentication views
     signup_view, signin_view, password_reset_view, password_change_view,
@@ -39,7 +39,8 @@ urlpatterns = patterns('',
     url(r'^signout/$', 'django.contrib.auth.views.logout', name='app-signout', kwargs={'next_page': '/'}),
     url(r'^help/$', help_view, name='app-help'),
     url(r'^robots.txt$', robots_view, name='app-robots'),
-    url(r'^sitemap.xml$', sitemap_view, name='app-sitemap'),
+    url(r'^sitemap.xml$', sitemap_index_view, name='app-sitemap'),
+    url(r'^sitemap-(?P<shard>\d+).xml$', sitemap_view, name='app-sitemap-shard'),
     url(r'^$', index_view, name='app-index'),
     url(r'^about/$', about_view, name='app-about'),
     url(r'^shareabouts/$', shareabouts_view, name='app-shareabouts'),
@@ -52,6 +53,12 @@ urlpatterns = patterns('',
 
     url(r'^moonclerk/pay-for/(?P<pk>[^/]+)/success$', project_payments_success_view, name='app-project-payments-success'),
 
+    # ==============================
+    # Sitemaps for custom domains that are mapped to a profile or a project
+
+    url(r'^(?P<owner_slug>[^/]+)/(?:(?P<project_slug>[^/]+)/)?sitemap.xml$', sitemap_index_view),
+    url(r'^(?P<owner_slug>[^/]+)/(?:(?P<project_slug>[^/]+)/)?sitemap-(?P<shard>\d+).xml$', sitemap_view),
+
     # ==============================
     # Profiles
 
@@ -4,45 +4,40 @@ import base64
 import hmac
 import hashlib
 import json
-import requests
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User as UserAuth
 from django.contrib.auth.views import redirect_to_login
 from django.core.urlresolvers import reverse
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.shortcuts import resolve_url
-from django.template import Context, Template
+from django.template import Context
 from django.utils.decorators import method_decorator
 from django.utils.http import is_safe_url
-from django.utils.timezone import now
+from django.utils.timezone import get_current_timezone, make_aware, now
 from django.views.generic import TemplateView, FormView, View, DetailView
 from moonclerk.models import Customer, Payment
+from planbox.outbound import http
 from password_reset.views import (
     PasswordResetView as BasePasswordResetView,
     PasswordResetRequestView as BasePasswordResetRequestView,
     PasswordResetInstructionsView as BasePasswordResetInstructionsView,
     PasswordChangeView as BasePasswordChangeView)
+from planbox_data import catalogue, conditional, documents
 from planbox_data.models import Project, Profile, Roundup
-from planbox_data.serializers import (ProjectSerializer, UserSerializer,
-    FullProjectSerializer, RoundupSerializer, ProfileProjectTemplateSerializer,
+from planbox_data.serializers import (UserSerializer, RoundupSerializer,
     TemplateProjectSerializer, ProfileSerializer, ProjectActivitySerializer)
+from planbox_ui import page_cache, prerender, sitemaps
 from planbox_ui.decorators import ssl_required
+from planbox_ui.flavors import flavor_templates
 from planbox_ui.forms import UserCreationForm, AuthenticationForm
-import pybars
 
 import logging
 log = logging.getLogger(__name__)
 
-def register_helper(helper_name):
-    def _register(helper_callback):
-        pybars._compiler._pybars_['helpers'][helper_name] = helper_callback
-        return helper_callback
-    return _register
-
 
 class ReadOnlyMixin (object):
     http_method_names = ['get', 'head', 'options', 'trace']
@@ -90,24 +85,6 @@ class AppMixin (object):
             context['intercom_user_hash'] = hmac.new(settings.INTERCOM_SECRET,
                 user_data['username'], digestmod=hashlib.sha256).hexdigest()
 
-        # Register handlebars helpers
-        @register_helper('user')
-        def user_attr_helper(this, attr):
-            user_data = context.get('user_data', None)
-            if user_data is not None:
-                return user_data.get(attr)
-            else:
-                return None
-
-        @register_helper('window_location')
-        def window_location_helper(this):
-            return self.request.get_full_path()
-
-        @register_helper('is')
-        def is_helper(this, options, a, b):
-            if a == b: return options['fn'](this)
-            else: return options['inverse'](this)
-
         # The current time, because it's useful sometimes
         context['current_time'] = now()
 
@@ -116,16 +93,41 @@ class AppMixin (object):
 
 class AlwaysFresh (object):
     """
-    Disallow client-side caching so that stale data isn't kept (e.g., when the
-    user presses the back button).
+    Make clients check back before reusing a page, so that stale data isn't
+    shown (e.g., when the user presses the back button). Views that can tell
+    whether a page has changed (see get_validators) answer those checks with
+    304 Not Modified; other pages are not stored on the client at all.
     """
-    def get(self, request, *args, **kwargs):
-        response = super(AlwaysFresh, self).get(request, *args, **kwargs)
-        response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    def get_validators(self):
+        """
+        Get the (etag, last_modified) pair for the page, or None if the page
+        can't be validated.
+        """
+        return None
+
+    def make_fresh(self, response):
+        validators = self.get_validators()
+        if validators is not None:
+            conditional.set_validators(response, *validators)
+            response['Cache-Control'] = 'no-cache, must-revalidate'
+        else:
+            response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response['Pragma'] = 'no-cache'
         response['Expires'] = 0
         return response
 
+    def get_not_modified_response(self, request):
+        validators = self.get_validators()
+        if validators is not None and conditional.is_not_modified(request, *validators):
+            return self.make_fresh(HttpResponseNotModified())
+        return None
+
+    def get(self, request, *args, **kwargs):
+        response = self.get_not_modified_response(request)
+        if response is None:
+            response = super(AlwaysFresh, self).get(request, *args, **kwargs)
+        return self.make_fresh(response)
+
 
 class S3UploadMixin (object):
     DEFAULT_S3_UPLOAD_ACL = 'public-read'
@@ -247,14 +249,10 @@ class ProjectFlavorView (AppMixin, TemplateView):
         return context
 
     def get_flavor_details_template(self, slug):
-        flavor_base_url = '%s/%s/' % (settings.PLANBOX_FLAVORS_ROOT_URL.strip('/'), slug)
-        response = requests.get(flavor_base_url + 'details.html')
-        if response.status_code == 200:
-            return Template(response.text)
-        elif response.status_code == 404:
+        template = flavor_templates.get(slug)
+        if template is None:
             raise Http404
-        else:
-            raise Exception('Invalid response while retrieving flavor details: %s %s' % (response.status_code, response.content))
+        return template
 
     def render_flavor_details(self, context_data):
         details_context = Context(context_data)
@@ -370,11 +368,7 @@ class ProfileView (AppMixin, AlwaysFresh, LoginRequired, SSLRequired, S3UploadMi
         context['profile_data'] = serializer.data
 
         # The project templates
-        ### TODO: Cache these
-        templates_slug = settings.TEMPLATES_PROFILE
-        templates = Profile.objects.get(slug=templates_slug)
-        project_templates_serializer = ProfileProjectTemplateSerializer(templates.project_templates.all(), many=True)
-        context['project_templates_data'] = project_templates_serializer.data
+        context['project_templates_data'] = catalogue.get_project_templates_data()
 
         return context
 
@@ -446,8 +440,7 @@ class BaseExistingProjectView (AlwaysFresh, ProjectMixin, TemplateView):
         )
 
     def get_project_serialized_data(self):
-        project_serializer = ProjectSerializer(self.project)
-        return project_serializer.data
+        return documents.get_project_data(self.project)
 
     def get_s3_upload_path(self):
         owner_slug = self.kwargs['owner_slug']
@@ -473,8 +466,7 @@ class ProjectEditorView (SSLRequired, LoginRequired, S3UploadMixin, BaseExisting
     template_name = 'project-admin.html'
 
     def get_project_serialized_data(self):
-        project_serializer = FullProjectSerializer(self.project)
-        return project_serializer.data
+        return documents.get_project_data(self.project, full=True)
 
     def get_project_is_editable(self):
         return self.project.editable_by(self.request.user)
@@ -491,8 +483,8 @@ class ProjectEditorView (SSLRequired, LoginRequired, S3UploadMixin, BaseExisting
         return super(ProjectEditorView, self).get_template_names()
 
     def get(self, request, owner_slug, project_slug):
-        self.project = get_object_or_404(Project.objects.select_related('theme', 'owner'),
-                                         owner__slug=owner_slug, slug__iexact=project_slug)
+        self.project = get_object_or_404(Project.objects.select_related('owner', 'owner__auth', 'theme'),
+            owner__slug=owner_slug, slug__iexact=project_slug)
 
         if not self.get_project_is_editable():
             raise Http404
@@ -543,7 +535,7 @@ class ProjectPaymentsSuccessView (SSLRequired, LoginRequired, AppMixin, DetailVi
                    'Accept': 'application/vnd.moonclerk+json;version=1'}
 
         try:
-            response = requests.get(url, headers=headers, timeout=15)
+            response = http.get(url, headers=headers, timeout=15)
         except:  # Socket timeout, or other such connection errors
             raise Exception('Failed to connect to the MookClerk API')
 
@@ -565,7 +557,7 @@ class ProjectPaymentsSuccessView (SSLRequired, LoginRequired, AppMixin, DetailVi
                    'Accept': 'application/vnd.moonclerk+json;version=1'}
 
         try:
-            response = requests.get(url, headers=headers, timeout=15)
+            response = http.get(url, headers=headers, timeout=15)
         except:  # Socket timeout, or other such connection errors
             raise Exception('Failed to connect to the MookClerk API')
 
@@ -655,9 +647,33 @@ class ProjectPageView (ReadOnlyMixin, BaseExistingProjectView):
     def get_project_is_editable(self):
         return False
 
+    def get_context_data(self, **kwargs):
+        context = super(ProjectPageView, self).get_context_data(**kwargs)
+
+        # The project body, rendered on the server for the first paint (and
+        # for crawlers); the app renders over it when it starts.
+        context['prerendered_project'] = prerender.get_prerendered_project(
+            self.project, context['project_data'])
+
+        return context
+
+    def get_validators(self):
+        # Signed-in users see details of their own on the page, so only pages
+        # for anonymous visitors are validated.
+        if self.request.user.is_authenticated():
+            return None
+        if not hasattr(self, 'validators'):
+            # The pre-rendered timeline marks events past or future by the
+            # date, so the page also changes at the start of each day.
+            today = prerender.get_render_date()
+            etag, last_modified = conditional.get_project_validators(self.project, 'page', today.isoformat())
+            start_of_day = make_aware(datetime.combine(today, datetime.min.time()), get_current_timezone())
+            self.validators = etag, conditional.latest(last_modified, start_of_day)
+        return self.validators
+
     def get(self, request, owner_slug, project_slug):
-        self.project = get_object_or_404(Project.objects.select_related('theme', 'owner'),
-                                         owner__slug=owner_slug, slug__iexact=project_slug)
+        self.project = get_object_or_404(Project.objects.select_related('owner', 'owner__auth', 'theme'),
+            owner__slug=owner_slug, slug__iexact=project_slug)
 
         if not self.is_project_active():
             raise Http404
@@ -665,7 +681,26 @@ class ProjectPageView (ReadOnlyMixin, BaseExistingProjectView):
         if not self.get_project_is_visible():
             raise Http404
 
-        return super(ProjectPageView, self).get(request, pk=self.project.pk)
+        # Before anything else, check whether the visitor already has the
+        # current page.
+        response = self.get_not_modified_response(request)
+        if response is not None:
+            return response
+
+        # Anonymous visitors all see the same page, so serve it from the
+        # page cache when we can.
+        cache_key = None
+        if self.project.public and page_cache.is_cacheable_request(request):
+            cache_key = page_cache.get_page_cache_key(request, self.project)
+            response = page_cache.get_cached_page(cache_key)
+            if response is not None:
+                return response
+
+        response = super(ProjectPageView, self).get(request, pk=self.project.pk)
+
+        if cache_key is not None:
+            page_cache.cache_page_when_rendered(cache_key, response)
+        return response
 
 
 class ProjectDashboardView (SSLRequired, LoginRequired, BaseExistingProjectView):
@@ -685,8 +720,8 @@ class ProjectDashboardView (SSLRequired, LoginRequired, BaseExistingProjectView)
         return super(ProjectDashboardView, self).get_template_names()
 
     def get(self, request, owner_slug, project_slug):
-        self.project = get_object_or_404(Project.objects.select_related('theme', 'owner'),
-                                         owner__slug=owner_slug, slug__iexact=project_slug)
+        self.project = get_object_or_404(Project.objects.select_related('owner', 'owner__auth', 'theme'),
+            owner__slug=owner_slug, slug__iexact=project_slug)
 
         if not self.get_project_is_editable():
             raise Http404
@@ -708,7 +743,7 @@ class NewProjectView (SSLRequired, LoginRequired, S3UploadMixin, ProjectMixin, T
 
     template_name = 'project-admin.html'
 
-    def get_template_project(self):
+    def get_template_project_data(self):
         request = self.request
         if 'template' in request.GET:
             template_string = request.GET['template']
@@ -722,18 +757,13 @@ class NewProjectView (SSLRequired, LoginRequired, S3UploadMixin, ProjectMixin, T
         except ValueError:
             return None
 
-        try:
-            project = Project.objects.get(owner__slug=owner_slug, slug=project_slug)
-            return project
-        except Project.DoesNotExist:
-            return None
+        return catalogue.get_template_project_data(owner_slug, project_slug)
 
     def get_project_serialized_data(self):
-        project = self.get_template_project()
-        if project:
-            project.template = project
-        serializer = TemplateProjectSerializer(project)
-        return serializer.data
+        data = self.get_template_project_data()
+        if data is None:
+            data = TemplateProjectSerializer(None).data
+        return data
 
     def get_project_is_editable(self):
         return True
@@ -767,23 +797,47 @@ class RoundupView (AlwaysFresh, AppMixin, TemplateView):
 
     def get(self, request, owner_slug):
         try:
-            self.roundup = Roundup.objects.filter(owner__slug=owner_slug)[0]
+            self.roundup = Roundup.objects.filter(owner__slug=owner_slug).select_related('owner', 'owner__auth', 'theme')[0]
         except IndexError:
             return redirect('app-profile', profile_slug=owner_slug)
         return super(RoundupView, self).get(request, owner_slug)
 
 
 # SEO
-class SiteMapView (AppMixin, TemplateView):
-    template_name = 'sitemap.xml'
+class SiteMapMixin (object):
+    def get_sitemap(self):
+        return sitemaps.Sitemap(self.kwargs.get('owner_slug'), self.kwargs.get('project_slug'))
 
-    def get_project_queryset(self):
-        return Project.objects.filter(public=True).select_related('owner')
+    def get_root_url(self):
+        scheme = 'https' if self.request.is_secure() else 'http'
+        return '%s://%s' % (scheme, self.request.get_host())
 
-    def get_context_data(self, **kwargs):
-        context = super(SiteMapView, self).get_context_data(**kwargs)
-        context['projects'] = self.get_project_queryset()
-        return context
+    def allow_caching(self, response):
+        response['Cache-Control'] = 'public, max-age=%s' % (sitemaps.SITEMAP_CACHE_TIMEOUT,)
+        return response
+
+
+class SiteMapIndexView (SiteMapMixin, View):
+    def get(self, request, **kwargs):
+        # The shards live alongside the index, whatever path the index was
+        # requested at (custom domains have their own paths).
+        root_url = self.get_root_url()
+        shard_url_format = root_url + request.path[:-len('sitemap.xml')] + 'sitemap-%s.xml'
+        content = sitemaps.get_cached_index(self.get_sitemap(), root_url, request.path, shard_url_format)
+        return self.allow_caching(HttpResponse(content, content_type='text/xml'))
+
+
+class SiteMapView (SiteMapMixin, View):
+    def get(self, request, shard, **kwargs):
+        sitemap = self.get_sitemap()
+        number = int(shard)
+        if number < 1 or number > sitemap.get_shard_count():
+            raise Http404
+
+        mapping = getattr(request, 'domain_mapping', None)
+        fix_url = mapping.fix_url if mapping is not None else None
+        content = sitemap.iter_shard(number, self.get_root_url(), fix_url)
+        return self.allow_caching(StreamingHttpResponse(content, content_type='text/xml'))
 
 
 # App views
@@ -818,4 +872,5 @@ signin_view = SigninView.as_view()
 password_reset_view = PasswordResetView.as_view()
 help_view = HelpView.as_view()
 robots_view = TemplateView.as_view(template_name='robots.txt', content_type='text/plain')
-sitemap_view = SiteMapView.as_view(content_type='text/xml')
+sitemap_index_view = SiteMapIndexView.as_view()
+sitemap_view = SiteMapView.as_view()
@@ -0,0 +1,117 @@
+"""
+An in-process cache of Shareabouts OAuth credentials.
+
+Getting credentials takes three requests to the Shareabouts API (see
+shareabouts_integration.oauth_dance), and the editor and dashboard ask for
+credentials every time they load. Since the credentials for a project only
+depend on the project's Shareabouts username and our client id, each process
+keeps the credentials it gets for a (username, client id) pair until shortly
+before they expire, according to the token's expires_in.
+
+When the credentials are due to be refreshed, only one greenlet (or thread)
+per pair does the OAuth dance; while it does, the others keep getting the old
+credentials, which are still valid. Only when there are no valid credentials
+at all do callers wait for the refresh.
+
+The dances go through the shared outbound HTTP client, so they reuse its
+kept-alive connections to the API. Each dance still gets its own session,
+since the API tracks the dance with a cookie.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import requests
+import threading
+import time
+from django.conf import settings
+from planbox.outbound import http
+from shareabouts_integration.oauth_dance import get_auth_header, get_authorization_code, get_credentials
+
+log = logging.getLogger(__name__)
+
+
+# Seconds before the credentials expire at which to get new ones
+CREDENTIALS_REFRESH_MARGIN = getattr(settings, 'SHAREABOUTS_CREDENTIALS_REFRESH_MARGIN', 5 * 60)
+
+
+class CredentialCache (object):
+    def __init__(self, refresh_margin=None, clock=time.time):
+        self.refresh_margin = (refresh_margin if refresh_margin is not None else
+                               CREDENTIALS_REFRESH_MARGIN)
+        self.clock = clock
+        self.locks_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # Each entry is a (credentials, refresh_at, expires_at) tuple.
+        self.entries = {}
+        self.locks = {}
+
+    def get_lock(self, key):
+        with self.locks_lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def fetch(self, host, client_id, client_secret, username):
+        """
+        Do the OAuth dance, and return a new cache entry.
+        """
+        session = http.session()
+        auth_header = get_auth_header(client_id, client_secret, username)
+        authorization_code = get_authorization_code(session, host, client_id, auth_header)
+        credentials = get_credentials(session, host, authorization_code, client_id, client_secret)
+
+        fetched_at = self.clock()
+        lifetime = float(credentials.get('expires_in') or 0)
+        refresh_at = fetched_at + max(lifetime - self.refresh_margin, lifetime / 2)
+        return (credentials, refresh_at, fetched_at + lifetime)
+
+    def get_fresh_credentials(self, entry):
+        # Report how long the credentials have left, rather than how long they
+        # had when we got them.
+        credentials, _, expires_at = entry
+        if 'expires_in' not in credentials:
+            return credentials
+        return dict(credentials, expires_in=max(0, int(expires_at - self.clock())))
+
+    def get(self, host, client_id, client_secret, username):
+        """
+        Get OAuth credentials for the given Shareabouts user. Raises an
+        AssertionError (from oauth_dance) if the API refuses to give any.
+        """
+        key = (host, client_id, username)
+        entry = self.entries.get(key)
+        if entry is not None and self.clock() < entry[1]:
+            return self.get_fresh_credentials(entry)
+
+        lock = self.get_lock(key)
+        valid = entry is not None and self.clock() < entry[2]
+        if valid:
+            # Someone else is already refreshing; use the old credentials.
+            if not lock.acquire(False):
+                return self.get_fresh_credentials(entry)
+        else:
+            lock.acquire()
+
+        try:
+            # Another caller may have refreshed the credentials while we
+            # waited for the lock.
+            entry = self.entries.get(key)
+            if entry is not None and self.clock() < entry[1]:
+                return self.get_fresh_credentials(entry)
+
+            try:
+                entry = self.fetch(host, client_id, client_secret, username)
+            except (AssertionError, requests.RequestException):
+                if not valid:
+                    raise
+                log.exception('Could not refresh Shareabouts credentials for %s; using the current ones.', username)
+                return self.get_fresh_credentials(entry)
+
+            self.entries[key] = entry
+            return self.get_fresh_credentials(entry)
+        finally:
+            lock.release()
+
+
+credential_cache = CredentialCache()
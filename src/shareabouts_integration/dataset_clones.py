@@ -0,0 +1,201 @@
+"""
+Cloning of Shareabouts datasets, off of the request path.
+
+When a project with a Shareabouts section is cloned, the section's dataset
+has to be cloned as well, through the Shareabouts API. Rather than waiting on
+the API while the project is cloned, the cloned section is saved without a
+dataset_url, and with a dataset_status of "pending" in its details, and a
+DatasetCloneJob is queued for it. A worker (the run_dataset_clone_jobs
+management command) then asks Shareabouts for the clone, and records the new
+dataset's URL on the job and patches it into the section's details. The
+editor can poll the job's status (and get the URL from the job) through the
+dataset-clone-status view.
+
+Project saves keep the dataset keys of a section whose incoming details
+leave them out (see SectionSerializer), but an editor that saves stale
+details can still drop the URL; the status view puts it back from the job.
+
+A job that fails is retried, with an exponentially growing delay, until it
+has been attempted DATASET_CLONE_MAX_ATTEMPTS times, after which the section
+is marked with a dataset_status of "failed".
+
+Jobs are claimed by setting their status to "running" with a conditional
+UPDATE, so several workers can run at once. A claim only lasts for
+DATASET_CLONE_LEASE seconds; if a worker dies while running a job, the job
+is picked up again once its lease runs out.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import requests
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import six
+from django.utils.timezone import now
+from planbox.outbound import http
+from planbox_data.models import Section
+from shareabouts_integration.models import DatasetCloneJob
+
+log = logging.getLogger(__name__)
+
+
+# Seconds to wait on the Shareabouts API before giving up on an attempt
+DATASET_CLONE_TIMEOUT = getattr(settings, 'SHAREABOUTS_DATASET_CLONE_TIMEOUT', 10)
+# How many times to try a clone before marking it as failed
+DATASET_CLONE_MAX_ATTEMPTS = getattr(settings, 'SHAREABOUTS_DATASET_CLONE_MAX_ATTEMPTS', 5)
+# Seconds to wait before the first retry; each retry waits twice as long
+DATASET_CLONE_RETRY_DELAY = getattr(settings, 'SHAREABOUTS_DATASET_CLONE_RETRY_DELAY', 30)
+# Seconds after which a job claimed by a worker may be claimed again
+DATASET_CLONE_LEASE = getattr(settings, 'SHAREABOUTS_DATASET_CLONE_LEASE', 5 * 60)
+
+
+class DatasetCloneError (Exception):
+    pass
+
+
+def get_dataset_list_url(dataset_url):
+    last_slash = dataset_url.rstrip('/').rfind('/')
+    return dataset_url[:last_slash]
+
+
+def request_dataset_clone(dataset_url, timeout=None):
+    """
+    Ask the Shareabouts API for a clone of the dataset at the given URL, and
+    return the URL of the new dataset.
+    """
+    dataset_list_url = get_dataset_list_url(dataset_url)
+    try:
+        response = http.post(dataset_list_url,
+            headers={'X-Shareabouts-Clone': dataset_url},
+            auth=(settings.SHAREABOUTS_USERNAME, settings.SHAREABOUTS_PASSWORD),
+            timeout=timeout or DATASET_CLONE_TIMEOUT)
+    except requests.RequestException as e:
+        raise DatasetCloneError('Could not reach %s: %s' % (dataset_list_url, e))
+
+    if response.status_code not in (201, 202):
+        raise DatasetCloneError('Invalid response from %s: (%s) %s' % (dataset_list_url, response.status_code, response.text))
+
+    try:
+        return response.json()['url']
+    except (ValueError, KeyError, TypeError):
+        raise DatasetCloneError('Invalid response from %s: %s' % (dataset_list_url, response.text))
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=DATASET_CLONE_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def get_due_jobs(limit=None):
+    jobs = DatasetCloneJob.objects\
+        .filter(status__in=[DatasetCloneJob.PENDING, DatasetCloneJob.RUNNING], run_after__lte=now())\
+        .order_by('run_after')
+    return jobs[:limit] if limit else jobs
+
+
+def claim_job(job):
+    """
+    Mark the job as running, unless another worker has claimed it since we
+    read it. Return whether the job was claimed.
+    """
+    current_time = now()
+    lease_end = current_time + timedelta(seconds=DATASET_CLONE_LEASE)
+    claimed = DatasetCloneJob.objects\
+        .filter(pk=job.pk, status=job.status, run_after=job.run_after)\
+        .update(status=DatasetCloneJob.RUNNING, run_after=lease_end, updated_at=current_time)
+    if claimed:
+        job.status, job.run_after, job.updated_at = DatasetCloneJob.RUNNING, lease_end, current_time
+    return bool(claimed)
+
+
+def update_section_details(section_id, **details):
+    """
+    Set the given keys in a section's details, leaving the rest of its
+    details (which may have been edited since the section was cloned) alone.
+    Keys set to None are removed.
+    """
+    with transaction.atomic():
+        try:
+            section = Section.objects.select_for_update().get(pk=section_id)
+        except Section.DoesNotExist:
+            return
+        for key, value in details.items():
+            if value is None:
+                section.details.pop(key, None)
+            else:
+                section.details[key] = value
+        section.save(update_fields=['details', 'updated_at'])
+
+
+def record_failure(job, error):
+    job.last_error = six.text_type(error)
+    if job.attempts >= DATASET_CLONE_MAX_ATTEMPTS:
+        job.status = DatasetCloneJob.FAILED
+        update_section_details(job.section_id, dataset_status=DatasetCloneJob.FAILED)
+    else:
+        job.status = DatasetCloneJob.PENDING
+        job.run_after = now() + get_retry_delay(job.attempts)
+    job.updated_at = now()
+    job.save()
+
+
+def run_job(job, timeout=None):
+    """
+    Attempt a claimed job, and record the outcome on the job and its section.
+    Return whether the dataset was cloned.
+    """
+    # Count the attempt before making it, so that a job whose attempts keep
+    # dying (along with their workers) still runs out of attempts.
+    job.attempts += 1
+    job.save(update_fields=['attempts'])
+
+    try:
+        dataset_url = request_dataset_clone(job.source_dataset_url, timeout=timeout)
+    except DatasetCloneError as e:
+        log.warning('Attempt %s to clone dataset %s for section %s failed: %s',
+                    job.attempts, job.source_dataset_url, job.section_id, e)
+        record_failure(job, e)
+        return False
+    except Exception as e:
+        log.exception('Attempt %s to clone dataset %s for section %s failed',
+                      job.attempts, job.source_dataset_url, job.section_id)
+        record_failure(job, e)
+        return False
+
+    # The URL is kept on the job too, since the section's details may be
+    # overwritten by an editor that hasn't seen it yet (see
+    # restore_dataset_url).
+    with transaction.atomic():
+        update_section_details(job.section_id, dataset_url=dataset_url, dataset_status=None)
+        job.status = DatasetCloneJob.DONE
+        job.dataset_url = dataset_url
+        job.last_error = ''
+        job.updated_at = now()
+        job.save()
+    return True
+
+
+def restore_dataset_url(job):
+    """
+    Put the URL of a done job's dataset back into its section's details, if
+    it has gone missing.
+    """
+    if job.status != DatasetCloneJob.DONE or not job.dataset_url:
+        return
+    section = Section.objects.filter(pk=job.section_id).first()
+    if section is not None and not section.details.get('dataset_url'):
+        update_section_details(job.section_id, dataset_url=job.dataset_url, dataset_status=None)
+
+
+def run_due_jobs(limit=None, timeout=None):
+    """
+    Run each job that is due, and that no other worker has claimed. Return
+    the number of jobs run.
+    """
+    count = 0
+    for job in get_due_jobs(limit):
+        if claim_job(job):
+            run_job(job, timeout=timeout)
+            count += 1
+    return count
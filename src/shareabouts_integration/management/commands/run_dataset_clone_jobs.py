@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from shareabouts_integration.dataset_clones import run_due_jobs
+
+
+class Command (NoArgsCommand):
+    help = 'Run the queued Shareabouts dataset clones that are due.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='Run the jobs that are due and exit, instead of polling for new jobs.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+            help='Seconds to wait between polls when there are no jobs due.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=20,
+            help='The most jobs to claim per poll.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        while True:
+            count = run_due_jobs(limit=options['batch_size'])
+            if count and verbosity > 1:
+                self.stdout.write('Ran %s dataset clone job(s)' % (count,))
+
+            if options['once']:
+                if count == options['batch_size']:
+                    continue
+                break
+            if count < options['batch_size']:
+                time.sleep(options['interval'])
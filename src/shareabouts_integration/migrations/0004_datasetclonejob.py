@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planbox_data', '0016_add_details_to_events'),
+        ('shareabouts_integration', '0003_add_default_preauthorizations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetCloneJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('source_dataset_url', models.TextField(help_text='The URL of the dataset to clone')),
+                ('status', models.CharField(default=b'pending', max_length=10, choices=[(b'pending', 'Pending'), (b'running', 'Running'), (b'done', 'Done'), (b'failed', 'Failed')])),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='The job will not be run (or retried) before this time')),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('section', models.ForeignKey(related_name='dataset_clone_jobs', to='planbox_data.Section')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='datasetclonejob',
+            index_together=set([('status', 'run_after')]),
+        ),
+    ]
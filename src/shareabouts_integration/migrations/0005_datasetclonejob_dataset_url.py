@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareabouts_integration', '0004_datasetclonejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetclonejob',
+            name='dataset_url',
+            field=models.TextField(help_text='The URL of the cloned dataset, once the job is done', blank=True),
+            preserve_default=True,
+        ),
+    ]
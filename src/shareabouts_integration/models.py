@@ -1,9 +1,9 @@
-import requests
-from django.conf import settings
 from django.db import models
+from django.utils.timezone import now
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext as _
-from planbox_data.models import clone_pre_save, Section, CloneableModelMixin
+from planbox_data.models import (clone_pre_save_batch, clone_post_save_batch,
+    Project, Section, CloneableModelMixin)
 
 
 @python_2_unicode_compatible
@@ -15,24 +15,72 @@ class Preauthorization (CloneableModelMixin, models.Model):
         return self.username
 
 
-def clone_section_dataset(sender, orig_inst, new_inst, *args, **kwargs):
-    if orig_inst.type == 'shareabouts' and 'dataset_url' in orig_inst.details:
-        username = settings.SHAREABOUTS_USERNAME
-        password = settings.SHAREABOUTS_PASSWORD
+@python_2_unicode_compatible
+class DatasetCloneJob (models.Model):
+    """
+    A request to clone the Shareabouts dataset of a section into a new
+    dataset for the section's clone. Jobs are run by the
+    run_dataset_clone_jobs management command (see
+    shareabouts_integration.dataset_clones).
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    section = models.ForeignKey('planbox_data.Section', related_name='dataset_clone_jobs')
+    source_dataset_url = models.TextField(help_text=_('The URL of the dataset to clone'))
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=now, help_text=_('The job will not be run (or retried) before this time'))
+    last_error = models.TextField(blank=True)
+    dataset_url = models.TextField(blank=True, help_text=_('The URL of the cloned dataset, once the job is done'))
+    created_at = models.DateTimeField(default=now)
+    updated_at = models.DateTimeField(default=now)
+
+    class Meta:
+        index_together = [('status', 'run_after')]
+
+    def __str__(self):
+        return 'Clone of %s (%s)' % (self.source_dataset_url, self.status)
+
+
+def is_cloned_dataset_section(section):
+    return section.type == 'shareabouts' and 'dataset_url' in section.details
+
+
+def defer_section_datasets(sender, pairs, *args, **kwargs):
+    """
+    Mark the clones of Shareabouts sections as waiting for their datasets.
+    The datasets are cloned later, by a worker, so that cloning a project does
+    not wait on the Shareabouts API.
+    """
+    for orig_inst, new_inst in pairs:
+        if is_cloned_dataset_section(orig_inst):
+            details = dict(orig_inst.details)
+            del details['dataset_url']
+            details['dataset_status'] = DatasetCloneJob.PENDING
+            new_inst.details = details
+clone_pre_save_batch.connect(defer_section_datasets, sender=Section, dispatch_uid="shareabouts-section-clone-dataset-signal")
+
 
-        # Get the dataset list URL
-        orig_dataset_url = orig_inst.details['dataset_url']
-        last_slash = orig_dataset_url.rfind('/')
-        dataset_list_url = orig_dataset_url[:last_slash]
+def queue_section_dataset_clones(sender, pairs, *args, **kwargs):
+    DatasetCloneJob.objects.bulk_create([
+        DatasetCloneJob(section_id=new_inst.pk, source_dataset_url=orig_inst.details['dataset_url'])
+        for orig_inst, new_inst in pairs if is_cloned_dataset_section(orig_inst)])
+clone_post_save_batch.connect(queue_section_dataset_clones, sender=Section, dispatch_uid="shareabouts-section-queue-dataset-clone-signal")
 
-        # Send a request to clone the dataset
-        response = requests.post(dataset_list_url,
-            headers={'X-Shareabouts-Clone': orig_dataset_url},
-            auth=(username, password))
 
-        # Use the new dataset URL in the cloned section
-        if response.status_code in (201, 202):
-            new_inst.details['dataset_url'] = response.json()['url']
-        else:
-            raise Exception('Invalid response from %s: (%s) %s' % (dataset_list_url, response.status_code, response.text))
-clone_pre_save.connect(clone_section_dataset, sender=Section, dispatch_uid="shareabouts-section-clone-dataset-signal")
+def clone_project_preauthorizations(sender, pairs, *args, **kwargs):
+    new_projects = dict((orig_inst.pk, new_inst) for orig_inst, new_inst in pairs)
+    preauthorizations = Preauthorization.objects.filter(project__in=list(new_projects))
+    Preauthorization.objects.bulk_create([
+        preauthorization.make_clone(overrides={'project': new_projects[preauthorization.project_id]})
+        for preauthorization in preauthorizations])
+clone_post_save_batch.connect(clone_project_preauthorizations, sender=Project, dispatch_uid="shareabouts-project-clone-preauthorization-signal")
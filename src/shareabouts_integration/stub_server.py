@@ -0,0 +1,193 @@
+"""
+A stand-in for the parts of the Shareabouts API that Planbox calls from the
+server, for tests and local development.
+
+It answers dataset clone requests (a POST to a dataset list URL with an
+X-Shareabouts-Clone header) with the URL of a new dataset, and goes through
+the OAuth dance in shareabouts_integration.oauth_dance. It can be told to
+fail, or to be slow, for a number of requests to exercise retries and
+timeouts. To run it on its own, e.g. alongside the run_dataset_clone_jobs
+worker:
+
+    python -m shareabouts_integration.stub_server [--port 8001]
+
+and point the dataset URLs of your template sections at
+http://localhost:8001/api/v2/<owner>/datasets/<slug>.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import re
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+
+
+class NullStream (object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+class QuietHandler (WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def get_stderr(self):
+        # Errors still reach the client as 500s; don't print them too, since
+        # clients that time out cause one each.
+        return NullStream()
+
+
+class QuietServer (WSGIServer):
+    def handle_error(self, request, client_address):
+        pass
+
+
+class StubShareaboutsAPI (object):
+    """
+    A WSGI app that clones datasets and hands out OAuth tokens.
+
+    Attributes:
+
+    requests -- The (method, path, headers) of each request received.
+    failures -- The number of upcoming requests to answer with a 503.
+    failure_message -- The error message in the body of those 503s.
+    delay -- Seconds to wait before answering each request.
+    token_lifetime -- The expires_in of the OAuth tokens handed out.
+
+    """
+    dataset_list_pattern = re.compile(r'^/api/v2/(?P<owner>[^/]+)/datasets/?$')
+    oauth_prefix = '/api/v2/users/oauth2/'
+
+    def __init__(self):
+        self.requests = []
+        self.failures = 0
+        self.failure_message = 'Unavailable'
+        self.delay = 0
+        self.token_lifetime = 3600
+        self.tokens_issued = 0
+        self.url = None
+        self.lock = threading.Lock()
+
+    def count_requests(self, path):
+        return len([request for request in self.requests if request[1] == path])
+
+    def __call__(self, environ, start_response):
+        headers = dict((key[5:].replace('_', '-').title(), value)
+                       for key, value in environ.items() if key.startswith('HTTP_'))
+        with self.lock:
+            self.requests.append((environ['REQUEST_METHOD'], environ['PATH_INFO'], headers))
+            failing = self.failures > 0
+            if failing:
+                self.failures -= 1
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        if failing:
+            return self.respond(start_response, '503 Service Unavailable', {'errors': self.failure_message})
+
+        if environ['PATH_INFO'].startswith(self.oauth_prefix):
+            return self.oauth(environ, start_response, headers)
+
+        match = self.dataset_list_pattern.match(environ['PATH_INFO'])
+        if environ['REQUEST_METHOD'] != 'POST' or not match:
+            return self.respond(start_response, '404 Not Found', {'errors': 'Not found'})
+        if 'Authorization' not in headers:
+            return self.respond(start_response, '401 Unauthorized', {'errors': 'Not authorized'})
+        if 'X-Shareabouts-Clone' not in headers:
+            return self.respond(start_response, '400 Bad Request', {'errors': 'Only clones are supported'})
+
+        source_slug = headers['X-Shareabouts-Clone'].rstrip('/').rsplit('/', 1)[-1]
+        dataset_url = '%s/api/v2/%s/datasets/%s-%s' % (
+            self.url, match.group('owner'), source_slug, len(self.requests))
+        return self.respond(start_response, '201 Created', {'url': dataset_url})
+
+    def oauth(self, environ, start_response, headers):
+        step = environ['PATH_INFO'][len(self.oauth_prefix):]
+
+        if step == 'authorize':
+            if not headers.get('Authorization', '').startswith('Remote '):
+                return self.respond(start_response, '401 Unauthorized', {'errors': 'Not authorized'})
+            return self.respond(start_response, '200 OK', {},
+                [('Set-Cookie', 'sessionid=stub; Path=/')])
+
+        if step == 'authorize/confirm':
+            if 'sessionid=stub' not in headers.get('Cookie', ''):
+                return self.respond(start_response, '403 Forbidden', {'errors': 'No session'})
+            return self.respond(start_response, '302 Found', {},
+                [('Location', self.url + self.oauth_prefix + 'callback?code=stub-code')])
+
+        if step == 'callback':
+            return self.respond(start_response, '200 OK', {})
+
+        if step == 'access_token':
+            with self.lock:
+                self.tokens_issued += 1
+                token = 'stub-token-%s' % (self.tokens_issued,)
+            return self.respond(start_response, '200 OK', {
+                'access_token': token,
+                'token_type': 'Bearer',
+                'expires_in': self.token_lifetime,
+                'scope': 'read',
+            })
+
+        return self.respond(start_response, '404 Not Found', {'errors': 'Not found'})
+
+    def respond(self, start_response, status, data, extra_headers=()):
+        # wsgiref wants native strings for the status and headers.
+        headers = [('Content-Type', 'application/json; charset=utf-8')] + list(extra_headers)
+        start_response(str(status), [(str(name), str(value)) for name, value in headers])
+        return [json.dumps(data, ensure_ascii=False).encode('utf-8')]
+
+
+class StubShareaboutsServer (object):
+    """
+    Serve a StubShareaboutsAPI from a background thread, e.g.:
+
+        with StubShareaboutsServer() as server:
+            section.details['dataset_url'] = server.url + '/api/v2/owner/datasets/places'
+            ...
+            assert len(server.api.requests) == 1
+
+    The server listens on a free port unless one is given.
+    """
+    def __init__(self, host='localhost', port=0):
+        self.api = StubShareaboutsAPI()
+        self.httpd = make_server(host, port, self.api,
+            server_class=QuietServer, handler_class=QuietHandler)
+        self.url = self.api.url = 'http://%s:%s' % (host, self.httpd.server_port)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a stub Shareabouts API server.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+
+    server = StubShareaboutsServer(args.host, args.port)
+    print('Serving a stub Shareabouts API at %s' % (server.url,))
+    server.httpd.serve_forever()
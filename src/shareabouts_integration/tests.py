@@ -0,0 +1,336 @@
+from __future__ import unicode_literals
+
+import json
+import requests
+import threading
+from datetime import timedelta
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.timezone import now
+from nose.tools import assert_equal, assert_in, assert_not_in, ok_
+from planbox.outbound import http
+
+from django.contrib.auth.models import User as UserAuth
+from planbox_data.cache import get_project_version
+from planbox_data.models import Profile, Project, Section
+from shareabouts_integration import dataset_clones
+from shareabouts_integration.credentials import CredentialCache
+from shareabouts_integration.models import DatasetCloneJob
+from shareabouts_integration.stub_server import StubShareaboutsServer
+
+
+class DatasetCloneTests (TestCase):
+    def setUp(self):
+        http.reset()
+        self.server = StubShareaboutsServer().start()
+        self.dataset_url = self.server.url + '/api/v2/planbox/datasets/template-places'
+
+        owner = Profile.objects.create(slug='shareabouts-templates')
+        self.template = Project.objects.create(slug='template', title='Template', location='Anywhere', owner=owner)
+        Section.objects.create(project=self.template, type='shareabouts', slug='map',
+                               details={'dataset_url': self.dataset_url, 'zoom': 12})
+        Section.objects.create(project=self.template, type='text', slug='intro')
+
+        self.user = UserAuth.objects.create_user(username='mjumbewu', password='123')
+        self.profile = self.user.profile
+
+    def tearDown(self):
+        self.server.stop()
+
+    def clone_template(self):
+        project = self.template.clone(overrides={'owner': self.profile})
+        return project.sections.get(type='shareabouts')
+
+    def run_due_jobs(self, **kwargs):
+        # Make any jobs waiting for a retry due now.
+        DatasetCloneJob.objects.filter(status=DatasetCloneJob.PENDING).update(run_after=now())
+        return dataset_clones.run_due_jobs(**kwargs)
+
+    def test_cloning_a_project_does_not_wait_for_shareabouts(self):
+        section = self.clone_template()
+
+        assert_equal(self.server.api.requests, [])
+        assert_not_in('dataset_url', section.details)
+        assert_equal(section.details['dataset_status'], 'pending')
+        assert_equal(section.details['zoom'], 12)
+
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.section, section)
+        assert_equal(job.source_dataset_url, self.dataset_url)
+
+        # The template keeps its dataset
+        template_section = self.template.sections.get(type='shareabouts')
+        assert_equal(template_section.details['dataset_url'], self.dataset_url)
+
+    def test_worker_sets_the_cloned_dataset_url(self):
+        section = self.clone_template()
+        version = get_project_version(section.project_id)
+
+        assert_equal(self.run_due_jobs(), 1)
+
+        (method, path, headers), = self.server.api.requests
+        assert_equal(method, 'POST')
+        assert_equal(path, '/api/v2/planbox/datasets')
+        assert_equal(headers['X-Shareabouts-Clone'], self.dataset_url)
+
+        section = Section.objects.get(pk=section.pk)
+        assert_equal(section.details['dataset_url'], self.server.url + '/api/v2/planbox/datasets/template-places-1')
+        assert_not_in('dataset_status', section.details)
+        assert_equal(section.details['zoom'], 12)
+        assert_equal(DatasetCloneJob.objects.get().status, DatasetCloneJob.DONE)
+        ok_(get_project_version(section.project_id) != version)
+
+        # Done jobs are not run again
+        assert_equal(self.run_due_jobs(), 0)
+
+    def test_failed_clones_are_retried_later(self):
+        section = self.clone_template()
+        self.server.api.failures = 1
+
+        assert_equal(dataset_clones.run_due_jobs(), 1)
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.status, DatasetCloneJob.PENDING)
+        assert_equal(job.attempts, 1)
+        assert_in('503', job.last_error)
+        ok_(job.run_after > now())
+
+        # Not due yet
+        assert_equal(dataset_clones.run_due_jobs(), 0)
+
+        assert_equal(self.run_due_jobs(), 1)
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.status, DatasetCloneJob.DONE)
+        assert_equal(job.attempts, 2)
+        assert_in('dataset_url', Section.objects.get(pk=section.pk).details)
+
+    def test_clones_fail_after_max_attempts(self):
+        section = self.clone_template()
+        self.server.api.failures = dataset_clones.DATASET_CLONE_MAX_ATTEMPTS
+
+        for _ in range(dataset_clones.DATASET_CLONE_MAX_ATTEMPTS):
+            assert_equal(self.run_due_jobs(), 1)
+        assert_equal(self.run_due_jobs(), 0)
+
+        assert_equal(DatasetCloneJob.objects.get().status, DatasetCloneJob.FAILED)
+        section = Section.objects.get(pk=section.pk)
+        assert_equal(section.details['dataset_status'], 'failed')
+        assert_not_in('dataset_url', section.details)
+
+    def test_non_ascii_errors_are_recorded(self):
+        self.clone_template()
+        self.server.api.failures = 1
+        self.server.api.failure_message = 'Indisponible \u2014 r\xe9essayez plus tard'
+
+        assert_equal(dataset_clones.run_due_jobs(), 1)
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.status, DatasetCloneJob.PENDING)
+        assert_equal(job.attempts, 1)
+        assert_in('r\xe9essayez', job.last_error)
+
+    def test_unexpected_errors_count_as_failed_attempts(self):
+        self.clone_template()
+        original_request_dataset_clone = dataset_clones.request_dataset_clone
+        def broken_request_dataset_clone(*args, **kwargs):
+            raise requests.TooManyRedirects('Exceeded 30 redirects.')
+
+        dataset_clones.request_dataset_clone = broken_request_dataset_clone
+        try:
+            assert_equal(dataset_clones.run_due_jobs(), 1)
+        finally:
+            dataset_clones.request_dataset_clone = original_request_dataset_clone
+
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.status, DatasetCloneJob.PENDING)
+        assert_equal(job.attempts, 1)
+        assert_in('redirects', job.last_error)
+
+    def test_stale_editor_saves_keep_the_cloned_dataset_url(self):
+        section = self.clone_template()
+        self.client.login(username='mjumbewu', password='123')
+        project_url = reverse('project-detail', kwargs={'pk': section.project_id})
+        document = json.loads(self.client.get(project_url).content.decode('utf-8'))
+
+        # The worker finishes while the editor is open...
+        self.run_due_jobs()
+        dataset_url = DatasetCloneJob.objects.get().dataset_url
+        ok_(dataset_url)
+
+        # ...and then the editor saves the details it loaded.
+        response = self.client.put(project_url, data=json.dumps(document), content_type='application/json')
+        assert_equal(response.status_code, 200)
+        details = Section.objects.get(pk=section.pk).details
+        assert_equal(details['dataset_url'], dataset_url)
+        assert_not_in('dataset_status', details)
+
+    def test_status_view_restores_a_lost_dataset_url(self):
+        section = self.clone_template()
+        self.run_due_jobs()
+        dataset_url = DatasetCloneJob.objects.get().dataset_url
+        Section.objects.filter(pk=section.pk).update(details={'zoom': 12})
+
+        self.client.login(username='mjumbewu', password='123')
+        response = self.client.get('/shareabouts/dataset-clone-status?section_id=%s' % (section.pk,))
+        data = json.loads(response.content.decode('utf-8'))
+        assert_equal(data['status'], 'done')
+        assert_equal(data['dataset_url'], dataset_url)
+        assert_equal(Section.objects.get(pk=section.pk).details['dataset_url'], dataset_url)
+
+    def test_slow_responses_time_out(self):
+        self.clone_template()
+        self.server.api.failures = 0
+        self.server.api.delay = 0.5
+
+        assert_equal(dataset_clones.run_due_jobs(timeout=0.1), 1)
+        job = DatasetCloneJob.objects.get()
+        assert_equal(job.status, DatasetCloneJob.PENDING)
+        assert_in('Could not reach', job.last_error)
+
+    def test_jobs_claimed_by_another_worker_are_skipped(self):
+        self.clone_template()
+        job = DatasetCloneJob.objects.get()
+        ok_(dataset_clones.claim_job(job))
+
+        assert_equal(dataset_clones.run_due_jobs(), 0)
+        assert_equal(self.server.api.requests, [])
+
+        # ...until the claim expires
+        DatasetCloneJob.objects.update(run_after=now() - timedelta(seconds=1))
+        assert_equal(dataset_clones.run_due_jobs(), 1)
+        assert_equal(DatasetCloneJob.objects.get().status, DatasetCloneJob.DONE)
+
+    def test_status_view(self):
+        section = self.clone_template()
+        url = '/shareabouts/dataset-clone-status?section_id=%s' % (section.pk,)
+
+        response = self.client.get(url)
+        assert_equal(response.status_code, 302)
+
+        self.client.login(username='mjumbewu', password='123')
+        response = self.client.get(url)
+        assert_equal(response.status_code, 200)
+        assert_equal(json.loads(response.content.decode('utf-8')),
+                     {'status': 'pending', 'attempts': 0, 'dataset_url': None})
+
+        self.run_due_jobs()
+        response = self.client.get(url)
+        data = json.loads(response.content.decode('utf-8'))
+        assert_equal(data['status'], 'done')
+        assert_equal(data['dataset_url'], Section.objects.get(pk=section.pk).details['dataset_url'])
+
+        # Only editors of the project may see the status
+        template_section = self.template.sections.get(type='shareabouts')
+        response = self.client.get('/shareabouts/dataset-clone-status?section_id=%s' % (template_section.pk,))
+        assert_equal(response.status_code, 401)
+
+
+class FakeClock (object):
+    def __init__(self):
+        self.time = 1000000.0
+
+    def __call__(self):
+        return self.time
+
+
+class CredentialCacheTests (TestCase):
+    def setUp(self):
+        http.reset()
+        self.server = StubShareaboutsServer().start()
+        self.clock = FakeClock()
+        self.cache = CredentialCache(refresh_margin=60, clock=self.clock)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_credentials(self, username='planbox'):
+        return self.cache.get(self.server.url, 'client', 'secret', username)
+
+    def count_token_requests(self):
+        return self.server.api.count_requests('/api/v2/users/oauth2/access_token')
+
+    def count_authorize_requests(self):
+        return self.server.api.count_requests('/api/v2/users/oauth2/authorize')
+
+    def test_credentials_are_reused_until_they_are_due_for_refresh(self):
+        credentials = self.get_credentials()
+        assert_equal(credentials['access_token'], 'stub-token-1')
+        assert_equal(credentials['expires_in'], 3600)
+        assert_equal(self.count_authorize_requests(), 1)
+        assert_equal(self.count_token_requests(), 1)
+
+        self.clock.time += 1000
+        credentials = self.get_credentials()
+        assert_equal(credentials['access_token'], 'stub-token-1')
+        assert_equal(credentials['expires_in'], 2600)
+        assert_equal(self.count_authorize_requests(), 1)
+        assert_equal(self.count_token_requests(), 1)
+
+        # Within the refresh margin
+        self.clock.time += 2550
+        credentials = self.get_credentials()
+        assert_equal(credentials['access_token'], 'stub-token-2')
+        assert_equal(credentials['expires_in'], 3600)
+        assert_equal(self.count_token_requests(), 2)
+
+    def test_credentials_are_cached_per_user(self):
+        self.get_credentials('planbox')
+        self.get_credentials('other')
+        self.get_credentials('planbox')
+        self.get_credentials('other')
+        assert_equal(self.count_token_requests(), 2)
+
+    def test_short_lived_credentials_are_refreshed_halfway(self):
+        self.server.api.token_lifetime = 60
+
+        self.get_credentials()
+        self.clock.time += 29
+        self.get_credentials()
+        assert_equal(self.count_token_requests(), 1)
+
+        self.clock.time += 2
+        self.get_credentials()
+        assert_equal(self.count_token_requests(), 2)
+
+    def test_current_credentials_are_used_if_refresh_fails(self):
+        self.get_credentials()
+        self.clock.time += 3550
+        self.server.api.failures = 1
+
+        credentials = self.get_credentials()
+        assert_equal(credentials['access_token'], 'stub-token-1')
+        assert_equal(credentials['expires_in'], 50)
+
+        # Once they've expired, the error is raised.
+        self.clock.time += 60
+        self.server.api.failures = 1
+        with self.assertRaises(AssertionError):
+            self.get_credentials()
+
+    def test_concurrent_requests_share_one_refresh(self):
+        self.server.api.delay = 0.05
+        results = []
+
+        def get_credentials():
+            results.append(self.get_credentials()['access_token'])
+
+        threads = [threading.Thread(target=get_credentials) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_equal(results, ['stub-token-1'] * 5)
+        assert_equal(self.count_token_requests(), 1)
+
+        # When due for refresh, one caller refreshes while the others get
+        # the current credentials.
+        self.clock.time += 3550
+        results[:] = []
+        threads = [threading.Thread(target=get_credentials) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_in('stub-token-1', results)
+        assert_in('stub-token-2', results)
+        assert_equal(self.count_token_requests(), 2)
@@ -5,4 +5,5 @@ urlpatterns = patterns('',
     url(r'^create-dataset$', 'shareabouts_integration.views.create_dataset'),
     url(r'^authorize-project$', 'shareabouts_integration.views.authorize_project'),
     url(r'^oauth-credentials$', 'shareabouts_integration.views.oauth_credentials'),
+    url(r'^dataset-clone-status$', 'shareabouts_integration.views.dataset_clone_status'),
 )
\ No newline at end of file
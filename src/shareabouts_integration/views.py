@@ -6,9 +6,11 @@ from django.conf import settings
 from django.http import HttpResponse, Http404
 from django.contrib.auth.decorators import login_required
 from django.core.signing import Signer
-from planbox_data.models import Project
-from shareabouts_integration.models import Preauthorization
-from shareabouts_integration.oauth_dance import get_auth_header, get_authorization_code, get_credentials
+from planbox.outbound import http
+from planbox_data.models import Project, Section
+from shareabouts_integration import dataset_clones
+from shareabouts_integration.models import DatasetCloneJob, Preauthorization
+from shareabouts_integration.credentials import credential_cache
 
 from raven.contrib.django.models import client
 
@@ -17,6 +19,12 @@ def bad_request(errors):
     return HttpResponse(json.dumps(errors), status=400, content_type='application/json')
 
 
+def upstream_error():
+    return HttpResponse(json.dumps({'errors': 'Unknown upstream problem.'}),
+        status=502,
+        content_type='application/json')
+
+
 @login_required
 def oauth_credentials(request):
     """
@@ -48,13 +56,11 @@ def oauth_credentials(request):
         raise Http404
     username = auth.username
 
-    # Get the requested credentials from the Shareabouts API server
-    session = requests.session()
+    # Get the requested credentials from the Shareabouts API server, unless
+    # we already have some that are fresh enough.
     try:
-        auth_header = get_auth_header(client_id, client_secret, username)
-        authorization_code = get_authorization_code(session, host, client_id, auth_header)
-        credentials = get_credentials(session, host, authorization_code, client_id, client_secret)
-    except AssertionError:
+        credentials = credential_cache.get(host, client_id, client_secret, username)
+    except (AssertionError, requests.RequestException):
         if settings.DEBUG: raise
         client.captureException()
         return HttpResponse('Upstream error occurred.',
@@ -92,7 +98,10 @@ def create_dataset(request):
         settings.SHAREABOUTS_PASSWORD)
 
     # Try to retrieve the dataset.
-    ds_response = requests.get(dataset_url, auth=planbox_auth)
+    try:
+        ds_response = http.get(dataset_url, auth=planbox_auth)
+    except requests.RequestException:
+        return upstream_error()
 
     # If the dataset exists already; nothing to do, since we assume that a
     # CORS permission profile is already created.
@@ -104,16 +113,16 @@ def create_dataset(request):
     # If the dataset was not reported as existing but we didn't get a 404 back
     # then we have some error response and should send a 502 down.
     elif ds_response.status_code != 404:
-        return HttpResponse(
-            json.dumps({'errors': 'Unknown upstream problem.'}),
-            status=502,
-            content_type='application/json')
+        return upstream_error()
 
     # If the dataset did not exist, create it.
-    ds_response = requests.post(datasets_url,
-        data=json.dumps({'slug': slug, 'display_name': slug}),
-        headers={'Content-type': 'application/json'},
-        auth=planbox_auth)
+    try:
+        ds_response = http.post(datasets_url,
+            data=json.dumps({'slug': slug, 'display_name': slug}),
+            headers={'Content-type': 'application/json'},
+            auth=planbox_auth)
+    except requests.RequestException:
+        return upstream_error()
 
     # Check that we were successful in creating the dataset.
     if ds_response.status_code == 201:
@@ -135,9 +144,7 @@ def create_dataset(request):
             content_type='application/json')
 
     else:
-        return HttpResponse(json.dumps({'errors': 'Unknown upstream problem.'}),
-            status=502,
-            content_type='application/json')
+        return upstream_error()
 
 
 @login_required
@@ -185,4 +192,35 @@ def authorize_project(request):
     auth.username = owner_username
     auth.save()
 
-    return HttpResponse('', status=204)
\ No newline at end of file
+    return HttpResponse('', status=204)
+
+
+@login_required
+def dataset_clone_status(request):
+    """
+    Report the progress of cloning the Shareabouts dataset for the section
+    given in the 'section_id' query parameter. The editor polls this while a
+    cloned section's details have a 'dataset_status' of 'pending'.
+    """
+    section_id = request.GET.get('section_id')
+    try:
+        section = Section.objects.select_related('project').get(pk=section_id)
+    except (Section.DoesNotExist, ValueError):
+        return bad_request([{'section_id': 'Section does not exist.'}])
+
+    # Make sure the user has edit permission on the section's project.
+    if not section.project.editable_by(request.user):
+        return HttpResponse('Unauthorized', status=401)
+
+    job = section.dataset_clone_jobs.order_by('-created_at').first()
+    if job is None:
+        raise Http404
+
+    dataset_clones.restore_dataset_url(job)
+
+    return HttpResponse(json.dumps({
+            'status': job.status,
+            'attempts': job.attempts,
+            'dataset_url': job.dataset_url or None,
+        }),
+        content_type='application/json')
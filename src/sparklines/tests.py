@@ -1,3 +1,58 @@
+from datetime import datetime
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils.timezone import utc
+from django_nose.tools import assert_num_queries
+from nose.tools import assert_equal
 
-# Create your tests here.
+from planbox_data.models import Profile, Project
+
+
+class CountDataTests (TestCase):
+    def setUp(self):
+        cache.clear()
+        Project.objects.all().delete()
+        owner = Profile.objects.create(slug='mjumbewu')
+        # Monday, Monday, Wednesday of one week, then Monday of the next
+        for index, day in enumerate([5, 5, 7, 12]):
+            project = Project.objects.create(slug='plan-%s' % index, owner=owner)
+            Project.objects.filter(pk=project.pk).update(created_at=datetime(2014, 5, day, 13, 45, tzinfo=utc))
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        Profile.objects.all().delete()
+        cache.clear()
+
+    def get_tsv(self, **params):
+        url = reverse('admin-model-count-data', kwargs={'app_label': 'planbox_data', 'model': 'project'})
+        response = self.client.get(url, params)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_counts_are_cumulative_by_day(self):
+        response, content = self.get_tsv(createdfield='created_at')
+        assert_equal(response.status_code, 200)
+        assert_equal(content,
+            'date\tclose\n'
+            '2014-05-05T00:00:00\t2\n'
+            '2014-05-07T00:00:00\t3\n'
+            '2014-05-12T00:00:00\t4\n')
+
+    def test_counts_can_be_bucketed_by_week(self):
+        _, content = self.get_tsv(createdfield='created_at', bucket='week')
+        assert_equal(content,
+            'date\tclose\n'
+            '2014-05-05T00:00:00\t3\n'
+            '2014-05-12T00:00:00\t4\n')
+
+    def test_counts_are_cached(self):
+        self.get_tsv(createdfield='created_at')
+        with assert_num_queries(1):
+            # Only the content type is looked up
+            _, content = self.get_tsv(createdfield='created_at')
+        assert_equal(content.count('\n'), 4)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('admin-model-count-data', kwargs={'app_label': 'planbox_data', 'model': 'project'}),
+                                   {'createdfield': 'title'})
+        assert_equal(response.status_code, 400)
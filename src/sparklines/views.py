@@ -1,30 +1,126 @@
 from collections import defaultdict
+from datetime import datetime, date, timedelta
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import connection, models
+from django.db.models import Count
+from django.db.models.fields import FieldDoesNotExist
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 from django.views.generic import TemplateView
 
 
-def get_objects(request, app_label, model):
+# Seconds for which to cache the cumulative counts for a model
+SPARKLINES_CACHE_TIMEOUT = getattr(settings, 'SPARKLINES_CACHE_TIMEOUT', 5 * 60)
+
+# The sizes of the buckets that objects can be counted in. Weeks aren't
+# supported by the database backends' truncation, so they are built from days.
+BUCKETS = ('day', 'week', 'month', 'year')
+
+
+def get_model(app_label, model):
     model_type = ContentType.objects.get(app_label=app_label, model=model)
-    Model = model_type.model_class()
+    return model_type.model_class()
+
+
+def get_objects(request, app_label, model):
+    Model = get_model(app_label, model)
     return Model.objects.all()
 
 
+def get_bucket_sql(field, bucket):
+    """
+    Get the SQL (and its parameters) that truncates the given date or
+    datetime field to the given bucket size.
+    """
+    qn = connection.ops.quote_name
+    column = '%s.%s' % (qn(field.model._meta.db_table), qn(field.column))
+    if isinstance(field, models.DateTimeField):
+        tzname = timezone.get_current_timezone_name() if settings.USE_TZ else None
+        return connection.ops.datetime_trunc_sql(bucket, column, tzname)
+    else:
+        return connection.ops.date_trunc_sql(bucket, column), []
+
+
+def to_datetime(value):
+    # Depending on the backend, truncated values come back as datetimes,
+    # dates, or strings.
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return parse_datetime(value) or datetime.combine(parse_date(value), datetime.min.time())
+
+
+def get_bucket_counts(objects, field, bucket):
+    """
+    Count the objects in each bucket of the given field, in the database.
+    Returns a sorted list of (bucket start, count) pairs.
+    """
+    db_bucket = 'day' if bucket == 'week' else bucket
+    sql, params = get_bucket_sql(field, db_bucket)
+    rows = objects\
+        .exclude(**{field.name + '__isnull': True})\
+        .extra(select={'bucket': sql}, select_params=params)\
+        .values('bucket')\
+        .annotate(count=Count('pk'))\
+        .order_by()
+
+    counts = defaultdict(int)
+    for row in rows:
+        start = to_datetime(row['bucket'])
+        if bucket == 'week':
+            start -= timedelta(days=start.weekday())
+        counts[start] += row['count']
+    return sorted(counts.items())
+
+
+def get_cumulative_counts(app_label, model, field, bucket):
+    """
+    Get a sorted list of (bucket start, running total) pairs for the given
+    model, from the cache if it's there.
+    """
+    key = 'sparklines:cumulative:%s.%s:%s:%s' % (app_label, model, field.name, bucket)
+    cumulative = cache.get(key)
+    if cumulative is None:
+        cumulative = []
+        total = 0
+        for start, count in get_bucket_counts(field.model.objects.all(), field, bucket):
+            total += count
+            cumulative.append((start, total))
+        cache.set(key, cumulative, SPARKLINES_CACHE_TIMEOUT)
+    return cumulative
+
+
+def iter_tsv(cumulative):
+    yield 'date\tclose\n'
+    for dt, count in cumulative:
+        yield '%s\t%s\n' % (dt.strftime('%Y-%m-%dT%H:%M:%S'), count)
+
+
 def count_tsv(request, app_label, model):
-    objects = get_objects(request, app_label, model)
+    Model = get_model(app_label, model)
     created_field = request.GET.get('createdfield', None)
+    bucket = request.GET.get('bucket', 'day')
 
     cumulative = list()
 
     if created_field:
-        count = 0
-        for instance in objects.order_by(created_field):
-            count += 1
-            dt = getattr(instance, created_field)
-            cumulative.append((dt, count))
+        try:
+            field = Model._meta.get_field(created_field)
+        except FieldDoesNotExist:
+            return HttpResponseBadRequest('Unknown field: %s' % (created_field,))
+        if not isinstance(field, models.DateField):
+            return HttpResponseBadRequest('Not a date field: %s' % (created_field,))
+        if bucket not in BUCKETS:
+            return HttpResponseBadRequest('Bucket must be one of: %s' % (', '.join(BUCKETS),))
+
+        cumulative = get_cumulative_counts(app_label, model, field, bucket)
 
-    return HttpResponse('date\tclose\n' + '\n'.join(['\t'.join([dt.strftime('%Y-%m-%dT%H:%m:%S'), str(count)]) for (dt, count) in cumulative]),
+    return StreamingHttpResponse(iter_tsv(cumulative),
         content_type='text/tab-separated-values',
         status=200)
 
@@ -39,10 +135,11 @@ class CountView (TemplateView):
         context['objects'] = get_objects(self.request, app_label, model)
 
         context['created_field'] = self.request.GET.get('createdfield', None)
+        context['bucket'] = self.request.GET.get('bucket', 'day')
         return context
 
     def get(self, request, app_label, model):
         return super(CountView, self).get(request, app_label, model)
 
 
-count_view = CountView.as_view()
\ No newline at end of file
+count_view = CountView.as_view()